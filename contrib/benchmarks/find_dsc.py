@@ -0,0 +1,138 @@
+# Copyright (c) 2012-2013 Paul Tagliamonte <paultag@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Time the Repo.find_dsc lookup done after accepting a source upload, against
+the number of sources in a throwaway Sources.gz, with a full scan of the
+file and with the Sources index.
+
+    python contrib/benchmarks/find_dsc.py --sizes 1000 10000 50000
+"""
+
+from debile.master import reprepro
+from debile.master.reprepro import Repo
+
+from argparse import ArgumentParser
+from gzip import GzipFile
+
+import os
+import shutil
+import tempfile
+import time
+
+
+class Named(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class Source(object):
+    def __init__(self, name, version):
+        self.name = name
+        self.version = version
+        self.suite = Named("unstable")
+        self.component = Named("main")
+
+
+class Changes(dict):
+    def get_changes_file(self):
+        return None
+
+    def get_dsc(self):
+        return "%s_%s.dsc" % (self["Source"], self["Version"])
+
+    def get_package_name(self):
+        return self["Source"]
+
+
+def write_sources(root, count, version):
+    """
+    Write a Sources.gz of `count` sources, the last one at `version`, the
+    way reprepro would after including it.
+    """
+    path = os.path.join(root, "dists/unstable/main/source")
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    with GzipFile(os.path.join(path, "Sources.gz.new"), "w") as f:
+        for i in range(count):
+            name = "bench%d" % i
+            v = version if i == count - 1 else "1.0-1"
+            directory = reprepro.pool_directory("main", name)
+            f.write("Package: %s\nVersion: %s\nMaintainer: Bench "
+                    "<bench@example.org>\nArchitecture: any\nDirectory: %s\n"
+                    "Files:\n 00000000000000000000000000000000 1024 "
+                    "%s_%s.dsc\n 00000000000000000000000000000000 65536 "
+                    "%s_%s.tar.gz\n\n" % (name, v, directory, name, v,
+                                          name, v))
+    os.rename(os.path.join(path, "Sources.gz.new"),
+              os.path.join(path, "Sources.gz"))
+
+    directory = os.path.join(root, reprepro.pool_directory(
+        "main", "bench%d" % (count - 1)))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    open(os.path.join(directory, "bench%d_%s.dsc" % (count - 1, version)),
+         "w").close()
+
+
+def accept(repo, root, count, version):
+    name = "bench%d" % (count - 1)
+    repo.include = lambda dist, changes: write_sources(root, count, version)
+    repo.add_changes(Changes(distribution="unstable", Source=name,
+                             Version=version))
+    start = time.time()
+    repo.find_dsc(Source(name, version))
+    return time.time() - start
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 50000])
+    parser.add_argument("--accepts", type=int, default=5)
+    args = parser.parse_args()
+
+    print "%10s %12s %12s" % ("sources", "scan ms", "index ms")
+    for count in args.sizes:
+        root = tempfile.mkdtemp()
+        try:
+            write_sources(root, count, "1.0-1")
+            sources = os.path.join(root,
+                                   "dists/unstable/main/source/Sources.gz")
+
+            start = time.time()
+            for x in range(args.accepts):
+                for entry in reprepro.scan_sources(sources):
+                    if entry[0] == "bench%d" % (count - 1):
+                        break
+            scan = (time.time() - start) / args.accepts
+
+            repo = Repo(root)
+            repo.find_dsc(Source("bench0", "1.0-1"))
+            index = sum(accept(repo, root, count, "1.%d-1" % (x + 1))
+                        for x in range(args.accepts)) / args.accepts
+
+            print "%10d %12.2f %12.2f" % (count, scan * 1000, index * 1000)
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
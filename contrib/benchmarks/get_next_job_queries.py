@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Copyright (c) 2012-2013 Paul Tagliamonte <paultag@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Count the SQL statements and time spent per get_next_job call, against a
+throwaway SQLite database filled with build and binary check jobs.
+
+    python contrib/benchmarks/get_next_job_queries.py --sources 200
+"""
+
+from debile.master.utils import config, session, _init_sqlalchemy
+from debile.master.orm import (Person, Builder, Suite, Component, Arch, Check,
+                               Group, GroupSuite, Binary, Base, create_source,
+                               create_jobs)
+from debile.master.interface import NAMESPACE, DebileMasterInterface
+
+from argparse import ArgumentParser
+from datetime import datetime
+from sqlalchemy import event
+
+import shutil
+import tempfile
+import time
+
+
+def populate(count):
+    with session() as s:
+        Base.metadata.create_all(s.bind)
+
+        user = Person(name="Bench", email="bench@example.org")
+        s.add(Builder(name="bench", maintainer=user,
+                      last_ping=datetime.utcnow()))
+
+        gs = GroupSuite(group=Group(name="default", maintainer=user),
+                        suite=Suite(name="unstable"))
+        gs.components.append(Component(name="main"))
+        gs.arches.extend([Arch(name="source"), Arch(name="all"),
+                          Arch(name="amd64")])
+        gs.checks.extend([
+            Check(name="build", source=False, binary=False, build=True),
+            Check(name="lintian", source=True, binary=True, build=False),
+        ])
+        s.add(gs)
+
+        for i in range(count):
+            source = create_source({
+                "Source": "bench%d" % i,
+                "Version": "1.0-1",
+                "Architecture": "any all",
+                "Maintainer": "Bench <bench@example.org>",
+                "Uploaders": "Other <other@example.org>",
+            }, gs, gs.components[0], user, ["amd64"], "any")
+            source.directory = "pool/main/b/bench%d" % i
+            source.dsc_filename = "bench%d_1.0-1.dsc" % i
+            # Half of the sources already have their binaries, so the
+            # binary check jobs are ready too.
+            if i % 2:
+                s.add(Binary(source=source, arch=source.affinity,
+                             uploaded_at=datetime.utcnow()))
+            create_jobs(source)
+            s.add(source)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sources", type=int, default=200)
+    parser.add_argument("--calls", type=int, default=100)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        config['database'] = "sqlite:///%s/bench.db" % tmpdir
+        config['repo'] = {
+            "repo_path": "/srv/debile/pool/{name}",
+            "repo_url": "http://localhost/debile/pool/{name}",
+            "files_path": "/srv/debile/files/{name}",
+            "files_url": "http://localhost/debile/files/{name}",
+        }
+        _init_sqlalchemy(config)
+        populate(args.sources)
+
+        statements = [0]
+
+        with session() as s:
+            @event.listens_for(s.bind, "before_cursor_execute")
+            def count(*args):
+                statements[0] += 1
+
+        interface = DebileMasterInterface()
+        calls = 0
+        start = time.time()
+        for x in range(args.calls):
+            with session() as s:
+                NAMESPACE.session = s
+                NAMESPACE.machine = s.query(Builder).one()
+                job = interface.get_next_job(["unstable"], ["main"],
+                                             ["amd64"], ["build", "lintian"])
+                if job is None:
+                    break
+                calls += 1
+        elapsed = time.time() - start
+
+        print "%d get_next_job calls" % calls
+        print "%.1f statements per call" % (statements[0] / float(calls))
+        print "%.2f ms per call" % (elapsed * 1000 / calls)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# Copyright (c) 2012-2013 Paul Tagliamonte <paultag@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Compare the size and the encode/decode time of get_next_job responses in
+XML-RPC and JSON-RPC.
+
+    python contrib/benchmarks/rpc_encoding.py --rounds 1000
+"""
+
+from debile.master.utils import config, session, _init_sqlalchemy
+from debile.master.orm import Builder
+from debile.master.interface import NAMESPACE, DebileMasterInterface
+from debile.utils import jsonrpc
+
+from argparse import ArgumentParser
+from get_next_job_queries import populate
+
+import xmlrpclib
+import shutil
+import tempfile
+import time
+
+
+def xml_encode(job):
+    return xmlrpclib.dumps((job,), methodresponse=True, allow_none=True)
+
+
+def xml_decode(data):
+    return xmlrpclib.loads(data)[0][0]
+
+
+def json_encode(job):
+    return jsonrpc.dumps({"jsonrpc": "2.0", "result": job, "id": None})
+
+
+def json_decode(data):
+    return jsonrpc.loads_response(data)
+
+
+def measure(function, values, rounds):
+    start = time.time()
+    for x in range(rounds):
+        for value in values:
+            function(value)
+    return (time.time() - start) * 1000000 / (rounds * len(values))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        config['database'] = "sqlite:///%s/bench.db" % tmpdir
+        config['repo'] = {
+            "repo_path": "/srv/debile/pool/{name}",
+            "repo_url": "http://localhost/debile/pool/{name}",
+            "files_path": "/srv/debile/files/{name}",
+            "files_url": "http://localhost/debile/files/{name}",
+        }
+        _init_sqlalchemy(config)
+        populate(args.jobs)
+
+        interface = DebileMasterInterface()
+        with session() as s:
+            NAMESPACE.session = s
+            NAMESPACE.machine = s.query(Builder).one()
+            jobs = interface.get_next_jobs(["unstable"], ["main"], ["amd64"],
+                                           ["build", "lintian"], args.jobs)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print "%d get_next_job responses, %d rounds" % (len(jobs), args.rounds)
+    print "%-10s %8s %12s %12s" % ("", "bytes", "encode (us)", "decode (us)")
+    for name, encode, decode in [("xml-rpc", xml_encode, xml_decode),
+                                 ("json-rpc", json_encode, json_decode)]:
+        encoded = [encode(x) for x in jobs]
+        print "%-10s %8d %12.1f %12.1f" % (
+            name, sum(len(x) for x in encoded) / len(encoded),
+            measure(encode, jobs, args.rounds),
+            measure(decode, encoded, args.rounds))
+
+
+if __name__ == '__main__':
+    main()
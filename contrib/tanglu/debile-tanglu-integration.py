@@ -113,6 +113,7 @@ class ArchiveDebileBridge:
                     job.builder = None
                     job.assigned_at = None
                     job.finished_at = None
+                    job.update_state()
 
             # Actually remove jobs marked for deletion above.
             session.commit()
@@ -137,6 +138,7 @@ class ArchiveDebileBridge:
                 check = session.query(Check).filter(Check.build == True).one()
                 job = Job(check=check, arch=arch_all,
                           source=source, binary=None)
+                job.update_state()
                 session.add(job)
 
         for arch in arches:
@@ -255,8 +257,10 @@ class ArchiveDebileBridge:
                                 break
                         if job.dose_report != dose_report:
                             job.dose_report = dose_report
+                            job.update_state()
                     elif job.dose_report != None:
                         job.dose_report = None
+                        job.update_state()
                         print("Unblocked job %s (%s) %s" %
                               (job.source.name, job.source.version, job.name))
                 except Exception as ex:
@@ -305,6 +309,7 @@ class ArchiveDebileBridge:
                 job.builder = None
                 job.assigned_at = None
                 job.finished_at = None
+                job.update_state()
 
             cutoff = datetime.utcnow() - timedelta(days=7)
             jobs = s.query(Job).join(Job.check).filter(
@@ -322,6 +327,7 @@ class ArchiveDebileBridge:
                 job.builder = None
                 job.assigned_at = None
                 job.finished_at = None
+                job.update_state()
 
     def clean_results(self):
         path = None
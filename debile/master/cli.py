@@ -39,6 +39,18 @@ def init():
     main(args, config)
 
 
+def upgrade():
+    parser = ArgumentParser(description="Debile master database upgrade")
+    parser.add_argument("--config", action="store", dest="config", default=None,
+                        help="Path to the master.yaml config file.")
+
+    args = parser.parse_args()
+    config = init_master(args.config)
+
+    from debile.master.upgrade import main
+    main(args, config)
+
+
 def process_incoming():
     parser = ArgumentParser(description="Debile master incoming handling")
     parser.add_argument("--config", action="store", dest="config", default=None,
@@ -49,6 +61,14 @@ def process_incoming():
                         help="Do not process *.dud files.")
     parser.add_argument("--no-changes", action="store_false", dest="changes",
                         help="Do not process *.changes files.")
+    parser.add_argument("--jobs", action="store", dest="jobs", type=int,
+                        default=1,
+                        help="Number of processes handling the uploads.")
+    parser.add_argument("--watch", action="store_true", dest="watch",
+                        help="Keep running and process uploads as they arrive.")
+    parser.add_argument("--rescan", action="store", dest="rescan", type=int,
+                        default=300,
+                        help="Seconds between two full passes in --watch mode.")
     parser.add_argument("directory", action="store",
                         help="Directry to process.")
 
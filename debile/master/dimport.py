@@ -23,6 +23,7 @@ from datetime import datetime
 from sqlalchemy.sql import exists
 
 from debile.master.utils import session
+from debile.master import lookup
 from debile.master.orm import (Person, Builder, Suite, Component, Arch, Check,
                                Group, GroupSuite, Base)
 
@@ -40,6 +41,8 @@ def main(args, config):
     checks = obj.pop("Checks", [])
     groups = obj.pop("Groups", [])
 
+    lookup.invalidate()
+
     with session() as s:
         Base.metadata.create_all(s.bind)
 
@@ -76,22 +79,17 @@ def main(args, config):
             s.add(group)
 
             for suite in suites:
-                gs = GroupSuite(group=group, suite=s.query(Suite).filter_by(
-                    name=suite['suite']).one())
+                gs = GroupSuite(group=group, suite=lookup.get(
+                    s, Suite, suite['suite']))
 
                 for component in suite.pop('components'):
-                    component = s.query(Component).filter_by(
-                        name=component
-                    ).one()
-                    gs.components.append(component)
+                    gs.components.append(lookup.get(s, Component, component))
 
                 for arch in ["source", "all"] + suite.pop('arches'):
-                    arch = s.query(Arch).filter_by(name=arch).one()
-                    gs.arches.append(arch)
+                    gs.arches.append(lookup.get(s, Arch, arch))
 
                 for check in suite.pop('checks'):
-                    check = s.query(Check).filter_by(name=check).one()
-                    gs.checks.append(check)
+                    gs.checks.append(lookup.get(s, Check, check))
 
                 s.add(gs)
 
@@ -0,0 +1,181 @@
+# Copyright (c) 2012-2013 Paul Tagliamonte <paultag@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from sqlalchemy import event
+from sqlalchemy.orm import aliased
+
+from debile.master.utils import session
+from debile.master.orm import (Suite, Component, Arch, Check, GroupSuite,
+                               Source, Job)
+
+from itertools import product
+
+import heapq
+import logging
+import threading
+
+
+class Dispatcher(object):
+    """
+    In-memory priority queues of ready jobs, one per (suite, component, arch,
+    check) a builder can ask for. Jobs for the "source" and "all" arches are
+    queued under the affinity arch of their source.
+
+    The queues are only a hint: a popped job still has to be claimed in the
+    database, and anything that became ready behind our back (for example
+    by debile-incoming) is picked up by the next rebuild.
+    """
+
+    def __init__(self, interval=60):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._wakeup = threading.Event()
+
+    @staticmethod
+    def _entry(job):
+        arch = job.arch.name
+        if arch in ["source", "all"]:
+            arch = job.source.affinity.name
+        key = (job.source.suite.name, job.source.component.name,
+               arch, job.check.name)
+        return key, (job.assigned_count, job.source.uploaded_at, job.id)
+
+    def push(self, key, priority):
+        with self._lock:
+            heapq.heappush(self._queues.setdefault(key, []), priority)
+
+    def push_after_commit(self, session, job):
+        """
+        Queue `job` once the transaction making it ready is committed.
+        """
+        entries = [self._entry(job)]
+
+        def push(session):
+            while entries:
+                self.push(*entries.pop())
+        event.listen(session, "after_commit", push)
+
+    def pop(self, suites, components, arches, checks):
+        """
+        Remove and return the id of the most important job matching the
+        request, or None if there is none queued.
+        """
+        with self._lock:
+            best = None
+            for key in product(suites, components, arches, checks):
+                queue = self._queues.get(key)
+                if queue and (best is None or queue[0] < best[0]):
+                    best = queue
+            if best is None:
+                return None
+            return heapq.heappop(best)[-1]
+
+    def candidates(self, suites, components, arches, checks):
+        while True:
+            job_id = self.pop(suites, components, arches, checks)
+            if job_id is None:
+                return
+            yield job_id
+
+    def rebuild(self, s):
+        affinity = aliased(Arch)
+        jobs = s.query(
+            Suite.name, Component.name, Arch.name, affinity.name, Check.name,
+            Job.assigned_count, Source.uploaded_at, Job.id,
+        ).select_from(Job).join(Job.source).join(Source.group_suite).join(
+            GroupSuite.suite
+        ).join(Source.component).join(Job.arch).join(
+            affinity, Source.affinity
+        ).join(Job.check).filter(
+            Job.state == "ready",
+        )
+
+        queues = {}
+        for suite, component, arch, affinity_, check, count, at, id in jobs:
+            if arch in ["source", "all"]:
+                arch = affinity_
+            queues.setdefault((suite, component, arch, check), []).append(
+                (count, at, id))
+
+        for queue in queues.values():
+            heapq.heapify(queue)
+
+        with self._lock:
+            self._queues = queues
+
+    def request_rebuild(self):
+        self._wakeup.set()
+
+    def rebuild_after_commit(self, session):
+        event.listen(session, "after_commit",
+                     lambda session: self.request_rebuild())
+
+    def _run(self):
+        logger = logging.getLogger('debile')
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                with session() as s:
+                    self.rebuild(s)
+            except:
+                logger.error("Error while rebuilding the dispatch queues",
+                             exc_info=True)
+
+    def start(self):
+        with session() as s:
+            self.rebuild(s)
+
+        thread = threading.Thread(target=self._run, name="dispatcher")
+        thread.daemon = True
+        thread.start()
+
+
+class Notifier(object):
+    """
+    Wakes up the get_next_job calls waiting for a job to become ready.
+
+    Only jobs made ready by this process are noticed, so waiters still
+    need to look at the database now and then.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.generation = 0
+
+    def listen(self, callback):
+        """
+        Have `callback` called after every notification.
+        """
+        with self._lock:
+            if callback not in self._listeners:
+                self._listeners.append(callback)
+
+    def notify(self):
+        with self._lock:
+            self.generation += 1
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback()
+
+    def notify_after_commit(self, session):
+        event.listen(session, "after_commit", lambda session: self.notify())
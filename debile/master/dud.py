@@ -32,10 +32,11 @@
 #   OTHER DEALINGS IN THE SOFTWARE.
 # -*- coding: utf-8 -*-
 
-from debile.utils.commands import run_command
+from debile.master.signatures import verify, SignatureError
+from debile.utils import checksums
+from debile.utils.checksums import ChecksumError
 from debile.utils import deb822
 import firehose.model
-import hashlib
 import os.path
 import sys
 
@@ -143,47 +144,15 @@ class Dud(object):
         """
         Validate the GPG signature of a .changes file.
         """
-
-        (gpg_output, gpg_output_stderr, exit_status) = run_command([
-            "gpg", "--batch", "--status-fd", "1",
-            "--no-default-keyring", "--keyring", keyring,
-            "--verify", self.get_dud_file(),
-        ])
-
-        if exit_status == -1:
-            raise DudFileException(
-                "Unknown problem while verifying signature")
-
-        # contains verbose human readable GPG information
-        if self.is_python3:
-            gpg_output_stderr = str(gpg_output_stderr, encoding='utf8')
-
-        if self.is_python3:
-            gpg_output = gpg_output.decode(encoding='UTF-8')
-
-        if gpg_output.count('[GNUPG:] GOODSIG'):
-            pass
-        elif gpg_output.count('[GNUPG:] BADSIG'):
-            raise DudFileException("Bad signature")
-        elif gpg_output.count('[GNUPG:] ERRSIG'):
-            raise DudFileException("Error verifying signature")
-        elif gpg_output.count('[GNUPG:] NODATA'):
-            raise DudFileException("No signature on")
-        else:
-            raise DudFileException(
-                "Unknown problem while verifying signature"
-            )
-
-        key = None
-        for line in gpg_output.split("\n"):
-            if line.startswith('[GNUPG:] VALIDSIG'):
-                key = line.split()[2]
-        return key
+        try:
+            return verify(self.get_dud_file(), keyring)
+        except SignatureError as e:
+            raise DudFileException(str(e))
 
     def validate_checksums(self, check_hash="md5"):
         """
-        Validate checksums for a package, using ``check_hack``'s type
-        to validate the package.
+        Validate all the checksums given for the files, reading each file
+        once. The ``check_hash`` checksum has to be given for every file.
 
         Valid ``check_hash`` types:
 
@@ -192,38 +161,7 @@ class Dud(object):
             * md5
             * md5sum
         """
-        for filename in self.get_files():
-            if check_hash == "sha1":
-                hash_type = hashlib.sha1()
-                checksums = self.get("Checksums-Sha1")
-                field_name = "sha1"
-            elif check_hash == "sha256":
-                hash_type = hashlib.sha256()
-                checksums = self.get("Checksums-Sha256")
-                field_name = "sha256"
-            elif check_hash == "md5":
-                hash_type = hashlib.md5()
-                checksums = self.get("Files")
-                field_name = "md5sum"
-
-            for changed_files in checksums:
-                if changed_files['name'] == os.path.basename(filename):
-                    break
-            else:
-                assert(
-                    "get_files() returns different files than Files: knows?!")
-
-            with open(filename, "rb") as fc:
-                for chunk in iter(
-                    (lambda: fc.read(128 * hash_type.block_size)),
-                    b''
-                ):
-                    hash_type.update(chunk)
-
-            if not hash_type.hexdigest() == changed_files[field_name]:
-                raise DudFileException(
-                    "Checksum mismatch for file %s: %s != %s" % (
-                        filename,
-                        hash_type.hexdigest(),
-                        changed_files[field_name]
-                    ))
+        try:
+            checksums.validate(self._data, self._directory, check_hash)
+        except ChecksumError as e:
+            raise DudFileException(str(e))
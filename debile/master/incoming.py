@@ -20,19 +20,243 @@
 
 from debile.master.incoming_dud import process_dud
 from debile.master.incoming_changes import process_changes
-from debile.master.utils import session
+from debile.master.changes import Changes
+from debile.master.dud import Dud
+from debile.master.signatures import verify_many
+from debile.master.utils import (Session, session, emit, defer_emits,
+                                 take_deferred_emits)
+from debile.master import lookup
 
+from importlib import import_module
+
+import multiprocessing
 import fnmatch
+import traceback
+import time
 import os
 
 
-def main(args, config):
+def arrived(path):
+    """
+    Whether all the files listed in the .changes or .dud `path` are there
+    with their full size.
+    """
+    try:
+        upload = (Dud if path.endswith(".dud") else Changes)(path)
+        files = upload["Files"]
+    except Exception:
+        return False
+
+    directory = os.path.dirname(os.path.abspath(path))
+    for f in files:
+        try:
+            if os.path.getsize(os.path.join(directory, f['name'])) != int(f['size']):
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def process_upload(args, config, path):
+    if fnmatch.fnmatch(path, "*.dud"):
+        with session() as s:
+            process_dud(config, s, path)
+    else:
+        with session() as s:
+            process_changes(args.group, config, s, path)
+
+
+def _process_uploads(args, config, paths):
+    """
+    Process the uploads in order, carrying on after the ones failing.
+    Returns the uploads that failed.
+    """
+    failed = []
+    for path in paths:
+        try:
+            process_upload(args, config, path)
+        except Exception:
+            print "ERROR: Failed to process {path}:".format(path=path)
+            traceback.print_exc()
+            failed.append(path)
+    return failed
+
+
+def _process_lane(task):
+    """
+    Process the uploads of a lane in order, in a worker process.
+    """
+    args, config, paths = task
+    failed = _process_uploads(args, config, paths)
+    return failed, take_deferred_emits()
+
+
+def _lanes(args, paths):
+    """
+    Split the .changes files by group, each group has a repository of its
+    own with a single reprepro writer.
+    """
+    lanes = {}
+    for path in paths:
+        try:
+            group = Changes(path).get('X-Debile-Group', args.group)
+        except Exception:
+            # process_changes() will complain about it.
+            group = None
+        lanes.setdefault(group, []).append(path)
+    return lanes.values()
+
+
+def _process_parallel(args, config, paths):
+    """
+    Returns the uploads that failed.
+    """
+    changes = [x for x in paths if x.endswith(".changes")]
+    duds = [x for x in paths if x.endswith(".dud")]
+
+    # The workers must not share the connections of this process.
+    Session.kw['bind'].dispose()
+    pool = multiprocessing.Pool(args.jobs, initializer=defer_emits)
+    failed = []
+    try:
+        # All the .changes go first, the .dud of a job might be waiting
+        # for the binaries of its build.
+        for tasks, chunksize in [
+            ([(args, config, lane) for lane in _lanes(args, changes)], 1),
+            ([(args, config, [x]) for x in duds], 16),
+        ]:
+            for lane_failed, messages in pool.imap_unordered(
+                    _process_lane, tasks, chunksize):
+                failed.extend(lane_failed)
+                for message in messages:
+                    emit(*message)
+    finally:
+        pool.close()
+        pool.join()
+    return failed
+
+
+def process_directory(args, config, check=None, failed=None):
+    """
+    Process the uploads in args.directory, or only the ones passing
+    `check(path)` when given. With args.jobs above 1, they are processed
+    by that many worker processes. When a `failed` list is given, the
+    uploads failing to process are added to it instead of stopping the
+    others (worker processes always carry on).
+    """
     abspath = os.path.abspath(args.directory)
-    for fp in os.listdir(abspath):
+    paths = []
+    for fp in sorted(os.listdir(abspath)):
         path = os.path.join(abspath, fp)
-        if args.dud and fnmatch.fnmatch(path, "*.dud"):
-            with session() as s:
-                process_dud(config, s, path)
-        if args.changes and fnmatch.fnmatch(path, "*.changes"):
-            with session() as s:
-                process_changes(args.group, config, s, path)
+        if not (args.dud and fnmatch.fnmatch(path, "*.dud") or
+                args.changes and fnmatch.fnmatch(path, "*.changes")):
+            continue
+        if check is not None and not check(path):
+            continue
+        paths.append(path)
+
+    if not paths:
+        return
+
+    start = time.time()
+    try:
+        # Check all the signatures with one gpg, processing hits the cache.
+        verify_many(paths, config['keyrings']['pgp'])
+    except Exception:
+        # Each upload is still checked on its own while processing it.
+        print "WARNING: Failed to check the signatures in one go:"
+        traceback.print_exc()
+
+    if getattr(args, 'jobs', 1) > 1 and len(paths) > 1:
+        lost = _process_parallel(args, config, paths)
+        if failed is not None:
+            failed.extend(lost)
+    elif failed is None:
+        for path in paths:
+            process_upload(args, config, path)
+    else:
+        failed.extend(_process_uploads(args, config, paths))
+    elapsed = time.time() - start
+
+    print "Processed {count} uploads in {elapsed:.1f}s ({rate:.1f}/s)".format(
+        count=len(paths), elapsed=elapsed, rate=len(paths) / max(elapsed, 0.001))
+
+
+def _safe_process_directory(args, config, check=None, failed=None):
+    try:
+        process_directory(args, config, check, failed)
+    except Exception:
+        print "ERROR: Failed to process the uploads:"
+        traceback.print_exc()
+
+
+def _scan(args, config, failures):
+    """
+    Process the uploads that have fully arrived. `failures` maps the
+    uploads that failed before to their mtime back then, they are left
+    alone until they change.
+    """
+    mtimes = {}
+
+    def check(path):
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return False
+        if failures.get(path) == mtime or not arrived(path):
+            return False
+        mtimes[path] = mtime
+        return True
+
+    failed = []
+    _safe_process_directory(args, config, check, failed)
+
+    for path in list(failures):
+        if not os.path.exists(path):
+            del failures[path]
+    for path in failed:
+        failures[path] = mtimes[path]
+
+
+def watch(args, config):
+    """
+    Process the uploads as soon as all of their files have arrived, and
+    look for the ones missed every args.rescan seconds. Without pyinotify,
+    only the periodic rescans are done. Uploads failing to process are
+    only tried again once they change.
+    """
+    try:
+        pyinotify = import_module("pyinotify")
+    except ImportError:
+        pyinotify = None
+        print "pyinotify is not available, rescanning every %d seconds" % (
+            args.rescan)
+
+    notifier = None
+    if pyinotify is not None:
+        manager = pyinotify.WatchManager()
+        manager.add_watch(os.path.abspath(args.directory),
+                          pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO)
+        notifier = pyinotify.Notifier(manager, lambda event: None)
+
+    failures = {}
+    while True:
+        # Pick up renamed suites, arches and the like.
+        lookup.invalidate()
+        _scan(args, config, failures)
+
+        rescan_at = time.time() + args.rescan
+        while time.time() < rescan_at:
+            timeout = rescan_at - time.time()
+            if notifier is None:
+                time.sleep(max(timeout, 0))
+            elif notifier.check_events(max(timeout, 0) * 1000):
+                notifier.read_events()
+                notifier.process_events()
+                _scan(args, config, failures)
+
+
+def main(args, config):
+    if getattr(args, 'watch', False):
+        return watch(args, config)
+    process_directory(args, config)
@@ -21,10 +21,11 @@
 import os
 import re
 
-from debian.debian_support import version_compare
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
 from debile.master.utils import emit
+from debile.master import lookup
+from debile.master.versions import version_sort_key
 from debile.master.changes import Changes, ChangesFileException
 from debile.master.reprepro import Repo, RepoSourceAlreadyRegistered, RepoPackageNotFound
 from debile.master.orm import (Person, Builder, Suite, Component, Arch, Group,
@@ -104,9 +105,9 @@ def accept_source_changes(default_group, config, session, changes, user):
     suite = changes['Distribution']
 
     try:
-        group_suite = session.query(GroupSuite).join(GroupSuite.group).join(GroupSuite.suite).filter(
+        group_suite = session.query(GroupSuite).join(GroupSuite.group).filter(
             Group.name == group,
-            Suite.name == suite,
+            GroupSuite.suite_id.in_(lookup.ids(session, Suite, [suite])),
         ).one()
     except MultipleResultsFound:
         return reject_changes(session, changes, "internal-error")
@@ -135,9 +136,10 @@ def accept_source_changes(default_group, config, session, changes, user):
         Source.group_suite == group_suite,
         Source.name == dsc['Source'],
     )
-    for oldsource in oldsources:
-        if version_compare(oldsource.version, dsc['Version']) > 0:
-            return reject_changes(session, changes, "newer-source-already-in-suite")
+    if session.query(oldsources.filter(
+        Source.version_key > version_sort_key(dsc['Version'])
+    ).exists()).scalar():
+        return reject_changes(session, changes, "newer-source-already-in-suite")
 
     # Drop any old jobs that are still pending.
     for oldsource in oldsources:
@@ -146,10 +148,11 @@ def accept_source_changes(default_group, config, session, changes, user):
                 session.delete(job)
             elif job.failed is None:
                 job.failed = True
+                job.update_state()
         if not any(oldsource.jobs):
             session.delete(oldsource)
 
-    component = session.query(Component).filter_by(name="main").one()
+    component = lookup.get(session, Component, "main")
 
     if 'Build-Architecture-Indep' in dsc:
         valid_affinities = dsc['Build-Architecture-Indep']
@@ -206,7 +209,8 @@ def accept_binary_changes(default_group, config, session, changes, builder):
         return reject_changes(session, changes, "wrong-builder")
 
     anames = changes.get("Architecture").split(None)
-    arches = session.query(Arch).filter(Arch.name.in_(anames)).all()
+    arches = [session.query(Arch).get(x)
+              for x in lookup.ids(session, Arch, anames)]
 
     binaries = {}
     for arch in arches:
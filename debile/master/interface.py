@@ -24,17 +24,93 @@ from debile.master.orm import (Person, Builder, Suite, Component, Arch, Check,
                                job_dependencies)
 from debile.master.keyrings import import_pgp, import_ssl, clean_ssl_keyring
 from debile.master.utils import emit
+from debile.master.dispatch import Notifier
+from debile.master.scheduler import DefaultPolicy
+from debile.master import lookup
 
-from debian.debian_support import Version
+from sqlalchemy.ext import baked
+from sqlalchemy.sql import bindparam
 from datetime import datetime, timedelta
 
 import threading
 import logging
+import time
 
 
 NAMESPACE = threading.local()
 
 
+bakery = baked.bakery()
+
+# Most jobs get_next_jobs hands out at once.
+MAX_JOBS_PER_CALL = 100
+
+# Number of jobs rerun_jobs resets per UPDATE statement. Everything is
+# committed at the end of the request, like any other call.
+RERUN_CHUNK = 1000
+
+
+def _listize(value):
+    if isinstance(value, (list, tuple)):
+        return value
+    return [value]
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value
+    value = str(value)
+    for fmt in ["%Y%m%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError("Invalid date %s." % value)
+
+
+def _load_job(session, job_id, populate_existing=False):
+    """
+    Load a job with everything Job.debilize() needs. The query is baked,
+    so its (large) eager loading SQL is only compiled once.
+    """
+    query = bakery(lambda s: s.query(Job).options(*Job.debilize_options()))
+    query += lambda q: q.filter(Job.id == bindparam('job_id'))
+    if populate_existing:
+        query += lambda q: q.populate_existing()
+    return query(session).params(job_id=job_id).one_or_none()
+
+
+class LongPoll(object):
+    """
+    A request the server can put aside while a call waits for work. Instead
+    of sleeping, the call parks the request by setting `recheck_at`, and is
+    made again at that time, or as soon as `notifier` moves past
+    `generation`. `deadline` is kept from one try to the next.
+    """
+
+    def __init__(self):
+        self.deadline = None
+        self.recheck_at = None
+        self.notifier = None
+        self.generation = None
+        # Kept by metrics.rpc across the tries of the call.
+        self.started_at = None
+        self.handling = 0.0
+
+    @property
+    def parked(self):
+        return self.recheck_at is not None
+
+    def park(self, notifier, generation, recheck_at):
+        self.notifier = notifier
+        self.generation = generation
+        self.recheck_at = recheck_at
+
+    def due(self, now):
+        return now >= self.recheck_at or \
+            self.notifier.generation != self.generation
+
+
 def generic_method(fn):
     def _(*args, **kwargs):
         try:
@@ -80,9 +156,20 @@ class DebileMasterInterface(object):
 
     shutdown_request = False
 
-    def __init__(self, ssl_keyring=None, pgp_keyring=None):
+    # How often a waiting get_next_job looks for jobs made ready by other
+    # processes, like debile-incoming.
+    recheck_interval = 10
+
+    def __init__(self, ssl_keyring=None, pgp_keyring=None, dispatcher=None,
+                 lease=None, policy=None):
         self.ssl_keyring = ssl_keyring
         self.pgp_keyring = pgp_keyring
+        self.dispatcher = dispatcher
+        # How long a builder may go without calling heartbeat_job before
+        # its jobs are handed to somebody else, as a timedelta.
+        self.lease = lease
+        self.notifier = Notifier()
+        self.policy = policy or DefaultPolicy()
 
     # Simple stuff.
 
@@ -103,60 +190,224 @@ class DebileMasterInterface(object):
     # The following trio of methods handle the job control.
 
     @builder_method
-    def get_next_job(self, suites, components, arches, checks):
-        NAMESPACE.machine.last_ping = datetime.utcnow()
-
-        if self.__class__.shutdown_request:
+    def get_next_job(self, suites, components, arches, checks, wait=0):
+        jobs = self.get_next_jobs(suites, components, arches, checks, 1, wait)
+        if not jobs:
             return None
+        return jobs[0]
+
+    @builder_method
+    def get_next_jobs(self, suites, components, arches, checks, limit,
+                      wait=0):
+        """
+        Assign up to `limit` jobs to the calling builder at once, but no
+        more than MAX_JOBS_PER_CALL. If there is nothing to do, wait up to
+        `wait` seconds for a job to show up.
+        """
+        NAMESPACE.machine.last_ping = datetime.utcnow()
+        limit = max(1, min(int(limit), MAX_JOBS_PER_CALL))
 
         arches = [x for x in arches if x not in ["source", "all"]]
-        job = NAMESPACE.session.query(Job).join(Job.source).join(Source.group_suite).filter(
-            ~Job.depedencies.any(),
-            Job.dose_report == None,
-            Job.assigned_at == None,
-            Job.finished_at == None,
-            Job.failed.is_(None),
-            GroupSuite.suite.has(Suite.name.in_(suites)),
-            Source.component.has(Component.name.in_(components)),
-            (Job.arch.has(Arch.name.in_(arches)) |
-             (Job.arch.has(Arch.name.in_(["source", "all"])) &
-              Source.affinity.has(Arch.name.in_(arches)))),
-            Job.check.has(Check.name.in_(checks)),
-        ).order_by(
-            Job.assigned_count.asc(),
-            Source.uploaded_at.asc(),
-        ).first()
 
-        if job is None:
+        # The request is parked in the server while waiting, so that it
+        # holds neither a thread nor a transaction. Calls made outside of
+        # the server (or in a multicall) can't wait.
+        poll = getattr(NAMESPACE, 'poll', None)
+        if poll is not None and poll.deadline is None:
+            poll.deadline = time.time() + wait
+
+        generation = self.notifier.generation
+
+        jobs = []
+        if not self.__class__.shutdown_request:
+            if self.dispatcher is not None:
+                jobs += self._dispatch_jobs(suites, components, arches,
+                                            checks, limit)
+            if len(jobs) < limit:
+                jobs += self._query_jobs(suites, components, arches,
+                                         checks, limit - len(jobs))
+
+        now = time.time()
+        if not jobs and poll is not None and now < poll.deadline and \
+                not self.__class__.shutdown_request:
+            poll.park(self.notifier, generation,
+                      min(poll.deadline, now + self.recheck_interval))
+            return []
+
+        jobs = [job.debilize() for job in jobs]
+        for job in jobs:
+            emit('start', 'job', job)
+
+        return jobs
+
+    def _claim_job(self, job_id):
+        """
+        Assign the job to the calling builder, unless somebody else got to
+        it first. Returns the job, or None if it is no longer ready.
+        """
+        jobs = Job.__table__
+        now = datetime.utcnow()
+        claimed = NAMESPACE.session.execute(jobs.update().where(
+            (jobs.c.id == job_id) & (jobs.c.state == "ready")
+        ).values(
+            state="assigned",
+            assigned_count=jobs.c.assigned_count + 1,
+            assigned_at=now,
+            lease_expires_at=now + self.lease if self.lease else None,
+            builder_id=NAMESPACE.machine.id,
+        )).rowcount
+        if not claimed:
             return None
+        return _load_job(NAMESPACE.session, job_id, populate_existing=True)
+
+    def _dispatch_jobs(self, suites, components, arches, checks, limit):
+        jobs = []
+        for job_id in self.dispatcher.candidates(suites, components, arches, checks):
+            # The queues might be out of date, _claim_job only takes the
+            # job if it is still ready.
+            job = self._claim_job(job_id)
+            if job is not None:
+                jobs.append(job)
+                if len(jobs) == limit:
+                    break
+        return jobs
+
+    def _query_jobs(self, suites, components, arches, checks, limit,
+                    attempts=10):
+        s = NAMESPACE.session
+        suite_ids = lookup.ids(s, Suite, suites)
+        component_ids = lookup.ids(s, Component, components)
+        arch_ids = lookup.ids(s, Arch, arches)
+        indep_ids = lookup.ids(s, Arch, ["source", "all"])
+        check_ids = lookup.ids(s, Check, checks)
+        if not (suite_ids and component_ids and arch_ids and check_ids):
+            return []
+
+        candidates = s.query(Job.id).join(Job.source).join(Source.group_suite).filter(
+            Job.state == "ready",
+            GroupSuite.suite_id.in_(suite_ids),
+            Source.component_id.in_(component_ids),
+            (Job.arch_id.in_(arch_ids) |
+             (Job.arch_id.in_(indep_ids) &
+              Source.affinity_id.in_(arch_ids))),
+            Job.check_id.in_(check_ids),
+        )
+
+        jobs = []
+        for group_suite_id in self.policy.group_suites(NAMESPACE.session, candidates):
+            query = candidates
+            if group_suite_id is not None:
+                query = query.filter(Source.group_suite_id == group_suite_id)
+            query = query.order_by(*self.policy.order())
+
+            if NAMESPACE.session.bind.dialect.name == "postgresql":
+                # Concurrent callers skip the rows locked by each other
+                # instead of all queueing up for the same job.
+                query = query.with_for_update(skip_locked=True, of=Job)
+
+            # Without SKIP LOCKED two callers can still pick the same job,
+            # the loser of the conditional update just tries again.
+            for attempt in range(attempts):
+                job_ids = query.limit(limit - len(jobs)).all()
+                if not job_ids:
+                    break
+                for job_id, in job_ids:
+                    job = self._claim_job(job_id)
+                    if job is not None:
+                        jobs.append(job)
+                        if group_suite_id is not None:
+                            self.policy.served(group_suite_id)
+                if len(jobs) == limit:
+                    return jobs
+        return jobs
+
+    def _requeue_after_commit(self, job):
+        """
+        Let the dispatcher and any waiting builder know about `job` once it
+        is committed, if it is ready.
+        """
+        if job.state != "ready":
+            return
+        if self.dispatcher is not None:
+            self.dispatcher.push_after_commit(NAMESPACE.session, job)
+        self.notifier.notify_after_commit(NAMESPACE.session)
 
-        job.assigned_count += 1
-        job.assigned_at = datetime.utcnow()
-        job.builder = NAMESPACE.machine
+    def _owned_job(self, job_id):
+        """
+        Returns the job, or None if it has since been handed to another
+        builder (for example because its lease expired).
+        """
+        job = NAMESPACE.session.query(Job).get(job_id)
+        if job.builder is not None and job.builder != NAMESPACE.machine:
+            logger = logging.getLogger('debile')
+            logger.warning("Builder %s no longer owns job %s",
+                           NAMESPACE.machine.name, job_id)
+            return None
+        return job
 
-        emit('start', 'job', job.debilize())
+    @builder_method
+    def heartbeat_job(self, job_id):
+        """
+        Extend the lease on a job. Returns False if the job is no longer
+        assigned to the calling builder.
+        """
+        if not self.lease:
+            return True
 
-        return job.debilize()
+        jobs = Job.__table__
+        return NAMESPACE.session.execute(jobs.update().where(
+            (jobs.c.id == job_id) & (jobs.c.state == "assigned") &
+            (jobs.c.builder_id == NAMESPACE.machine.id)
+        ).values(
+            lease_expires_at=datetime.utcnow() + self.lease,
+        )).rowcount > 0
 
     @builder_method
     def close_job(self, job_id, failed):
-        job = NAMESPACE.session.query(Job).get(job_id)
+        job = self._owned_job(job_id)
+        if job is None:
+            return False
         job.finished_at = datetime.utcnow()
+        job.lease_expires_at = None
+        job.update_state()
 
         emit('complete', 'job', job.debilize())
 
         return True
 
+    @builder_method
+    def close_jobs(self, results):
+        """
+        Close several jobs at once, `results` is a list of (job_id, failed)
+        pairs. Returns what close_job returned for each of them, False for
+        the jobs the builder no longer owns.
+        """
+        return [self.close_job(job_id, failed) for job_id, failed in results]
+
     @builder_method
     def forfeit_job(self, job_id):
-        job = NAMESPACE.session.query(Job).get(job_id)
+        job = self._owned_job(job_id)
+        if job is None:
+            return False
         job.assigned_at = None
+        job.lease_expires_at = None
         job.builder = None
+        job.update_state()
+
+        self._requeue_after_commit(job)
 
         emit('abort', 'job', job.debilize())
 
         return True
 
+    @builder_method
+    def forfeit_jobs(self, job_ids):
+        """
+        Hand several jobs back at once. Returns what forfeit_job returned
+        for each of them, False for the jobs the builder no longer owns.
+        """
+        return [self.forfeit_job(job_id) for job_id in job_ids]
+
     # Useful methods below.
 
     @generic_method
@@ -173,7 +424,7 @@ class DebileMasterInterface(object):
 
     @generic_method
     def get_job(self, job_id):
-        return NAMESPACE.session.query(Job).get(job_id).debilize()
+        return _load_job(NAMESPACE.session, job_id).debilize()
 
     # Creating builders/users
 
@@ -192,6 +443,7 @@ class DebileMasterInterface(object):
         b = Builder(name=name, maintainer=NAMESPACE.user, pgp=pgp, ssl=ssl,
                     last_ping=datetime.utcnow())
         NAMESPACE.session.add(b)
+        lookup.invalidate_principals(NAMESPACE.session)
 
         emit('create', 'slave', b.debilize())
         return b.debilize()
@@ -208,6 +460,7 @@ class DebileMasterInterface(object):
 
         builder.pgp = import_pgp(self.pgp_keyring, pgp)
         builder.ssl = import_ssl(self.ssl_keyring, ssl, builder.name)
+        lookup.invalidate_principals(NAMESPACE.session)
 
         clean_ssl_keyring(self.ssl_keyring, NAMESPACE.session)
 
@@ -225,6 +478,7 @@ class DebileMasterInterface(object):
 
         builder.pgp = "0000000000000000DEADBEEF0000000000000000"
         builder.ssl = "0000000000000000DEADBEEF0000000000000000"
+        lookup.invalidate_principals(NAMESPACE.session)
 
         clean_ssl_keyring(self.ssl_keyring, NAMESPACE.session)
 
@@ -243,6 +497,7 @@ class DebileMasterInterface(object):
 
         p = Person(name=name, email=email, pgp=pgp, ssl=ssl)
         NAMESPACE.session.add(p)
+        lookup.invalidate_principals(NAMESPACE.session)
 
         emit('create', 'user', p.debilize())
         return p.debilize()
@@ -259,6 +514,7 @@ class DebileMasterInterface(object):
 
         user.pgp = import_pgp(self.pgp_keyring, pgp)
         user.ssl = import_ssl(self.ssl_keyring, ssl, user.name, user.email)
+        lookup.invalidate_principals(NAMESPACE.session)
 
         clean_ssl_keyring(self.ssl_keyring, NAMESPACE.session)
 
@@ -276,6 +532,7 @@ class DebileMasterInterface(object):
 
         user.pgp = "0000000000000000DEADBEEF0000000000000000"
         user.ssl = "0000000000000000DEADBEEF0000000000000000"
+        lookup.invalidate_principals(NAMESPACE.session)
 
         clean_ssl_keyring(self.ssl_keyring, NAMESPACE.session)
 
@@ -293,18 +550,21 @@ class DebileMasterInterface(object):
         if any(job.built_binaries):
             raise ValueError("Can not re-run a successfull build job.")
 
-        versions = NAMESPACE.session.query(Source.version).filter(
-            Source.group_suite == job.source.group_suite,
-            Source.name == job.source.name,
-        )
-        max_version = max([x[0] for x in versions], key=Version)
-        if job.source.version != max_version:
+        latest = NAMESPACE.session.query(Source.id).filter(
+            Source.id == job.source_id,
+            Source.is_latest(),
+        ).first()
+        if latest is None:
             raise ValueError("Can not re-run a job for a superseeded source.")
 
         job.failed = None
         job.builder = None
         job.assigned_at = None
+        job.lease_expires_at = None
         job.finished_at = None
+        job.update_state()
+
+        self._requeue_after_commit(job)
 
         return job.debilize()
 
@@ -315,47 +575,102 @@ class DebileMasterInterface(object):
         if check.build:
             raise ValueError("Can not re-run a build check.")
 
-        jobs = NAMESPACE.session.query(Job).filter(
-            Job.check == check
-        )
-
-        for job in jobs:
-            versions = NAMESPACE.session.query(Source.version).filter(
-                Source.group_suite == job.source.group_suite,
-                Source.name == job.source.name,
-            )
-            max_version = max([x[0] for x in versions], key=Version)
-            if job.source.version != max_version:
-                continue
-
-            job.failed = None
-            job.builder = None
-            job.assigned_at = None
-            job.finished_at = None
+        # Unlike rerun_jobs, this also resets the jobs that are not
+        # finished yet.
+        self._rerun(self._jobs_to_rerun({"check": name}))
 
     @user_method
     def retry_failed(self):
         cutoff = datetime.utcnow() - timedelta(hours=1)
-        jobs = NAMESPACE.session.query(Job).filter(
-            ~Job.built_binaries.any(),
-            Job.check.has(Check.build == True),
-            Job.finished_at != None,
-            Job.finished_at < cutoff,
+        self._rerun(self._jobs_to_rerun({"build": True,
+                                         "finished_before": cutoff}))
+
+    @user_method
+    def rerun_jobs(self, filter):
+        """
+        Re-run the finished jobs matching `filter`, a dict with any of:
+
+            suite, group, arch, check: a name or a list of names
+            build: only (or never) jobs of build checks
+            failed: only failed (or successful) jobs
+            finished_after, finished_before: a date
+
+        Successful build jobs and jobs of superseded sources are never
+        re-run. Returns the number of jobs made ready and blocked.
+        """
+        return self._rerun(self._jobs_to_rerun(filter).filter(
+            Job.finished_at != None))
+
+    def _jobs_to_rerun(self, filter):
+        """
+        Returns the query for the ids of the jobs matching `filter` (see
+        rerun_jobs), finished or not.
+        """
+        s = NAMESPACE.session
+        query = s.query(Job.id).join(Job.source).join(Source.group_suite).join(Job.check).filter(
+            Source.is_latest(),
+            ~((Check.build == True) & Job.built_binaries.any()),
         )
 
-        for job in jobs:
-            versions = NAMESPACE.session.query(Source.version).filter(
-                Source.group_suite == job.source.group_suite,
-                Source.name == job.source.name
-            )
-            max_version = max([x[0] for x in versions], key=Version)
-            if job.source.version != max_version:
-                continue
-
-            job.failed = None
-            job.builder = None
-            job.assigned_at = None
-            job.finished_at = None
+        for key, cls, column in [("suite", Suite, GroupSuite.suite_id),
+                                 ("arch", Arch, Job.arch_id),
+                                 ("check", Check, Job.check_id)]:
+            if key in filter:
+                query = query.filter(column.in_(
+                    lookup.ids(s, cls, _listize(filter[key]))))
+
+        if "group" in filter:
+            query = query.join(GroupSuite.group).filter(
+                Group.name.in_(_listize(filter["group"])))
+        if "build" in filter:
+            query = query.filter(Check.build == bool(filter["build"]))
+        if "failed" in filter:
+            query = query.filter(Job.failed == bool(filter["failed"]))
+        if "finished_after" in filter:
+            query = query.filter(
+                Job.finished_at >= _parse_date(filter["finished_after"]))
+        if "finished_before" in filter:
+            query = query.filter(
+                Job.finished_at < _parse_date(filter["finished_before"]))
+        return query
+
+    def _rerun(self, query):
+        """
+        Resets the jobs whose ids `query` returns, in chunks. Returns the
+        number of jobs made ready and blocked.
+        """
+        s = NAMESPACE.session
+        jobs = Job.__table__
+        blocked = (jobs.c.dose_report != None) | (jobs.c.pending_dependencies > 0)
+
+        counts = {"ready": 0, "blocked": 0}
+        last = 0
+        while True:
+            ids = [x for x, in query.filter(Job.id > last).order_by(Job.id).limit(RERUN_CHUNK)]
+            if not ids:
+                break
+            last = ids[-1]
+
+            for state, condition in [("blocked", blocked), ("ready", ~blocked)]:
+                counts[state] += s.execute(jobs.update().where(
+                    jobs.c.id.in_(ids) & condition
+                ).values(
+                    failed=None,
+                    builder_id=None,
+                    assigned_at=None,
+                    lease_expires_at=None,
+                    finished_at=None,
+                    state=state,
+                )).rowcount
+
+        if counts["ready"]:
+            # The rebuild and the waiting builders read the jobs in sessions
+            # of their own, they can't see them before the commit.
+            if self.dispatcher is not None:
+                self.dispatcher.rebuild_after_commit(s)
+            self.notifier.notify_after_commit(s)
+
+        return counts
 
     @user_method
     def set_check(self, check, *args):
@@ -373,6 +688,7 @@ class DebileMasterInterface(object):
         check.binary = is_binary
         check.build = is_build
         NAMESPACE.session.add(check)
+        lookup.invalidate(NAMESPACE.session)
         return check.debilize()
 
     @user_method
@@ -404,6 +720,7 @@ class DebileMasterInterface(object):
 
         gs = gs_query.one()
         gs.checks.append(check_query.one())
+        lookup.invalidate(NAMESPACE.session)
         return 'Check %s added to %s.' % (check, gs)
 
     @user_method
@@ -0,0 +1,164 @@
+# Copyright (c) 2012-2013 Paul Tagliamonte <paultag@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Process-wide name -> id cache for the small tables that hardly ever change
+(Arch, Check, Suite, Component), and of the names of the group suites.
+
+Names missing from the cache are looked up in the database once, unknown
+names are remembered as such too, so the builders polling for an arch or a
+suite the master doesn't have don't cost a query each time. Anything
+adding, renaming or removing rows has to call invalidate().
+
+The builder and user behind an SSL fingerprint or client address are
+cached too, for PRINCIPAL_TTL seconds or until invalidate_principals().
+Changes made behind the master's back, like a builder revoked directly in
+the database, only apply once the entry expires.
+"""
+
+from sqlalchemy import event
+from sqlalchemy.orm.exc import NoResultFound
+
+from debile.master.orm import Group, Suite, GroupSuite
+
+import threading
+import time
+
+
+# Seconds an authenticated builder or user is remembered, 0 to not cache
+# them at all.
+PRINCIPAL_TTL = 60
+
+_lock = threading.Lock()
+_ids = {}
+_group_suites = {}
+_principals = {}
+_principals_generation = [0]
+
+
+def ids(session, cls, names):
+    """
+    Returns the ids of the `cls` rows named `names`, unknown names are
+    left out.
+    """
+    names = set(names)
+    with _lock:
+        cache = _ids.setdefault(cls, {})
+        missing = [x for x in names if x not in cache]
+
+    if missing:
+        found = dict(session.query(cls.name, cls.id).filter(
+            cls.name.in_(missing)))
+        with _lock:
+            # Unknown names are kept as None until the next invalidate().
+            cache.update((x, found.get(x)) for x in missing)
+
+    return [cache[x] for x in names if cache.get(x) is not None]
+
+
+def get(session, cls, name):
+    """
+    Returns the `cls` row named `name`, raises NoResultFound like
+    Query.one() if there is none.
+    """
+    id = ids(session, cls, [name])
+    if not id:
+        raise NoResultFound("No %s named %s" % (cls.__name__, name))
+    return session.query(cls).get(id[0])
+
+
+def group_suite_names(session, ids):
+    """
+    Returns a dict of the (group, suite) names of the group suites `ids`.
+    """
+    ids = set(ids)
+    with _lock:
+        missing = [x for x in ids if x not in _group_suites]
+
+    if missing:
+        found = session.query(GroupSuite.id, Group.name, Suite.name).join(
+            GroupSuite.group).join(GroupSuite.suite).filter(
+            GroupSuite.id.in_(missing))
+        with _lock:
+            _group_suites.update((id, (group, suite))
+                                 for id, group, suite in found)
+
+    return dict((x, _group_suites[x]) for x in ids if x in _group_suites)
+
+
+def invalidate(session=None):
+    """
+    Forget the cached ids and names. Pass the session changing them to
+    also forget whatever gets cached before it is committed.
+    """
+    def invalidate(*args):
+        with _lock:
+            _ids.clear()
+            _group_suites.clear()
+
+    invalidate()
+    if session is not None:
+        event.listen(session, "after_commit", invalidate)
+
+
+def principals(session, key, load):
+    """
+    Returns the (builder, user) pair for `key`, attached to `session`.
+    `load` is called to query them when they are not cached.
+    """
+    if not PRINCIPAL_TTL:
+        return load()
+
+    now = time.time()
+    with _lock:
+        entry = _principals.get(key)
+        generation = _principals_generation[0]
+
+    if entry is None or entry[0] < now:
+        found = load()
+        if not any(found):
+            return found
+
+        # Keep detached copies, each request gets its own merged ones.
+        for obj in set(x for x in found if x is not None):
+            session.expunge(obj)
+        entry = (now + PRINCIPAL_TTL,) + tuple(found)
+        with _lock:
+            # Don't cache anything loaded before an invalidation.
+            if generation == _principals_generation[0]:
+                _principals[key] = entry
+
+    return tuple(None if x is None else session.merge(x, load=False)
+                 for x in entry[1:])
+
+
+def invalidate_principals(session=None):
+    """
+    Forget the cached builders and users. Pass the session changing them
+    to also forget whatever gets cached before it is committed.
+    """
+    def invalidate(*args):
+        with _lock:
+            _principals.clear()
+            _principals_generation[0] += 1
+
+    invalidate()
+    if session is not None:
+        event.listen(session, "after_commit", invalidate)
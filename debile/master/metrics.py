@@ -0,0 +1,415 @@
+# Copyright (c) 2012-2013 Paul Tagliamonte <paultag@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+In-process metrics of the master, served as Prometheus text on /metrics
+and as a dict by get_stats.
+
+RPC latencies, query counts and SQL time are collected as calls are made,
+the time long polls spend parked is timed apart from the latencies.
+Slow RPCs can be logged with their statements, and RPCs profiled on
+demand. The job counts, the builder pings and the uploads are read from
+the database at most once every SNAPSHOT_INTERVAL seconds, however often
+they are asked for.
+"""
+
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+
+from debile.master.utils import session
+from debile.master.orm import (Suite, Arch, Check, GroupSuite, Source, Binary,
+                               Builder, Job)
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import bisect
+import cProfile
+import logging
+import pstats
+import threading
+import time
+
+
+# Seconds the job counts, builder pings and uploads are cached for.
+SNAPSHOT_INTERVAL = 30
+
+# RPCs taking at least this many seconds are logged with their statements.
+SLOW_RPC = None
+MAX_LOGGED_STATEMENTS = 200
+
+# Where toggle_profiling() writes the profile of the RPCs, in the home of
+# the master's user rather than a predictable name in /tmp.
+PROFILE_PATH = "/var/lib/debile/debile/debile-master.prof"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60)
+
+_lock = threading.Lock()
+_local = threading.local()
+_rpcs = {}
+
+# The profiles of the calls since toggle_profiling(), or None.
+_profile = [None]
+
+_snapshot_lock = threading.Lock()
+_snapshot = [None, 0]
+
+
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # The last count is for the values above all buckets.
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bucket, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            yield bucket, total
+
+
+class RPCMetrics(object):
+    def __init__(self):
+        self.latency = Histogram()
+        self.wait = Histogram()
+        self.errors = 0
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    _local.queries = getattr(_local, 'queries', 0) + 1
+    conn.info.setdefault('query_start', []).append(time.time())
+    if context is not None:
+        context.debile_timed = True
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.time() - conn.info['query_start'].pop()
+    if context is not None:
+        context.debile_timed = False
+    _local.sql_seconds = getattr(_local, 'sql_seconds', 0.0) + elapsed
+    statements = getattr(_local, 'statements', None)
+    if statements is not None and len(statements) < MAX_LOGGED_STATEMENTS:
+        statements.append((elapsed, statement))
+
+
+def _handle_error(context):
+    # A failed statement never gets to _after_cursor_execute.
+    if getattr(context.execution_context, 'debile_timed', False):
+        context.execution_context.debile_timed = False
+        context.connection.info['query_start'].pop()
+
+
+def install():
+    """
+    Start counting the SQL statements run by each RPC, and timing them.
+    """
+    for name, listener in [("before_cursor_execute", _before_cursor_execute),
+                           ("after_cursor_execute", _after_cursor_execute),
+                           ("handle_error", _handle_error)]:
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+
+
+def toggle_profiling():
+    """
+    Start profiling RPCs, or stop and write the profile to PROFILE_PATH.
+    Safe to call from a signal handler.
+    """
+    if _profile[0] is None:
+        _profile[0] = []
+        logging.getLogger('debile').info("Profiling RPCs")
+        return
+
+    profiles, _profile[0] = _profile[0], None
+
+    def write():
+        logger = logging.getLogger('debile')
+        if not profiles:
+            logger.info("No RPCs were profiled")
+            return
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(PROFILE_PATH)
+        logger.info("Wrote the profile of %d RPCs to %s", len(profiles),
+                    PROFILE_PATH)
+
+    # Not from the signal handler, the other threads might hold the locks.
+    threading.Thread(target=write, name="profile").start()
+
+
+def _log_slow(method, elapsed, queries, sql_seconds, statements):
+    lines = ["Slow RPC %s took %.2fs, %d queries in %.2fs" % (
+        method, elapsed, queries, sql_seconds)]
+    lines.extend("  %.4fs %s" % (x, " ".join(statement.split()))
+                 for x, statement in statements)
+    if queries > len(statements):
+        lines.append("  ... %d more" % (queries - len(statements)))
+    logging.getLogger('debile').warning("\n".join(lines))
+
+
+@contextmanager
+def rpc(method, poll=None):
+    """
+    Time the call to `method` run in this block, and count its queries.
+    `poll` is the LongPoll of the request, a call parking it is only
+    counted once it returns for good, and the time it spent parked goes
+    to the wait histogram instead of the latency.
+    """
+    queries = getattr(_local, 'queries', 0)
+    sql_seconds = getattr(_local, 'sql_seconds', 0.0)
+    depth = getattr(_local, 'depth', 0)
+    outermost = depth == 0
+    if outermost:
+        _local.statements = [] if SLOW_RPC is not None else None
+    _local.depth = depth + 1
+    first_statement = len(getattr(_local, 'statements', None) or [])
+
+    profiles = _profile[0]
+    profile = None
+    # Profiles of nested calls (in a multicall) would replace the outer one.
+    if outermost and profiles is not None:
+        profile = cProfile.Profile()
+        profile.enable()
+
+    start = time.time()
+    if poll is not None and poll.started_at is None:
+        poll.started_at = start
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        elapsed = time.time() - start
+        _local.depth = depth
+        if profile is not None:
+            profile.disable()
+            profiles.append(profile)
+
+        queries = getattr(_local, 'queries', 0) - queries
+        sql_seconds = getattr(_local, 'sql_seconds', 0.0) - sql_seconds
+        statements = getattr(_local, 'statements', None)
+        if statements is not None:
+            if SLOW_RPC is not None and elapsed >= SLOW_RPC:
+                _log_slow(method, elapsed, queries, sql_seconds,
+                          statements[first_statement:])
+            if outermost:
+                _local.statements = None
+
+        waited = None
+        if poll is not None:
+            if poll.parked and not failed:
+                # Made again later, that try counts towards the same call.
+                poll.handling += elapsed
+                elapsed = None
+            elif poll.handling:
+                waited = time.time() - poll.started_at - poll.handling - \
+                    elapsed
+                elapsed += poll.handling
+
+        with _lock:
+            metrics = _rpcs.get(method)
+            if metrics is None:
+                metrics = _rpcs[method] = RPCMetrics()
+            metrics.queries += queries
+            metrics.sql_seconds += sql_seconds
+            if elapsed is not None:
+                metrics.latency.observe(elapsed)
+                metrics.errors += failed
+            if waited is not None:
+                metrics.wait.observe(max(waited, 0))
+
+
+def _take_snapshot(s):
+    now = datetime.utcnow()
+    hour_ago = now - timedelta(hours=1)
+
+    jobs = s.query(
+        Suite.name, Arch.name, Check.name, Job.state, func.count(Job.id)
+    ).select_from(Job).join(Job.source).join(Source.group_suite).join(
+        GroupSuite.suite
+    ).join(Job.arch).join(Job.check).filter(
+        Job.state.in_(["ready", "blocked", "assigned"])
+    ).group_by(Suite.name, Arch.name, Check.name, Job.state)
+
+    return {
+        "taken_at": now,
+        "jobs": [{"suite": suite, "arch": arch, "check": check,
+                  "state": state, "count": count}
+                 for suite, arch, check, state, count in jobs],
+        "builders": dict(s.query(Builder.name, Builder.last_ping)),
+        "uploads": {
+            "source": s.query(func.count(Source.id)).filter(
+                Source.uploaded_at >= hour_ago).scalar(),
+            "binary": s.query(func.count(Binary.id)).filter(
+                Binary.uploaded_at >= hour_ago).scalar(),
+        },
+    }
+
+
+def snapshot():
+    """
+    Returns the cached job counts, builder pings and uploads of the last
+    hour, taking a new snapshot if it is too old.
+    """
+    with _snapshot_lock:
+        if _snapshot[0] is None or _snapshot[1] + SNAPSHOT_INTERVAL < time.time():
+            with session() as s:
+                _snapshot[0] = _take_snapshot(s)
+            _snapshot[1] = time.time()
+        return _snapshot[0]
+
+
+def invalidate():
+    with _snapshot_lock:
+        _snapshot[0] = None
+
+
+def get_stats(server_stats=None):
+    snap = snapshot()
+    now = datetime.utcnow()
+
+    with _lock:
+        rpcs = dict((method, {
+            "calls": metrics.latency.count,
+            "errors": metrics.errors,
+            "seconds": metrics.latency.sum,
+            "waits": metrics.wait.count,
+            "wait_seconds": metrics.wait.sum,
+            "queries": metrics.queries,
+            "sql_seconds": metrics.sql_seconds,
+        }) for method, metrics in _rpcs.items())
+
+    stats = {
+        "jobs": snap["jobs"],
+        "rpc": rpcs,
+        "builders": dict(
+            (name, (now - ping).total_seconds())
+            for name, ping in snap["builders"].items()),
+        "uploads_last_hour": snap["uploads"],
+        "snapshot_age": (now - snap["taken_at"]).total_seconds(),
+    }
+    if server_stats is not None:
+        stats["server"] = server_stats
+    return stats
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (key, unicode(value).replace("\\", "\\\\").replace(
+            '"', '\\"').replace("\n", "\\n"))
+        for key, value in sorted(labels.items()))
+
+
+def render(server_stats=None):
+    """
+    Returns the metrics in the Prometheus text format.
+    """
+    stats = get_stats(server_stats)
+    lines = []
+
+    def metric(name, kind, help, samples):
+        lines.append("# HELP %s %s" % (name, help))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for suffix, labels, value in samples:
+            lines.append("%s%s%s %s" % (name, suffix, _labels(**labels),
+                                        repr(float(value))))
+
+    metric("debile_jobs", "gauge", "Unfinished jobs.", [
+        ("", dict((k, v) for k, v in x.items() if k != "count"), x["count"])
+        for x in stats["jobs"]])
+
+    with _lock:
+        histograms = [(method, list(metrics.latency.cumulative()),
+                       metrics.latency.sum, metrics.latency.count,
+                       list(metrics.wait.cumulative()), metrics.wait.sum,
+                       metrics.wait.count)
+                      for method, metrics in sorted(_rpcs.items())]
+
+    def histogram(name, help, values):
+        samples = []
+        for method, buckets, sum, count in values:
+            samples.extend(("_bucket", {"method": method, "le": bucket},
+                            total) for bucket, total in buckets)
+            samples.append(("_sum", {"method": method}, sum))
+            samples.append(("_count", {"method": method}, count))
+        metric(name, "histogram", help, samples)
+
+    histogram("debile_rpc_duration_seconds",
+              "Time spent in RPCs, not counting the wait of long polls.",
+              [x[:4] for x in histograms])
+    # Only the methods that ever waited.
+    histogram("debile_rpc_wait_seconds",
+              "Time long polls spent parked, waiting for work.",
+              [x[:1] + x[4:] for x in histograms if x[6]])
+
+    rpcs = sorted(stats["rpc"].items())
+    metric("debile_rpc_errors_total", "counter", "Failed RPCs.",
+           [("", {"method": m}, x["errors"]) for m, x in rpcs])
+    metric("debile_rpc_queries_total", "counter", "SQL statements run by RPCs.",
+           [("", {"method": m}, x["queries"]) for m, x in rpcs])
+    metric("debile_rpc_sql_seconds_total", "counter",
+           "Time spent in SQL statements by RPCs.",
+           [("", {"method": m}, x["sql_seconds"]) for m, x in rpcs])
+
+    metric("debile_builder_last_ping_age_seconds", "gauge",
+           "Seconds since the last ping of each builder.",
+           [("", {"builder": name}, age)
+            for name, age in sorted(stats["builders"].items())])
+    metric("debile_uploads_last_hour", "gauge",
+           "Uploads accepted by debile-incoming in the last hour.",
+           [("", {"kind": kind}, count)
+            for kind, count in sorted(stats["uploads_last_hour"].items())])
+    metric("debile_snapshot_age_seconds", "gauge",
+           "Age of the job, builder and upload figures.",
+           [("", {}, stats["snapshot_age"])])
+
+    if server_stats is not None:
+        metric("debile_server_busy_workers", "gauge",
+               "Threads handling a request.",
+               [("", {}, server_stats["busy_workers"])])
+        metric("debile_server_queue_length", "gauge",
+               "Requests waiting for a worker.",
+               [("", {}, server_stats["queue_length"])])
+        metric("debile_server_idle_connections", "gauge",
+               "Kept alive connections waiting for their next request.",
+               [("", {}, server_stats["idle_connections"])])
+        metric("debile_server_parked_requests", "gauge",
+               "get_next_job calls waiting for a job.",
+               [("", {}, server_stats["parked_requests"])])
+        metric("debile_server_rejected_total", "counter",
+               "Requests turned away while the queue was full.",
+               [("", {}, server_stats["rejected"])])
+
+    return "\n".join(lines) + "\n"
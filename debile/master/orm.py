@@ -21,7 +21,9 @@
 
 import re
 import importlib
+import threading
 from datetime import datetime
+from operator import attrgetter
 
 from firewoes.lib.orm import metadata
 from firehose.model import Analysis
@@ -29,41 +31,55 @@ from firehose.model import Analysis
 from sqlalchemy.dialects.postgresql import INET
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import relationship, backref
-from sqlalchemy import (Table, Column, ForeignKey, UniqueConstraint,
-                        Integer, String, DateTime, Boolean)
+from sqlalchemy.orm import (relationship, backref, object_session,
+                            joinedload, aliased, validates)
+from sqlalchemy.sql import text, select, exists
+from sqlalchemy import (Table, Column, ForeignKey, UniqueConstraint, Index,
+                        Integer, String, DateTime, Boolean, Enum, LargeBinary,
+                        event)
 
 
 from debile.master.utils import config
 from debile.master.arches import (get_preferred_affinity, get_source_arches)
+from debile.master.versions import version_sort_key
 
 
 Base = declarative_base(metadata=metadata)
 
 
-def _debilize(self):
-    def getthing(obj, name):
-        if obj is None:
-            return None
-        if "." in name:
-            local, remote = name.split(".", 1)
-            foo = getattr(obj, local)
-            return getthing(foo, remote)
-        if name == "__str__":
-            return str(obj)
-        if name == "__debilize__":
-            return _debilize(obj)
-        if name == "__list__":
-            return [_debilize(x) for x in obj]
-        return getattr(obj, name)
+def _getter(path):
+    """
+    Compile a dotted _debile_objs path into a function fetching it.
+    """
+    local, _, remote = path.partition(".")
+    if remote:
+        fetch = attrgetter(local)
+        rest = _getter(remote)
+        return lambda obj: None if obj is None else rest(fetch(obj))
+    if path == "__str__":
+        return lambda obj: None if obj is None else str(obj)
+    if path == "__debilize__":
+        return _debilize
+    if path == "__list__":
+        return lambda obj: None if obj is None else [_debilize(x) for x in obj]
+    fetch = attrgetter(path)
+    return lambda obj: None if obj is None else fetch(obj)
+
+
+_debilize_plans = {}
 
+
+def _debilize(self):
     if self is None:
         return None
 
-    ret = {}
-    for attribute, path in self._debile_objs.items():
-        ret[attribute] = getthing(self, path)
-    return ret
+    plan = _debilize_plans.get(type(self))
+    if plan is None:
+        plan = [(attribute, _getter(path))
+                for attribute, path in self._debile_objs.items()]
+        _debilize_plans[type(self)] = plan
+
+    return {attribute: get(self) for attribute, get in plan}
 
 
 class Person(Base):
@@ -86,7 +102,8 @@ class Person(Base):
     pgp = Column(String(40), nullable=True, default=None)
     ssl = Column(String(40), nullable=True, default=None)
 
-    ip = Column(INET, nullable=True, default=None)
+    ip = Column(String(255).with_variant(INET(), "postgresql"),
+                nullable=True, default=None)
 
     def __str__(self):
         return "%s <%s>" % (self.name, self.email)
@@ -120,7 +137,8 @@ class Builder(Base):
     pgp = Column(String(40), nullable=True, default=None)
     ssl = Column(String(40), nullable=True, default=None)
 
-    ip = Column(INET, nullable=True, default=None)
+    ip = Column(String(255).with_variant(INET(), "postgresql"),
+                nullable=True, default=None)
 
     def __str__(self):
         return self.name
@@ -212,6 +230,54 @@ class Check(Base):
         return "<Check: %s (%s)>" % (self.name, self.id)
 
 
+_repo_info_lock = threading.Lock()
+_repo_info_state = {"conf": None, "resolver": None, "cache": {}}
+
+
+def _repo_info_cache():
+    """
+    Returns the repo config, its custom resolver and the per-group cache
+    of resolved repo info. All of it is reset whenever config["repo"] is
+    replaced, for example when the config is loaded again.
+    """
+    with _repo_info_lock:
+        state = _repo_info_state
+        conf = config.get("repo", None)
+        if state["conf"] is not conf:
+            resolver = None
+            custom_resolver = conf.get("custom_resolver", None)
+            if custom_resolver:
+                module, func = custom_resolver.rsplit(".", 1)
+                resolver = getattr(importlib.import_module(module), func)
+            state.update(conf=conf, resolver=resolver, cache={})
+        return state["conf"], state["resolver"], state["cache"]
+
+
+def invalidate_repo_info():
+    """
+    Forget the resolved repo info, needed when config["repo"] is changed in
+    place or the custom resolver's answers change.
+    """
+    with _repo_info_lock:
+        _repo_info_state.update(conf=None, resolver=None, cache={})
+
+
+def _resolve_repo_info(group, conf, resolver):
+    if resolver:
+        return resolver(group, conf)
+
+    entires = ["repo_path", "repo_url", "files_path", "files_url"]
+
+    for entry in entires:
+        if conf.get(entry) is None:
+            raise ValueError("No configured repo info. Set in master.yaml")
+
+    return {x: conf[x].format(
+        name=group.name,
+        id=group.id,
+    ) for x in entires}
+
+
 class Group(Base):
     __tablename__ = 'groups'
     __table_args__ = (UniqueConstraint('name'),)
@@ -234,39 +300,31 @@ class Group(Base):
     maintainer = relationship("Person", foreign_keys=[maintainer_id])
 
     def get_repo_info(self):
-        conf = config.get("repo", None)
-        custom_resolver = conf.get("custom_resolver", None)
-        if custom_resolver:
-            module, func = custom_resolver.rsplit(".", 1)
-            m = importlib.import_module(module)
-            return getattr(m, func)(self, conf)
+        return dict(self._repo_info())
 
-        entires = ["repo_path", "repo_url", "files_path", "files_url"]
-
-        for entry in entires:
-            if conf.get(entry) is None:
-                raise ValueError("No configured repo info. Set in master.yaml")
-
-        return {x: conf[x].format(
-            name=self.name,
-            id=self.id,
-        ) for x in entires}
+    def _repo_info(self):
+        conf, resolver, cache = _repo_info_cache()
+        key = (self.id, self.name)
+        info = cache.get(key)
+        if info is None:
+            info = cache[key] = _resolve_repo_info(self, conf, resolver)
+        return info
 
     @property
     def repo_path(self):
-        return self.get_repo_info()['repo_path']
+        return self._repo_info()['repo_path']
 
     @property
     def repo_url(self):
-        return self.get_repo_info()['repo_url']
+        return self._repo_info()['repo_url']
 
     @property
     def files_path(self):
-        return self.get_repo_info()['files_path']
+        return self._repo_info()['files_path']
 
     @property
     def files_url(self):
-        return self.get_repo_info()['files_url']
+        return self._repo_info()['files_url']
 
     def __str__(self):
         return self.name
@@ -343,6 +401,10 @@ source_arch_association = (
 
 class Source(Base):
     __tablename__ = 'sources'
+    __table_args__ = (Index('ix_sources_group_suite_component',
+                            'group_suite_id', 'component_id'),
+                      Index('ix_sources_group_suite_name_version',
+                            'group_suite_id', 'name', 'version_key'))
     _debile_objs = {
         "id": "id",
         "name": "name",
@@ -371,6 +433,28 @@ class Source(Base):
     name = Column(String(255), nullable=False)
     version = Column(String(255), nullable=False)
 
+    # Sorts like dpkg sorts version, see version_sort_key. Kept as bytes
+    # (bytea) so it compares byte-wise whatever the collation.
+    version_key = Column(LargeBinary, nullable=False)
+
+    @validates('version')
+    def _set_version_key(self, key, version):
+        self.version_key = version_sort_key(version)
+        return version
+
+    @classmethod
+    def is_latest(cls):
+        """
+        SQL condition matching the sources without a newer version in their
+        group suite.
+        """
+        newer = aliased(cls)
+        return ~exists().where(
+            (newer.group_suite_id == cls.group_suite_id) &
+            (newer.name == cls.name) &
+            (newer.version_key > cls.version_key)
+        )
+
     group_suite_id = Column(Integer, ForeignKey('group_suites.id', ondelete="RESTRICT"), nullable=False)
     group_suite = relationship("GroupSuite", foreign_keys=[group_suite_id])
 
@@ -582,14 +666,35 @@ class Deb(Base):
 
 
 # Many-to-Many relationship
+# Note that the columns are named the other way around: blocking_job_id is
+# the job that is waiting, blocked_job_id is the job it is waiting for.
+# Edges are kept once resolved, Job.pending_dependencies counts the rest.
 job_dependencies = (
     Table('job_dependencies', Base.metadata,
           Column('blocked_job_id', Integer, ForeignKey('jobs.id', ondelete="CASCADE"), nullable=False),
-          Column('blocking_job_id', Integer, ForeignKey('jobs.id', ondelete="CASCADE"), nullable=False)))
+          Column('blocking_job_id', Integer, ForeignKey('jobs.id', ondelete="CASCADE"), nullable=False),
+          Column('resolved', Boolean, nullable=False, default=False),
+          Index('ix_job_dependencies_blocked_job_id', 'blocked_job_id')))
+
+
+# Lifecycle of a job:
+#   pending  - unused, jobs get their first state when they are inserted
+#   blocked  - waiting for dependencies or a dose report to clear
+#   ready    - can be handed out to a builder
+#   assigned - handed out to a builder
+#   finished - closed by the builder, or a successfull result was received
+#   failed   - a failed result was received
+JOB_STATES = ("pending", "blocked", "ready", "assigned", "finished", "failed")
 
 
 class Job(Base):
     __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ix_jobs_state', 'state'),
+        # Only the ready jobs are interesting when dispatching.
+        Index('ix_jobs_ready', 'arch_id', 'check_id', 'assigned_count',
+              postgresql_where=text("state = 'ready'")),
+    )
     _debile_objs = {
         "id": "id",
         "source": "source.__str__",
@@ -602,7 +707,9 @@ class Job(Base):
         "builder": "builder.__debilize__",
         "assigned_at": "assigned_at",
         "finished_at": "finished_at",
+        "lease_expires_at": "lease_expires_at",
         "failed": "failed",
+        "state": "state",
         "group_id": "group.id",
         "source_id": "source.id",
         "binary_id": "binary.id",
@@ -616,6 +723,32 @@ class Job(Base):
         obj['binary_obj'] = _debilize(self.binary)
         return obj
 
+    @classmethod
+    def debilize_options(cls):
+        """
+        Loader options fetching everything debilize() needs in a single
+        query, instead of one lazy load per relationship. The collections
+        involved only have a handful of rows, so they are joined too.
+        """
+        source = joinedload(cls.source)
+        group_suite = source.joinedload(Source.group_suite)
+        binary = joinedload(cls.binary)
+        return [
+            joinedload(cls.check),
+            joinedload(cls.arch),
+            joinedload(cls.builder).joinedload(Builder.maintainer),
+            group_suite.joinedload(GroupSuite.group).joinedload(Group.maintainer),
+            group_suite.joinedload(GroupSuite.suite),
+            source.joinedload(Source.component),
+            source.joinedload(Source.affinity),
+            source.joinedload(Source.uploader),
+            source.joinedload(Source.maintainers),
+            source.joinedload(Source.binaries).joinedload(Binary.arch),
+            binary.joinedload(Binary.arch),
+            binary.joinedload(Binary.debs),
+            binary.joinedload(Binary.build_job).joinedload(cls.builder),
+        ]
+
     id = Column(Integer, primary_key=True)
 
     @hybrid_property
@@ -670,6 +803,16 @@ class Job(Base):
     finished_at = Column(DateTime, nullable=True, default=None)
     failed = Column(Boolean, nullable=True, default=None)
 
+    # Assigned jobs go back to ready once this passes, unless the builder
+    # keeps extending it with heartbeat_job. NULL means no lease.
+    lease_expires_at = Column(DateTime, nullable=True, default=None)
+
+    # Set by update_state(), or by _initial_job_state() below.
+    state = Column(Enum(*JOB_STATES, name="job_states"), nullable=False)
+
+    # Number of unresolved entries in depedencies.
+    pending_dependencies = Column(Integer, nullable=False, default=0)
+
     depedencies = relationship(
         "Job", secondary=job_dependencies, passive_deletes=True,
         cascade="save-update, merge, delete",
@@ -685,6 +828,46 @@ class Job(Base):
                 self.arch == self.source.affinity and
                 not any(x.arch.name == "all" for x in self.source.binaries))
 
+    # Must be called after any change to the columns the state derives from.
+    def update_state(self):
+        if self.failed:
+            self.state = "failed"
+        elif self.finished_at is not None or self.failed is not None:
+            self.state = "finished"
+        elif self.assigned_at is not None:
+            self.state = "assigned"
+        elif self.dose_report is not None or self.pending_dependencies:
+            self.state = "blocked"
+        else:
+            self.state = "ready"
+
+    # Called once this job no longer blocks the jobs depending on it.
+    def unblock_dependants(self):
+        session = object_session(self)
+        session.flush()
+
+        jobs = Job.__table__
+        edges = job_dependencies.c
+        unresolved = (edges.blocked_job_id == self.id) & (edges.resolved == False)
+
+        session.execute(jobs.update().where(
+            jobs.c.id.in_(select([edges.blocking_job_id]).where(unresolved))
+        ).values(pending_dependencies=jobs.c.pending_dependencies - 1))
+        session.execute(job_dependencies.update().where(unresolved).values(
+            resolved=True))
+        session.execute(jobs.update().where(
+            jobs.c.id.in_(select([edges.blocking_job_id]).where(
+                edges.blocked_job_id == self.id)) &
+            (jobs.c.state == "blocked") &
+            (jobs.c.pending_dependencies == 0) &
+            (jobs.c.dose_report == None)
+        ).values(state="ready"))
+
+        # Don't let already loaded jobs hold on to the old values.
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, Job) and obj is not self:
+                session.expire(obj, ['pending_dependencies', 'state'])
+
     # Called when the .changes for a build job is processed
     def new_binary(self, arch=None):
         if not self.check.build:
@@ -702,8 +885,8 @@ class Job(Base):
                 job.binary = binary
 
         self.dose_report = None
-        for job in list(self.blocking):
-            job.depedencies.remove(self)
+        self.update_state()
+        self.unblock_dependants()
 
         return binary
 
@@ -713,11 +896,11 @@ class Job(Base):
         result.firehose_id = fire.id
         result.failed = failed
         self.failed = failed
-        # Only delete the dependency if the job was sucessfull, and
-        # not if it is a build job (that is handled by add_binary().
+        self.update_state()
+        # Only resolve the dependency if the job was sucessfull, and
+        # not if it is a build job (that is handled by new_binary()).
         if not result.failed and not self.check.build:
-            for job in list(self.blocking):
-                job.depedencies.remove(self)
+            self.unblock_dependants()
         return result
 
     def __str__(self):
@@ -727,6 +910,13 @@ class Job(Base):
         return "<Job: %s %s (%s)>" % (self.source, self.name, self.id)
 
 
+@event.listens_for(Job, "before_insert")
+def _initial_job_state(mapper, connection, job):
+    # A job created without calling update_state() would never be ready.
+    if job.state is None:
+        job.update_state()
+
+
 class Result(Base):
     __tablename__ = 'results'
     _debile_objs = {
@@ -937,8 +1127,10 @@ def create_jobs(source, dose_report=None):
 
             for dep in deps:
                 j.depedencies.append(dep)
+            j.pending_dependencies = len(deps)
 
     for job in source.jobs:
         # Fake the assigned_count to prioritize build jobs an production suites slightly.
         job.assigned_count = ((4 if job.source.suite.name in ["staging", "sid", "experimental"] else 0) +
                               (8 if not job.check.build else 0))
+        job.update_state()
@@ -20,8 +20,12 @@
 
 from debile.utils.commands import run_command
 from debian.deb822 import Sources
+from contextlib import closing
 from gzip import GzipFile
 
+import os
+import sqlite3
+
 
 class RepoException(Exception):
     pass
@@ -38,15 +42,181 @@ class RepoPackageNotFound(RepoException):
         return 'Package {0} not found in Sources.gz'.format(self.package)
 
 
+def pool_directory(component, name):
+    prefix = name[:4] if name.startswith("lib") and len(name) > 3 else name[0]
+    return "pool/{0}/{1}/{2}".format(component, prefix, name)
+
+
+def scan_sources(path):
+    """
+    Yield a (name, version, directory, dsc) tuple for every entry of the
+    Sources.gz file at `path`.
+    """
+    for entry in Sources.iter_paragraphs(GzipFile(filename=path)):
+        dsc = None
+        for line in entry['Files']:
+            if line['name'].endswith(".dsc"):
+                dsc = line['name']
+                break
+        yield (entry['Package'], entry['Version'], entry['Directory'], dsc)
+
+
+class SourcesIndex(object):
+    """
+    On-disk index of the Sources.gz files of a repository, mapping
+    (suite, component, name, version) to (directory, dsc).
+
+    Every indexed file is recorded with its stat, and is indexed again
+    from scratch on the next lookup once it no longer matches. Uploads
+    included through Repo.add_changes update the index in place, so an
+    accept does not cost a reparse of the whole Sources file. As another
+    writer may have changed the file along with the include, a lookup
+    missing in an up to date index rebuilds it once before giving up.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        db = sqlite3.connect(self.path, timeout=60)
+        db.execute("""CREATE TABLE IF NOT EXISTS files (
+            suite TEXT, component TEXT, stat TEXT,
+            PRIMARY KEY (suite, component))""")
+        db.execute("""CREATE TABLE IF NOT EXISTS sources (
+            suite TEXT, component TEXT, name TEXT, version TEXT,
+            directory TEXT, dsc TEXT,
+            PRIMARY KEY (suite, component, name, version))""")
+        return db
+
+    @staticmethod
+    def stat(sources):
+        try:
+            st = os.stat(sources)
+        except OSError:
+            return None
+        return "%d:%d:%d" % (st.st_ino, st.st_size, st.st_mtime * 1e9)
+
+    def _indexed_stat(self, db, suite, component):
+        row = db.execute("SELECT stat FROM files WHERE suite=? AND "
+                         "component=?", (suite, component)).fetchone()
+        return row[0] if row else None
+
+    def _set_stat(self, db, suite, component, stat):
+        db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                   (suite, component, stat))
+
+    def current(self, suite, component, sources):
+        """
+        Return whether the index is up to date with `sources`.
+        """
+        with closing(self._connect()) as db:
+            stat = self.stat(sources)
+            return stat is not None and \
+                self._indexed_stat(db, suite, component) == stat
+
+    def rebuild(self, suite, component, sources):
+        with closing(self._connect()) as db, db:
+            stat = self.stat(sources)
+            db.execute("DELETE FROM sources WHERE suite=? AND component=?",
+                       (suite, component))
+            db.executemany("INSERT OR REPLACE INTO sources VALUES "
+                           "(?, ?, ?, ?, ?, ?)", (
+                (suite, component) + entry
+                for entry in scan_sources(sources)))
+            self._set_stat(db, suite, component, stat)
+
+    def update(self, suite, component, sources, previous, name, version,
+               directory, dsc):
+        """
+        Record `name` `version` as the only version of the source in
+        `suite`/`component`. The index is marked up to date with `sources`
+        only if it still is with `previous`, the stat of `sources` before
+        the upload was included; otherwise the next lookup rebuilds it.
+        """
+        with closing(self._connect()) as db, db:
+            # Writing first holds the lock until the stat is recorded.
+            db.execute("DELETE FROM sources WHERE suite=? AND component=? "
+                       "AND name=?", (suite, component, name))
+            db.execute("INSERT INTO sources VALUES (?, ?, ?, ?, ?, ?)",
+                       (suite, component, name, version, directory, dsc))
+            if self._indexed_stat(db, suite, component) == previous:
+                self._set_stat(db, suite, component, self.stat(sources))
+
+    def _find(self, suite, component, name, version):
+        with closing(self._connect()) as db:
+            return db.execute(
+                "SELECT directory, dsc FROM sources WHERE suite=? AND "
+                "component=? AND name=? AND version=?",
+                (suite, component, name, version)).fetchone()
+
+    def lookup(self, suite, component, sources, name, version):
+        """
+        Return (directory, dsc) for the source, or None if it is not in
+        `sources`. The index is rebuilt first if it is out of date.
+        """
+        rebuilt = not self.current(suite, component, sources)
+        if rebuilt:
+            self.rebuild(suite, component, sources)
+        entry = self._find(suite, component, name, version)
+        if entry is None and not rebuilt:
+            self.rebuild(suite, component, sources)
+            entry = self._find(suite, component, name, version)
+        return entry
+
+
 class Repo(object):
 
     def __init__(self, root):
         self.root = root
+        self.index = SourcesIndex(os.path.join(root, "db",
+                                               "debile-sources.db"))
+
+    def sources_path(self, suite, component):
+        return "{root}/dists/{suite}/{component}/source/Sources.gz".format(
+            root=self.root,
+            suite=suite,
+            component=component
+        )
+
+    def _components(self, suite):
+        try:
+            names = os.listdir(os.path.join(self.root, "dists", suite))
+        except OSError:
+            return []
+        return [x for x in names
+                if os.path.exists(self.sources_path(suite, x))]
 
     def add_changes(self, changes):
         dist = changes['distribution']
+        dsc = changes.get_dsc()
+        if dsc is None:
+            self.include(dist, changes.get_changes_file())
+            return
+
+        # Only the components whose index was up to date before the
+        # include can be updated in place; the others are rebuilt anyway.
+        previous = {}
+        for component in self._components(dist):
+            sources = self.sources_path(dist, component)
+            stat = self.index.stat(sources)
+            if self.index.current(dist, component, sources):
+                previous[component] = stat
+
         self.include(dist, changes.get_changes_file())
 
+        name = changes.get_package_name().split()[0]
+        version = changes['Version']
+        dsc = os.path.basename(dsc)
+        for component, stat in previous.items():
+            directory = pool_directory(component, name)
+            if os.path.exists(os.path.join(self.root, directory, dsc)):
+                self.index.update(dist, component,
+                                  self.sources_path(dist, component), stat,
+                                  name, version, directory, dsc)
+
     def _exec(self, *args):
         cmd = ["reprepro", "-Vb", self.root] + list(args)
         out, err, ret = run_command(cmd)
@@ -79,20 +249,12 @@ class Repo(object):
         raise NotImplemented()
 
     def find_dsc(self, source):
-        sources = "{root}/dists/{suite}/{component}/source/Sources.gz".format(
-            root=self.root,
-            suite=source.suite.name,
-            component=source.component.name
-        )
-
-        for entry in Sources.iter_paragraphs(GzipFile(filename=sources)):
-            if entry['Package'] == source.name and entry['Version'] == source.version:
-                dsc = None
-                for line in entry['Files']:
-                    if line['name'].endswith(".dsc"):
-                        dsc = line['name']
-                        break
-                return (entry['Directory'], dsc)
-
-        raise RepoPackageNotFound('{0}-{1}'.format(source.name,
-                                             source.version))
+        suite = source.suite.name
+        component = source.component.name
+        entry = self.index.lookup(suite, component,
+                                  self.sources_path(suite, component),
+                                  source.name, source.version)
+        if entry is None:
+            raise RepoPackageNotFound('{0}-{1}'.format(source.name,
+                                                 source.version))
+        return entry
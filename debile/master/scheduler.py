@@ -0,0 +1,143 @@
+# Copyright (c) 2012-2013 Paul Tagliamonte <paultag@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from sqlalchemy.sql import func
+
+from debile.master.orm import Source, Job
+from debile.master import lookup
+
+from datetime import datetime
+
+import importlib
+import threading
+
+
+class DefaultPolicy(object):
+    """
+    Hand out the least assigned jobs first, oldest uploads first. This is
+    the order the in-memory dispatcher uses too.
+    """
+
+    dispatchable = True
+
+    def __init__(self, conf=None):
+        self.conf = conf or {}
+
+    def order(self):
+        return [Job.assigned_count.asc(), Source.uploaded_at.asc()]
+
+    def group_suites(self, session, candidates):
+        """
+        Returns the ids of the group suites to take jobs from, in order of
+        preference. `candidates` is the query for the jobs the builder can
+        do. None stands for any group suite.
+        """
+        return [None]
+
+    def served(self, group_suite_id):
+        """
+        Called when a job of `group_suite_id` was handed out.
+        """
+        pass
+
+
+class FairSharePolicy(DefaultPolicy):
+    """
+    Share the builders between the group suites according to their weight:
+    the group suite with the least assigned jobs per unit of weight goes
+    first. Every `aging` seconds a group suite has been waiting since it
+    was last handed a job (or since its oldest waiting upload, if that is
+    more recent) count as one job less, so no group suite starves. Once it
+    is served, a big old backlog stops aging ahead of everyone else.
+
+    When a group suite was last served is only kept in memory, there is a
+    single master handing out the jobs, and a row updated by every claim
+    would serialize the builders.
+    """
+
+    dispatchable = False
+
+    def __init__(self, conf=None):
+        super(FairSharePolicy, self).__init__(conf)
+        self._lock = threading.Lock()
+        self._served = {}
+
+    def served(self, group_suite_id):
+        with self._lock:
+            self._served[group_suite_id] = datetime.utcnow()
+
+    def weight(self, group, suite):
+        weights = self.conf.get("weights", {})
+        return weights.get("%s/%s" % (group, suite),
+                           weights.get(suite, self.conf.get("default_weight", 1)))
+
+    def group_suites(self, session, candidates):
+        waiting = candidates.with_entities(
+            Source.group_suite_id, func.min(Source.uploaded_at),
+        ).order_by(None).group_by(Source.group_suite_id).all()
+        if not waiting:
+            return []
+
+        # Only the running jobs, through the index on the state.
+        running = dict(session.query(
+            Source.group_suite_id, func.count(Job.id),
+        ).join(Job.source).filter(
+            Job.state == "assigned",
+        ).group_by(Source.group_suite_id))
+
+        names = lookup.group_suite_names(session,
+                                         [id for id, oldest in waiting])
+        with self._lock:
+            served = dict(self._served)
+
+        now = datetime.utcnow()
+        aging = self.conf.get("aging", 3600)
+
+        def score(entry):
+            id, oldest = entry
+            share = running.get(id, 0) / float(self.weight(*names[id]))
+            if aging:
+                since = max(oldest, served.get(id) or oldest)
+                share -= (now - since).total_seconds() / float(aging)
+            return share, oldest
+
+        return [id for id, oldest in sorted(waiting, key=score)]
+
+
+POLICIES = {
+    "default": DefaultPolicy,
+    "fair-share": FairSharePolicy,
+}
+
+
+def get_policy(conf):
+    """
+    Returns the scheduling policy configured in the scheduler section of
+    master.yaml. The policy is either one of POLICIES or the dotted path
+    to a class implementing the same interface as DefaultPolicy.
+    """
+    conf = conf or {}
+    name = conf.get("policy", "default")
+    if name in POLICIES:
+        return POLICIES[name](conf)
+
+    module, cls = name.rsplit(".", 1)
+    m = importlib.import_module(module)
+    return getattr(m, cls)(conf)
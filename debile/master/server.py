@@ -26,15 +26,34 @@ from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
 from sqlalchemy.sql import exists
 
 from debile.utils.log import start_logging
-from debile.master.utils import session
+from debile.utils.xmlrpc import BUSY_FAULT
+from debile.utils import jsonrpc
+from debile.utils.jsonrpc import JSONRPCRequestHandlerMixIn
+from debile.master.utils import session, emit
 from debile.master.orm import Person, Builder, Job
-from debile.master.interface import NAMESPACE, DebileMasterInterface
+from debile.master.interface import NAMESPACE, DebileMasterInterface, LongPoll
+from debile.master.dispatch import Dispatcher
+from debile.master.scheduler import get_policy
+from debile.master import lookup, metrics
+
+from contextlib import contextmanager
+from cStringIO import StringIO
+from datetime import datetime, timedelta
 
 import SocketServer
+import errno
+import select
+import sys
+import xmlrpclib
+import Queue
+import threading
 import signal
+import socket
+import time
 import hashlib
 import logging
 import logging.handlers
+import os
 import os.path
 import ssl
 
@@ -48,17 +67,201 @@ def check_shutdown():
             raise SystemExit(0)
 
 
-class DebileMasterAuthMixIn(SimpleXMLRPCRequestHandler):
+def reap_expired_jobs(dispatcher=None, notifier=None):
+    """
+    Put the assigned jobs whose lease has expired back in the ready state.
+    """
+    jobs = Job.__table__
+    with session() as s:
+        now = datetime.utcnow()
+        expired = (jobs.c.state == "assigned") & (jobs.c.lease_expires_at < now)
+
+        reaped = []
+        for job_id, in s.query(Job.id).filter(expired):
+            # The builder might still send a heartbeat while we are at it.
+            if s.execute(jobs.update().where(
+                (jobs.c.id == job_id) & expired
+            ).values(
+                state="ready",
+                assigned_at=None,
+                lease_expires_at=None,
+                builder_id=None,
+            )).rowcount:
+                reaped.append(job_id)
+
+        if reaped:
+            for job in s.query(Job).filter(Job.id.in_(reaped)):
+                emit('abort', 'job', job.debilize())
+
+    if reaped:
+        logger = logging.getLogger('debile')
+        logger.info("Returned %d jobs with an expired lease to the queue",
+                    len(reaped))
+        if dispatcher is not None:
+            dispatcher.request_rebuild()
+        if notifier is not None:
+            notifier.notify()
+    return len(reaped)
+
+
+def start_reaper(interval, dispatcher=None, notifier=None):
+    def run():
+        logger = logging.getLogger('debile')
+        while True:
+            time.sleep(interval)
+            try:
+                reap_expired_jobs(dispatcher, notifier)
+            except:
+                logger.error("Error while reaping expired jobs", exc_info=True)
+
+    thread = threading.Thread(target=run, name="reaper")
+    thread.daemon = True
+    thread.start()
+
+
+class MetricsRequestHandlerMixIn(JSONRPCRequestHandlerMixIn):
+    def do_GET(self):
+        if self.path != "/metrics":
+            return self.report_404()
+
+        response = metrics.render(self.server.get_server_stats())
+        self.send_response(200)
+        self.send_header("Content-type", "text/plain; version=0.0.4")
+        self.send_header("Content-length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+
+class PooledRequestHandlerMixIn(MetricsRequestHandlerMixIn):
+    """
+    A connection served by the worker pool of the server. Instead of
+    handling all of its requests when it is created, it handles them one at
+    a time as the workers call handle_next(), and waits in the server's
+    ConnectionPoller in between.
+
+    A call waiting for work (see LongPoll) parks its request in the poller
+    too, and is made again from a worker when it might have some.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Seconds a client may take to send the rest of a request.
+    timeout = 30
+
+    def __init__(self, request, client_address, server):
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.close_connection = 1
+        self.poll = LongPoll()
+        self._body = None
+        self.setup()
+
+    def handle_next(self):
+        """
+        Resume the parked request, or handle the next request on the
+        connection and the ones the client already sent after it.
+        """
+        if self.poll.parked:
+            self._resume()
+        else:
+            self.close_connection = 1
+            self.handle_one_request()
+
+        while not (self.close_connection or self.poll.parked) and \
+                self.pending():
+            self.close_connection = 1
+            self.handle_one_request()
+
+    def pending(self):
+        """
+        Whether part of a request was read ahead in rfile (or decrypted
+        by the SSL socket), where polling the socket does not see it.
+        """
+        buffered = self.rfile._rbuf
+        buffered.seek(0, 2)
+        if buffered.tell():
+            return True
+        pending = getattr(self.connection, "pending", None)
+        return pending is not None and pending() > 0
+
+    def close(self):
+        try:
+            self.finish()
+        finally:
+            self.server.shutdown_request(self.request)
+
+    @contextmanager
+    def _session(self):
+        try:
+            with session() as s:
+                NAMESPACE.session = s
+                yield
+        finally:
+            NAMESPACE.session = None
+            NAMESPACE.machine = None
+            NAMESPACE.user = None
+
+    def handle_one_request(self):
+        with self._session():
+            SimpleXMLRPCRequestHandler.handle_one_request(self)
+
+        if DebileMasterInterface.shutdown_request:
+            check_shutdown()
+
+    def do_POST(self):
+        try:
+            length = int(self.headers["content-length"])
+        except (TypeError, ValueError):
+            return MetricsRequestHandlerMixIn.do_POST(self)
+
+        # Keep the body, to make the call again if it parks the request.
+        self.poll = LongPoll()
+        self._body = self.rfile.read(length)
+        self._post()
+
+    def _post(self):
+        """
+        Make the call, and send its response unless it parked the request.
+        """
+        rfile, wfile = self.rfile, self.wfile
+        self.rfile, self.wfile = StringIO(self._body), StringIO()
+        NAMESPACE.poll = self.poll
+        try:
+            MetricsRequestHandlerMixIn.do_POST(self)
+            response = self.wfile.getvalue()
+        finally:
+            NAMESPACE.poll = None
+            self.rfile, self.wfile = rfile, wfile
+
+        if not self.poll.parked:
+            self._body = None
+            self.wfile.write(response)
+            self.wfile.flush()
+
+    def _resume(self):
+        self.poll.recheck_at = None
+        with self._session():
+            # The builder might have been disabled in the meantime.
+            if self.authenticate():
+                self._post()
+            else:
+                self.send_error(401, 'Authentication failed')
+
+
+class DebileMasterAuthMixIn(PooledRequestHandlerMixIn):
     def authenticate(self):
         cert = self.connection.getpeercert(True)
         fingerprint = hashlib.sha1(cert).hexdigest().upper()
 
-        NAMESPACE.machine = NAMESPACE.session.query(Builder).filter_by(
-            ssl=fingerprint
-        ).first()
-        NAMESPACE.user = NAMESPACE.session.query(Person).filter_by(
-            ssl=fingerprint
-        ).first()
+        def load():
+            return (NAMESPACE.session.query(Builder).filter_by(
+                ssl=fingerprint
+            ).first(), NAMESPACE.session.query(Person).filter_by(
+                ssl=fingerprint
+            ).first())
+
+        NAMESPACE.machine, NAMESPACE.user = lookup.principals(
+            NAMESPACE.session, ("ssl", fingerprint), load)
 
         return NAMESPACE.machine or NAMESPACE.user
 
@@ -70,29 +273,19 @@ class DebileMasterAuthMixIn(SimpleXMLRPCRequestHandler):
                 self.send_error(401, 'Authentication failed')
         return False
 
-    def handle_one_request(self):
-        try:
-            with session() as s:
-                NAMESPACE.session = s
-                SimpleXMLRPCRequestHandler.handle_one_request(self)
-        finally:
-            NAMESPACE.session = None
-            NAMESPACE.machine = None
-            NAMESPACE.user = None
-
-        if DebileMasterInterface.shutdown_request:
-            check_shutdown()
-
-class DebileMasterSimpleAuthMixIn(SimpleXMLRPCRequestHandler):
+class DebileMasterSimpleAuthMixIn(PooledRequestHandlerMixIn):
     def authenticate(self):
         client_address, _ = self.client_address
-        NAMESPACE.machine = NAMESPACE.session.query(Builder).filter_by(
-            ip=client_address
-        ).first()
 
-        NAMESPACE.user = NAMESPACE.session.query(Person).filter_by(
-            ip=client_address
-        ).first()
+        def load():
+            return (NAMESPACE.session.query(Builder).filter_by(
+                ip=client_address
+            ).first(), NAMESPACE.session.query(Person).filter_by(
+                ip=client_address
+            ).first())
+
+        NAMESPACE.machine, NAMESPACE.user = lookup.principals(
+            NAMESPACE.session, ("ip", client_address), load)
 
         return NAMESPACE.machine or NAMESPACE.user
 
@@ -104,19 +297,6 @@ class DebileMasterSimpleAuthMixIn(SimpleXMLRPCRequestHandler):
                 self.send_error(401, 'Authentication failed')
         return False
 
-    def handle_one_request(self):
-        try:
-            with session() as s:
-                NAMESPACE.session = s
-                SimpleXMLRPCRequestHandler.handle_one_request(self)
-        finally:
-            NAMESPACE.session = None
-            NAMESPACE.machine = None
-            NAMESPACE.user = None
-
-        if DebileMasterInterface.shutdown_request:
-            check_shutdown()
-
 
 class SimpleAsyncXMLRPCServer(SocketServer.ThreadingMixIn,
                              DebileMasterSimpleAuthMixIn):
@@ -127,7 +307,301 @@ class AsyncXMLRPCServer(SocketServer.ThreadingMixIn, DebileMasterAuthMixIn):
     pass
 
 
-class SimpleAuthXMLRPCServer(SimpleXMLRPCServer):
+class BusyRequestHandler(JSONRPCRequestHandlerMixIn):
+    """
+    Answers every call, XML-RPC or JSON-RPC, with a BUSY_FAULT, without
+    authenticating or opening a database session.
+    """
+
+    # Don't let a slow client hold up the accepting thread.
+    timeout = 10
+
+    def _dispatch(self, method, params):
+        raise xmlrpclib.Fault(BUSY_FAULT, "The master is busy, try again later")
+
+
+class ConnectionPoller(object):
+    """
+    Watches the kept alive connections of the server between requests, and
+    hands them back to the server when their next request comes in. The
+    ones idle for more than the server's keepalive_timeout are closed.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self._lock = threading.Lock()
+        # Connection -> time it is closed at, or None.
+        self._idle = {}
+        # Connections with a parked request.
+        self._parked = set()
+        self._wakeup, self._waker = os.pipe()
+
+        thread = threading.Thread(target=self._run, name="poller")
+        thread.daemon = True
+        thread.start()
+
+    def add(self, connection):
+        timeout = self.server.keepalive_timeout
+        with self._lock:
+            self._idle[connection] = time.time() + timeout if timeout else None
+        self.wake()
+
+    def park(self, connection):
+        """
+        Hand `connection` back to the server once its parked request is due.
+        """
+        connection.poll.notifier.listen(self.wake)
+        with self._lock:
+            self._parked.add(connection)
+        self.wake()
+
+    def wake(self):
+        os.write(self._waker, "x")
+
+    def counts(self):
+        with self._lock:
+            return len(self._idle), len(self._parked)
+
+    def _poll(self, timeout):
+        with self._lock:
+            connections = dict((x.connection.fileno(), x) for x in self._idle)
+
+        poll = select.poll()
+        poll.register(self._wakeup, select.POLLIN)
+        for fd in connections:
+            poll.register(fd, select.POLLIN)
+
+        ready, closed = [], []
+        for fd, event in poll.poll(None if timeout is None else timeout * 1000):
+            if fd == self._wakeup:
+                os.read(self._wakeup, 4096)
+            elif self._closed_by_client(connections[fd]):
+                closed.append(connections[fd])
+            else:
+                ready.append(connections[fd])
+        return ready, closed
+
+    @staticmethod
+    def _closed_by_client(connection):
+        # Peek below the SSL layer, the socket is readable so this does
+        # not block.
+        try:
+            return connection.connection._sock.recv(1, socket.MSG_PEEK) == ""
+        except socket.error:
+            return True
+
+    def _run(self):
+        while True:
+            now = time.time()
+            with self._lock:
+                expired = [x for x, at in self._idle.items()
+                           if at is not None and at <= now]
+                for connection in expired:
+                    del self._idle[connection]
+                due = [x for x in self._parked if x.poll.due(now)]
+                self._parked.difference_update(due)
+                expiries = [x for x in self._idle.values() if x is not None]
+                expiries.extend(x.poll.recheck_at for x in self._parked)
+            for connection in expired:
+                self.server.drop_connection(connection)
+            for connection in due:
+                self.server.submit(connection)
+
+            timeout = max(0, min(expiries) - now) if expiries else None
+            try:
+                ready, closed = self._poll(timeout)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            with self._lock:
+                for connection in ready + closed:
+                    del self._idle[connection]
+            for connection in closed:
+                self.server.drop_connection(connection)
+            for connection in ready:
+                self.server.submit(connection)
+
+
+class WorkerPoolMixIn:
+    """
+    Handles requests in a fixed pool of `workers` threads, with up to
+    `queue_size` requests waiting for a worker. Requests coming in while the
+    queue is full get a BUSY_FAULT. Without workers, every request gets its
+    own thread.
+
+    A connection only holds a worker while one of its requests is handled.
+    In between, kept alive connections wait in a ConnectionPoller for their
+    next request, for up to `keepalive_timeout` seconds.
+    """
+
+    daemon_threads = True
+    workers = 0
+    queue_size = 0
+    keepalive_timeout = 75
+
+    _poller = None
+    _requests = None
+    _busy = 0
+    _handled = 0
+    _rejected = 0
+    _stats_lock = threading.Lock()
+
+    def _start(self):
+        self._requests = Queue.Queue()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name="worker-%d" % i)
+            thread.daemon = True
+            thread.start()
+        self._poller = ConnectionPoller(self)
+
+    def process_request(self, request, client_address):
+        if self._poller is None:
+            self._start()
+        self.submit(self.RequestHandlerClass(request, client_address, self))
+
+    def submit(self, connection):
+        """
+        Have a worker handle the next request on `connection`, or turn it
+        away if too many requests are waiting for one already.
+        """
+        if not self.workers:
+            thread = threading.Thread(target=self._handle, args=(connection,))
+            thread.daemon = self.daemon_threads
+            thread.start()
+            return
+
+        with self._stats_lock:
+            # Parked requests were let in already, they are not turned away.
+            full = not connection.poll.parked and \
+                self._requests.qsize() >= (self.queue_size or self.workers)
+            if full:
+                self._rejected += 1
+            else:
+                self._requests.put(connection)
+        if full:
+            try:
+                BusyRequestHandler(connection.request,
+                                   connection.client_address, self)
+            except:
+                self.handle_error(connection.request, connection.client_address)
+            self.drop_connection(connection)
+
+    def drop_connection(self, connection):
+        try:
+            connection.close()
+        except:
+            self.handle_error(connection.request, connection.client_address)
+
+    def _handle(self, connection):
+        with self._stats_lock:
+            self._busy += 1
+        parked = keep = False
+        try:
+            connection.handle_next()
+            parked = connection.poll.parked
+            keep = not connection.close_connection
+        except:
+            self.handle_error(connection.request, connection.client_address)
+        finally:
+            with self._stats_lock:
+                self._busy -= 1
+                if not parked:
+                    self._handled += 1
+
+        if parked:
+            self._poller.park(connection)
+        elif keep:
+            self._poller.add(connection)
+        else:
+            self.drop_connection(connection)
+
+    def _work(self):
+        while True:
+            self._handle(self._requests.get())
+
+    def get_server_stats(self):
+        """
+        Get the request counters of the master.
+        """
+        idle, parked = self._poller.counts() if self._poller else (0, 0)
+        with self._stats_lock:
+            return {
+                "workers": self.workers,
+                "busy_workers": self._busy,
+                "queue_size": self.queue_size,
+                "queue_length": self._requests.qsize() if self._requests else 0,
+                "idle_connections": idle,
+                "parked_requests": parked,
+                "handled": self._handled,
+                "rejected": self._rejected,
+            }
+
+
+class MetricsMixIn:
+    def _dispatch(self, method, params):
+        with metrics.rpc(self._metric_name(method),
+                         getattr(NAMESPACE, 'poll', None)):
+            return SimpleXMLRPCServer._dispatch(self, method, params)
+
+    def _metric_name(self, method):
+        # Whatever else clients send shares one series, the metrics must
+        # not grow with every made up method name.
+        if method in self.funcs:
+            return method
+        if self.instance is not None and not method.startswith('_') and \
+                callable(getattr(self.instance, method, None)):
+            return method
+        return "other"
+
+    def get_stats(self):
+        """
+        Get the job counts, RPC timings, builder pings and uploads.
+        """
+        return metrics.get_stats(self.get_server_stats())
+
+
+class MultiCallMixIn:
+    """
+    system.multicall running all calls in the session of the request, each
+    in its own savepoint so a failing call leaves the others be.
+    """
+
+    def system_multicall(self, call_list):
+        # The calls can't park the request, get_next_job doesn't wait.
+        poll, NAMESPACE.poll = getattr(NAMESPACE, 'poll', None), None
+        try:
+            return self._multicall(call_list)
+        finally:
+            NAMESPACE.poll = poll
+
+    def _multicall(self, call_list):
+        results = []
+        for call in call_list:
+            savepoint = NAMESPACE.session.begin_nested()
+            try:
+                result = self._dispatch(call['methodName'], call['params'])
+            except:
+                if savepoint.is_active:
+                    savepoint.rollback()
+                exc_type, exc_value = sys.exc_info()[:2]
+                if isinstance(exc_value, xmlrpclib.Fault):
+                    results.append({'faultCode': exc_value.faultCode,
+                                    'faultString': exc_value.faultString})
+                else:
+                    results.append({'faultCode': 1, 'faultString': "%s:%s" % (
+                        exc_type, exc_value)})
+            else:
+                # Calls committing themselves already released it.
+                if savepoint.is_active:
+                    savepoint.commit()
+                results.append([result])
+        return results
+
+
+class SimpleAuthXMLRPCServer(MetricsMixIn, MultiCallMixIn, WorkerPoolMixIn,
+                             SimpleXMLRPCServer):
     def __init__(self, addr,
                  requestHandler=SimpleXMLRPCRequestHandler,
                  bind_and_activate=True,
@@ -139,7 +613,8 @@ class SimpleAuthXMLRPCServer(SimpleXMLRPCServer):
 
 
 
-class SecureXMLRPCServer(SimpleXMLRPCServer):
+class SecureXMLRPCServer(MetricsMixIn, MultiCallMixIn, WorkerPoolMixIn,
+                         SimpleXMLRPCServer):
     def __init__(
         self, addr, keyfile, certfile, ca_certs,
         requestHandler=SimpleXMLRPCRequestHandler, logRequests=True,
@@ -152,20 +627,31 @@ class SecureXMLRPCServer(SimpleXMLRPCServer):
                                     encoding=encoding,
                                     bind_and_activate=False)
 
-        cert_reqs = (ssl.CERT_NONE if ca_certs is None
-                     else ssl.CERT_REQUIRED)
-        self.socket = ssl.wrap_socket(self.socket,
-                                      keyfile=keyfile, certfile=certfile,
-                                      ca_certs=ca_certs, cert_reqs=cert_reqs,
-                                      ssl_version=ssl.PROTOCOL_TLSv1)
+        # TLS 1.2 or later, with the default ciphers of the ssl module.
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH,
+                                             cafile=ca_certs)
+        context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
+        context.verify_mode = (ssl.CERT_NONE if ca_certs is None
+                               else ssl.CERT_REQUIRED)
+        context.load_cert_chain(certfile, keyfile)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
 
         if bind_and_activate:
             self.server_bind()
             self.server_activate()
 
 
+def get_capabilities():
+    """
+    Get the protocols spoken by the master, besides XML-RPC.
+    """
+    return {"json-rpc": jsonrpc.CAPABILITY}
+
+
 def serve(server_addr, port, auth_method,
-          keyfile=None, certfile=None, ssl_keyring=None, pgp_keyring=None):
+          keyfile=None, certfile=None, ssl_keyring=None, pgp_keyring=None,
+          dispatcher=None, lease=None, reap_interval=60, policy=None,
+          workers=0, queue_size=0, keepalive=None):
     logger = logging.getLogger('debile')
     logger.info("Serving on `{server_addr}' on port `{port}'".format(**locals()))
     logger.info("Authentication method: {0}".format(auth_method))
@@ -174,6 +660,15 @@ def serve(server_addr, port, auth_method,
                     "ssl_keyring=`{ssl_keyring}'".format(**locals()))
     logger.info("Using pgp_keyring=`{pgp_keyring}'".format(**locals()))
 
+    if dispatcher is not None and policy is not None and not policy.dispatchable:
+        logger.warning("The in-memory dispatch queues can't be used with "
+                       "the {0} scheduler".format(policy.__class__.__name__))
+        dispatcher = None
+
+    if dispatcher is not None:
+        logger.info("Using in-memory dispatch queues")
+        dispatcher.start()
+
     server = None
     if auth_method == 'simple':
         server = SimpleAuthXMLRPCServer((server_addr, port),
@@ -186,8 +681,30 @@ def serve(server_addr, port, auth_method,
                                 requestHandler=AsyncXMLRPCServer,
                                 allow_none=True)
 
+    if keepalive is not None:
+        server.keepalive_timeout = keepalive
+
+    if workers:
+        logger.info("Using {0} workers and a queue of {1} requests".format(
+            workers, queue_size))
+        server.workers = workers
+        server.queue_size = queue_size
+
+    interface = DebileMasterInterface(
+        ssl_keyring, pgp_keyring, dispatcher,
+        timedelta(seconds=lease) if lease else None, policy)
+
+    if lease:
+        logger.info("Leasing jobs for {0} seconds".format(lease))
+        start_reaper(reap_interval, dispatcher, interface.notifier)
+
     server.register_introspection_functions()
-    server.register_instance(DebileMasterInterface(ssl_keyring, pgp_keyring))
+    server.register_multicall_functions()
+    server.register_function(get_capabilities, "system.getCapabilities")
+    server.register_function(server.get_server_stats)
+    server.register_function(server.get_stats)
+    metrics.install()
+    server.register_instance(interface)
     server.serve_forever()
 
 def system_exit_handler(signum, frame):
@@ -199,6 +716,10 @@ def shutdown_request_handler(signum, frame):
     check_shutdown()
 
 
+def profile_request_handler(signum, frame):
+    metrics.toggle_profiling()
+
+
 def main(args, config):
     start_logging(args)
 
@@ -208,6 +729,7 @@ def main(args, config):
 
     signal.signal(signal.SIGHUP,  signal.SIG_IGN)
     signal.signal(signal.SIGUSR1, shutdown_request_handler)
+    signal.signal(signal.SIGUSR2, profile_request_handler)
 
     logger = logging.getLogger('debile')
 
@@ -222,9 +744,29 @@ def main(args, config):
         if not os.path.isfile(config['keyrings']['ssl']):
             logger.error("Can not find ssl keyring `{file}'".format(file=config['keyrings']['ssl']))
 
+    lookup.PRINCIPAL_TTL = config['xmlrpc'].get('auth_cache_ttl',
+                                                lookup.PRINCIPAL_TTL)
+
+    metrics.SNAPSHOT_INTERVAL = config.get('metrics', {}).get(
+        'snapshot_interval', metrics.SNAPSHOT_INTERVAL)
+    metrics.SLOW_RPC = config.get('metrics', {}).get('slow_rpc')
+    metrics.PROFILE_PATH = config.get('metrics', {}).get(
+        'profile_path', metrics.PROFILE_PATH)
+
+    dispatcher = None
+    if config.get('dispatcher', {}).get('enabled', False):
+        dispatcher = Dispatcher(config['dispatcher'].get('rebuild_interval', 60))
+
     serve(config['xmlrpc']['addr'], config['xmlrpc']['port'],
           args.auth_method,
           config['xmlrpc'].get('keyfile'),
           config['xmlrpc'].get('certfile'),
           config['keyrings'].get('ssl'),
-          config["keyrings"].get('pgp'))
+          config["keyrings"].get('pgp'),
+          dispatcher,
+          config.get('leases', {}).get('duration'),
+          config.get('leases', {}).get('reap_interval', 60),
+          get_policy(config.get('scheduler')),
+          config['xmlrpc'].get('workers', 0),
+          config['xmlrpc'].get('queue_size', 0),
+          config['xmlrpc'].get('keepalive_timeout'))
@@ -0,0 +1,179 @@
+# Copyright (c) 2012-2013 Paul Tagliamonte <paultag@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Verification of the signatures on .changes and .dud files.
+
+Results are cached by the sha256 of the file and the state of the keyring,
+so a file is checked by gpg once for as long as the keyring is unchanged.
+gpg checks a private copy of the bytes that were hashed, so a file swapped
+in the meantime can't get the verdict of another one. Failures to run gpg
+are not cached. verify_many() checks a whole batch of files with a single
+gpg process.
+"""
+
+from debile.utils.commands import run_command
+
+from collections import OrderedDict
+
+import threading
+import tempfile
+import hashlib
+import shutil
+import os
+
+
+CACHE_SIZE = 4096
+
+# Most files handed to one gpg, to keep its command line short.
+GPG_BATCH = 256
+
+# gpg did not run, or said nothing we understand: worth another try.
+UNKNOWN_PROBLEM = "Unknown problem while verifying signature"
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+
+class SignatureError(Exception):
+    pass
+
+
+def _keyring_state(keyring):
+    st = os.stat(keyring)
+    return (keyring, st.st_ino, st.st_size, st.st_mtime)
+
+
+def _result(status):
+    """
+    Returns the (fingerprint, error) verdict of gpg's status lines about a
+    file.
+    """
+    if '[GNUPG:] GOODSIG' in status:
+        pass
+    elif '[GNUPG:] BADSIG' in status:
+        return None, "Bad signature"
+    elif '[GNUPG:] ERRSIG' in status:
+        return None, "Error verifying signature"
+    elif '[GNUPG:] NODATA' in status:
+        return None, "No signature on"
+    else:
+        return None, UNKNOWN_PROBLEM
+
+    key = None
+    for line in status.split("\n"):
+        if line.startswith('[GNUPG:] VALIDSIG'):
+            key = line.split()[2]
+    return key, None
+
+
+def _gpg(keyring, *args):
+    output, stderr, exit_status = run_command([
+        "gpg", "--batch", "--status-fd", "1",
+        "--no-default-keyring", "--keyring", keyring,
+    ] + list(args))
+    if exit_status == -1:
+        return None
+    return output
+
+
+def _verify_batch(paths, keyring):
+    """
+    Verify `paths` with one gpg process, as far as it gets: gpg stops at
+    the first bad signature. Returns the results for the files it saw.
+    """
+    output = _gpg(keyring, "--verify-files", *paths)
+    if output is None:
+        return [(None, UNKNOWN_PROBLEM)]
+
+    sections = output.split("[GNUPG:] FILE_START ")[1:]
+    if not sections:
+        # An older gpg, without FILE_START and FILE_DONE.
+        output = _gpg(keyring, "--verify", paths[0])
+        if output is None:
+            return [(None, UNKNOWN_PROBLEM)]
+        return [_result(output)]
+    return [_result(x) for x in sections[:len(paths)]]
+
+
+def verify_many(paths, keyring):
+    """
+    Returns a dict of the (fingerprint, error) verdicts on the signatures
+    of `paths`, one of them being None.
+    """
+    state = _keyring_state(keyring)
+    data = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            data[path] = f.read()
+    keys = dict((path, (hashlib.sha256(data[path]).hexdigest(),) + state)
+                for path in paths)
+
+    results = {}
+    with _lock:
+        for path in paths:
+            if keys[path] in _cache:
+                results[path] = _cache[keys[path]]
+
+    todo = [x for x in paths if x not in results]
+    if todo:
+        # gpg gets the very bytes that were hashed, not the file again.
+        directory = tempfile.mkdtemp(prefix="debile-verify-")
+        try:
+            copies = {}
+            for i, path in enumerate(todo):
+                copies[path] = os.path.join(directory, "%d-%s" % (
+                    i, os.path.basename(path)))
+                with open(copies[path], "wb") as f:
+                    f.write(data[path])
+
+            while todo:
+                batch = _verify_batch([copies[x] for x in todo[:GPG_BATCH]],
+                                      keyring)
+                for path, result in zip(todo, batch):
+                    results[path] = result
+                todo = todo[len(batch):]
+        finally:
+            shutil.rmtree(directory)
+
+    with _lock:
+        for path in paths:
+            _cache.pop(keys[path], None)
+            if results[path][1] != UNKNOWN_PROBLEM:
+                _cache[keys[path]] = results[path]
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return results
+
+
+def verify(path, keyring):
+    """
+    Returns the fingerprint of the key `path` is signed with, or raises a
+    SignatureError.
+    """
+    fingerprint, error = verify_many([path], keyring)[path]
+    if error is not None:
+        raise SignatureError(error)
+    return fingerprint
+
+
+def invalidate():
+    with _lock:
+        _cache.clear()
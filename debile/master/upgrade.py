@@ -0,0 +1,157 @@
+# Copyright (c) 2012-2013 Paul Tagliamonte <paultag@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from sqlalchemy import inspect
+from sqlalchemy.sql import exists, select, func, bindparam
+
+from debile.master.utils import session
+from debile.master.orm import Source, Job, job_dependencies
+from debile.master.versions import version_sort_key
+
+
+def _has_column(s, table, name):
+    columns = inspect(s.connection()).get_columns(table.name)
+    return name in [x['name'] for x in columns]
+
+
+def _add_column(s, column):
+    """
+    Add `column` to its (existing) table. The column is always added as
+    nullable, it is up to the caller to backfill it.
+    """
+    bind = s.connection()
+    if hasattr(column.type, "create"):
+        # Enums and other schema types might need a CREATE TYPE first.
+        column.type.create(bind, checkfirst=True)
+    s.execute("ALTER TABLE {table} ADD COLUMN {column} {type}".format(
+        table=column.table.name,
+        column=column.name,
+        type=column.type.compile(dialect=bind.dialect),
+    ))
+
+
+def _create_indexes(s, table, *names):
+    existing = [x['name'] for x in inspect(s.connection()).get_indexes(table.name)]
+    for index in table.indexes:
+        if index.name in names and index.name not in existing:
+            index.create(s.connection())
+
+
+def upgrade_job_state(s):
+    """
+    Add the jobs.state column, derived from the other job columns.
+    """
+    jobs = Job.__table__
+    if _has_column(s, jobs, "state"):
+        return False
+
+    _add_column(s, jobs.c.state)
+
+    # Same precedence as Job.update_state(), lowest first.
+    for state, condition in [
+        ("ready", None),
+        ("blocked", (jobs.c.dose_report != None) | exists().where(
+            job_dependencies.c.blocking_job_id == jobs.c.id)),
+        ("assigned", jobs.c.assigned_at != None),
+        ("finished", (jobs.c.finished_at != None) | (jobs.c.failed != None)),
+        ("failed", jobs.c.failed == True),
+    ]:
+        query = jobs.update().values(state=state)
+        if condition is not None:
+            query = query.where(condition)
+        s.execute(query)
+
+    _create_indexes(s, jobs, 'ix_jobs_state', 'ix_jobs_ready')
+    _create_indexes(s, Source.__table__, 'ix_sources_group_suite_component')
+    return True
+
+
+def upgrade_job_dependency_counters(s):
+    """
+    Add the jobs.pending_dependencies counter and job_dependencies.resolved.
+    Until now resolved dependencies were deleted, so all remaining ones are
+    still pending.
+    """
+    jobs = Job.__table__
+    edges = job_dependencies
+    if _has_column(s, jobs, "pending_dependencies"):
+        return False
+
+    _add_column(s, edges.c.resolved)
+    s.execute(edges.update().values(resolved=False))
+
+    _add_column(s, jobs.c.pending_dependencies)
+    s.execute(jobs.update().values(pending_dependencies=select(
+        [func.count()]).where(edges.c.blocking_job_id == jobs.c.id).as_scalar()))
+
+    _create_indexes(s, edges, 'ix_job_dependencies_blocked_job_id')
+    return True
+
+
+def upgrade_job_lease(s):
+    """
+    Add the jobs.lease_expires_at column. Jobs assigned before the upgrade
+    keep no lease, and are never reaped.
+    """
+    jobs = Job.__table__
+    if _has_column(s, jobs, "lease_expires_at"):
+        return False
+
+    _add_column(s, jobs.c.lease_expires_at)
+    return True
+
+
+def upgrade_source_version_key(s):
+    """
+    Add the sources.version_key column and backfill it.
+    """
+    sources = Source.__table__
+    if _has_column(s, sources, "version_key"):
+        return False
+
+    _add_column(s, sources.c.version_key)
+    rows = s.execute(select([sources.c.id, sources.c.version])).fetchall()
+    if rows:
+        s.execute(sources.update().where(
+            sources.c.id == bindparam('_id')
+        ).values(version_key=bindparam('_key')), [
+            {'_id': id, '_key': version_sort_key(version)}
+            for id, version in rows
+        ])
+
+    _create_indexes(s, sources, 'ix_sources_group_suite_name_version')
+    return True
+
+
+UPGRADES = [
+    upgrade_job_state,
+    upgrade_job_dependency_counters,
+    upgrade_job_lease,
+    upgrade_source_version_key,
+]
+
+
+def main(args, config):
+    for upgrade in UPGRADES:
+        with session() as s:
+            if upgrade(s):
+                print "Applied %s" % upgrade.__name__
+            else:
+                print "Skipped %s, already applied" % upgrade.__name__
@@ -22,13 +22,14 @@ from debile.utils.config import get_config
 
 from contextlib import contextmanager
 from importlib import import_module
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 
 config = {}
 Session = sessionmaker()
 fedmsg = None
+deferred_emits = None
 
 
 def _init_config(path):
@@ -38,6 +39,19 @@ def _init_config(path):
 
 def _init_sqlalchemy(config):
     engine = create_engine(config['database'], implicit_returning=False)
+    if engine.dialect.name == "sqlite":
+        # pysqlite starts and ends transactions on its own, which breaks
+        # savepoints. Leave it to SQLAlchemy, and enable foreign keys
+        # while not in a transaction.
+        @event.listens_for(engine, "connect")
+        def connect(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+            dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+        @event.listens_for(engine, "begin")
+        def begin(connection):
+            connection.execute("BEGIN")
+
     Session.configure(bind=engine)
 
 
@@ -71,9 +85,6 @@ def init_master(confpath=None, fedmsg=True):
 @contextmanager
 def session():
     session_ = Session()
-    if session_.get_bind().driver == "sqlite":
-        print("Explicitly enabling foreign keys in sqlite")
-        session_.execute("PRAGMA foreign_keys=ON")
 
     try:
         yield session_
@@ -85,7 +96,26 @@ def session():
         session_.close()
 
 
+def defer_emits():
+    """
+    Keep the messages of emit() for take_deferred_emits() from now on, for
+    forked processes that can't use the fedmsg sockets of their parent.
+    """
+    global deferred_emits
+    deferred_emits = []
+
+
+def take_deferred_emits():
+    messages = deferred_emits[:]
+    del deferred_emits[:]
+    return messages
+
+
 def emit(topic, modname, message):
+    if deferred_emits is not None:
+        deferred_emits.append((topic, modname, message))
+        return
+
     # <topic_prefix>.<env>.<modname>.<topic>
     modname = "debile.%s" % (modname)
     if fedmsg:
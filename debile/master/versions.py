@@ -0,0 +1,69 @@
+# Copyright (c) 2012-2013 Paul Tagliamonte <paultag@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import re
+
+
+_PART = re.compile(r"([^0-9]*)([0-9]*)")
+
+# Byte values used in the sort keys. "~" sorts before the end of a string,
+# which sorts before letters, which sort before everything else.
+_TILDE = "\x01"
+_END = "\x02"
+
+
+def _number(digits):
+    digits = digits.lstrip("0")
+    return chr(len(digits)) + digits
+
+
+def _char(c):
+    if c == "~":
+        return _TILDE
+    if c.isalpha():
+        return c
+    return chr(0x80 + ord(c))
+
+
+def _part_key(part):
+    # An empty part compares equal to "0".
+    part = part or "0"
+    key = []
+    for text, digits in _PART.findall(part):
+        if not text and not digits:
+            continue
+        key.extend(_char(c) for c in text)
+        key.append(_END)
+        key.append(_number(digits))
+    key.append(_END)
+    return "".join(key)
+
+
+def version_sort_key(version):
+    """
+    Returns a byte string that sorts (byte-wise) the same way dpkg sorts the
+    Debian version `version`.
+    """
+    # Versions are plain ASCII, but might come in as unicode.
+    version = str(version)
+    epoch, _, rest = version.partition(":") if ":" in version else ("", "", version)
+    upstream, _, revision = rest.rpartition("-") if "-" in rest else (rest, "", "")
+
+    return _number(epoch) + _part_key(upstream) + _part_key(revision)
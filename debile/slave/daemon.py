@@ -23,6 +23,7 @@ from debile.slave.commands import PLUGINS, load_module
 from debile.slave.utils import tdir, cd, upload
 from debile.utils.commands import safe_run
 from debile.utils.log import start_logging
+from debile.utils.xmlrpc import get_proxy, is_busy
 from debile.utils.deb822 import Changes
 
 from contextlib import contextmanager
@@ -31,7 +32,9 @@ from firehose.model import (Analysis, Generator, Metadata,
                             DebianBinary, DebianSource)
 
 import sys
+import random
 import signal
+import threading
 import logging
 import time
 import os.path
@@ -103,12 +106,13 @@ def checkout(package):
 
 
 @contextmanager
-def workon(proxy, suites, components, arches, capabilities):
+def workon(proxy, suites, components, arches, capabilities, wait=0):
     logger = logging.getLogger('debile')
     logger.debug("Checking for new jobs")
 
     try:
-        job = proxy.get_next_job(suites, components, arches, capabilities)
+        job = proxy.get_next_job(suites, components, arches, capabilities,
+                                 wait)
     except:
         logger.error("Error while requesting a job from the master", exc_info=True)
         raise
@@ -176,6 +180,35 @@ def workon(proxy, suites, components, arches, capabilities):
             raise
 
 
+@contextmanager
+def heartbeat(proxy, job, interval):
+    """
+    Keep extending the lease on `job` from a background thread. `proxy`
+    has to come from get_proxy(), whose transport takes one call at a time.
+    """
+    logger = logging.getLogger('debile')
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                if not proxy.heartbeat_job(job['id']):
+                    logger.warning("Job id=%s is no longer assigned to us",
+                                   job['id'])
+            except:
+                logger.warning("Error while sending a heartbeat to the master",
+                               exc_info=True)
+
+    thread = threading.Thread(target=run, name="heartbeat")
+    thread.daemon = True
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
 def run_job(config, job):
     group = job['group_obj']
     source = job['source_obj']
@@ -292,17 +325,30 @@ def main(args, config, proxy):
     arches = config['arches']
     checks = config.get('checks', list(PLUGINS.keys()))
 
+    heartbeat_interval = config.get('heartbeat_interval', 60)
+    # The master holds on to get_next_job for up to this many seconds when
+    # there is nothing to do, keep it below the 60 seconds xmlrpc timeout.
+    wait = config.get('poll_wait', 45)
+
     while True:
         try:
-            with workon(proxy, suites, components, arches, checks) as job:
-                run_job(config, job)
+            with workon(proxy, suites, components, arches, checks,
+                        wait) as job:
+                with heartbeat(proxy, job, heartbeat_interval):
+                    run_job(config, job)
             if shutdown_request:
                 raise SystemExit(0)
         except KeyboardInterrupt:
             raise SystemExit(1)
         except SystemExit:
             raise
-        except:
+        except IDidNothingException:
+            if shutdown_request:
+                raise SystemExit(0)
+            if not wait:
+                time.sleep(60)
+        except Exception as e:
             if shutdown_request:
                 raise SystemExit(0)
-            time.sleep(60)
+            # Spread out the builders coming back to a busy master.
+            time.sleep(random.randint(5, 30) if is_busy(e) else 60)
@@ -0,0 +1,117 @@
+# Copyright (c) 2012-2013 Paul Tagliamonte <paultag@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Compute all the digests of a file in a single read, and check them against
+the Files and Checksums-* fields of .changes, .dsc and .dud files.
+"""
+
+from multiprocessing.pool import ThreadPool
+
+import hashlib
+import os
+
+
+# Digest name -> (field, key of the digest in the field)
+FIELDS = {
+    "md5": ("Files", "md5sum"),
+    "sha1": ("Checksums-Sha1", "sha1"),
+    "sha256": ("Checksums-Sha256", "sha256"),
+}
+
+# hashlib releases the GIL on large updates, big reads keep it released.
+CHUNK_SIZE = 1024 * 1024
+
+# Uploads with more data than this are hashed with THREADS threads.
+PARALLEL_THRESHOLD = 32 * 1024 * 1024
+THREADS = 4
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def file_digests(path, algorithms=("md5", "sha1", "sha256")):
+    """
+    Returns a dict of the hex digests of the file at `path`.
+    """
+    hashes = [(x, hashlib.new(x)) for x in algorithms]
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            for name, hash in hashes:
+                hash.update(chunk)
+    return dict((name, hash.hexdigest()) for name, hash in hashes)
+
+
+def digests_many(paths, algorithms=("md5", "sha1", "sha256")):
+    """
+    Returns a dict of the file_digests() of `paths`, hashed in parallel when
+    they are large enough to be worth it.
+    """
+    if len(paths) > 1 and sum(
+            os.path.getsize(x) for x in paths) > PARALLEL_THRESHOLD:
+        pool = ThreadPool(min(THREADS, len(paths)))
+        try:
+            digests = pool.map(lambda x: file_digests(x, algorithms), paths)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        digests = [file_digests(x, algorithms) for x in paths]
+    return dict(zip(paths, digests))
+
+
+def expected_digests(data):
+    """
+    Returns {name: {digest: value}} from the checksum fields of `data`, a
+    deb822 mapping.
+    """
+    expected = {}
+    for algorithm, (field, key) in FIELDS.items():
+        for entry in data.get(field) or []:
+            expected.setdefault(entry['name'], {})[algorithm] = entry[key]
+    return expected
+
+
+def validate(data, directory, require="md5"):
+    """
+    Check the files listed in `data` against every digest it gives for
+    them, reading each file once. The `require` digest has to be given for
+    every file. Raises a ChecksumError on the first problem.
+    """
+    if require == "md5sum":
+        require = "md5"
+    if require not in FIELDS:
+        raise ValueError("Unknown digest %s" % require)
+
+    expected = expected_digests(data)
+    for name, digests in expected.items():
+        if require not in digests:
+            raise ChecksumError("No %s checksum for file %s" % (require, name))
+
+    algorithms = sorted(set(x for digests in expected.values()
+                            for x in digests))
+    paths = dict((os.path.join(directory, name), name) for name in expected)
+    actual = digests_many(sorted(paths), algorithms)
+    for path in sorted(paths):
+        for algorithm, value in sorted(expected[paths[path]].items()):
+            if actual[path][algorithm] != value:
+                raise ChecksumError("Checksum mismatch for file %s: %s != %s" % (
+                    path, actual[path][algorithm], value))
@@ -21,9 +21,16 @@
 
 from debile.utils.config import get_config
 from debile.utils.xmlrpc import get_proxy
+
+import xmlrpclib
+import shlex
 import sys
 
 
+# Commands sent to the master in a single batch request.
+BATCH_SIZE = 200
+
+
 def _create_slave(proxy, name, pgp, ssl):
     """
         Create a slave:
@@ -44,7 +51,7 @@ def _create_slave(proxy, name, pgp, ssl):
         print("   %s when trying to open %s" % (str(e), ssl))
         raise
 
-    print(proxy.create_builder(name, pgp, ssl))
+    return proxy.create_builder(name, pgp, ssl)
 
 
 def _update_slave_keys(proxy, name, pgp, ssl):
@@ -67,7 +74,7 @@ def _update_slave_keys(proxy, name, pgp, ssl):
         print("   %s when trying to open %s" % (str(e), ssl))
         raise
 
-    print(proxy.update_builder_keys(name, pgp, ssl))
+    return proxy.update_builder_keys(name, pgp, ssl)
 
 
 def _disable_slave(proxy, name):
@@ -76,7 +83,7 @@ def _disable_slave(proxy, name):
             debile-remote disable-slave <name>
     """
 
-    print(proxy.disable_builder(name))
+    return proxy.disable_builder(name)
 
 
 def _create_user(proxy, name, email, pgp, ssl):
@@ -99,7 +106,7 @@ def _create_user(proxy, name, email, pgp, ssl):
         print("   %s when trying to open %s" % (str(e), ssl))
         raise
 
-    print(proxy.create_user(name, email, pgp, ssl))
+    return proxy.create_user(name, email, pgp, ssl)
 
 
 def _update_user_keys(proxy, email, pgp, ssl):
@@ -122,7 +129,7 @@ def _update_user_keys(proxy, email, pgp, ssl):
         print("   %s when trying to open %s" % (str(e), ssl))
         raise
 
-    print(proxy.update_user_keys(email, pgp, ssl))
+    return proxy.update_user_keys(email, pgp, ssl)
 
 
 def _disable_user(proxy, email):
@@ -131,7 +138,7 @@ def _disable_user(proxy, email):
             debile-remote disable-user <email>
     """
 
-    print(proxy.disable_user(email))
+    return proxy.disable_user(email)
 
 
 def _rerun_job(proxy, job_id):
@@ -140,7 +147,7 @@ def _rerun_job(proxy, job_id):
         debile-remote rerun-job <job-id>
     """
 
-    print(proxy.rerun_job(job_id))
+    return proxy.rerun_job(job_id)
 
 
 def _rerun_check(proxy, name):
@@ -149,7 +156,7 @@ def _rerun_check(proxy, name):
         debile-remote rerun-check <check-name>
     """
 
-    print(proxy.rerun_check(name))
+    return proxy.rerun_check(name)
 
 
 def _retry_failed(proxy):
@@ -158,7 +165,26 @@ def _retry_failed(proxy):
         debile-remote retry-failed
     """
 
-    print(proxy.retry_failed())
+    return proxy.retry_failed()
+
+
+def _rerun_jobs(proxy, *args):
+    """
+    Re-runs all finished jobs matching the given filters:
+        debile-remote rerun-jobs [suite=<suites>] [group=<groups>] [arch=<arches>] [check=<checks>] [build=yes|no] [failed=yes|no] [finished-after=<date>] [finished-before=<date>]
+    """
+    filter = {}
+    for arg in args:
+        key, _, value = arg.partition("=")
+        key = key.replace("-", "_")
+        if key in ["build", "failed"]:
+            filter[key] = value in ["yes", "true", "1"]
+        elif key in ["suite", "group", "arch", "check"]:
+            filter[key] = value.split(",")
+        else:
+            filter[key] = value
+
+    return proxy.rerun_jobs(filter)
 
 
 def _set_check(proxy, check, *args):
@@ -166,7 +192,7 @@ def _set_check(proxy, check, *args):
     Add a check to the database or configure an existing one:
         debile-remote set-check <check-name> [source] [binary] [build]
     """
-    print(proxy.set_check(check, *args))
+    return proxy.set_check(check, *args)
 
 
 def _enable_check(proxy, check, group, suite):
@@ -174,7 +200,7 @@ def _enable_check(proxy, check, group, suite):
     Enable a check for a given group/suite
         debile-remote enable-check <check> <group> <suite>
     """
-    print(proxy.enable_check(check, group, suite))
+    return proxy.enable_check(check, group, suite)
 
 
 def _list_checks(proxy, *args):
@@ -182,7 +208,34 @@ def _list_checks(proxy, *args):
     List checks
         debile-remote list-checks
     """
-    print(proxy.list_checks(*args))
+    return proxy.list_checks(*args)
+
+
+def _batch(proxy, filename):
+    """
+    Run the commands of a file, one per line, in chunks of BATCH_SIZE
+    calls. Each chunk is a single request and database transaction:
+        debile-remote batch <file>
+    """
+    with open(filename) as f:
+        lines = [(n, shlex.split(line)) for n, line in enumerate(f, 1)]
+    lines = [(n, args) for n, args in lines
+             if args and not args[0].startswith("#")]
+
+    for x in range(0, len(lines), BATCH_SIZE):
+        chunk = lines[x:x + BATCH_SIZE]
+        multicall = xmlrpclib.MultiCall(proxy)
+        for n, args in chunk:
+            if args[0] not in COMMANDS or args[0] == "batch":
+                raise ValueError("line %d: unknown command %s" % (n, args[0]))
+            COMMANDS[args[0]](multicall, *args[1:])
+
+        results = multicall()
+        for i, (n, args) in enumerate(chunk):
+            try:
+                print("%d: %s" % (n, results[i]))
+            except xmlrpclib.Fault as e:
+                print("%d: error: %s" % (n, e.faultString))
 
 
 def _help():
@@ -201,9 +254,11 @@ COMMANDS = {
     "rerun-job": _rerun_job,
     "rerun-check": _rerun_check,
     "retry-failed": _retry_failed,
+    "rerun-jobs": _rerun_jobs,
     "enable-check": _enable_check,
     "list-checks": _list_checks,
     "set-check": _set_check,
+    "batch": _batch,
 
 }
 
@@ -219,4 +274,6 @@ def main():
     config = get_config("user.yaml")
     proxy = get_proxy(config)
 
-    return run(proxy, *args)
+    result = run(proxy, *args)
+    if result is not None:
+        print(result)
@@ -21,7 +21,7 @@
 
 from debian.deb822 import _gpg_multivalued
 from debian.deb822 import Changes as Changes_
-import hashlib
+from debile.utils.checksums import FIELDS, file_digests
 import os
 
 
@@ -42,30 +42,21 @@ class Changes(Changes_):
         statinfo = os.stat(fp)
         size = statinfo.st_size
 
-        algos = {
-            "Files": "md5",
-            "Checksums-Sha1": "sha1",
-            "Checksums-Sha256": "sha256",
-        }
+        digests = file_digests(fp)
 
-        for key, algo in algos.items():
+        for algo, (key, _) in FIELDS.items():
             if key not in self:
                 self[key] = []
 
-            m = hashlib.new(algo)
-            with open(fp, "rb") as fd:
-                for chunk in iter((lambda: fd.read(128 * m.block_size)), b''):
-                    m.update(chunk)
-
             if key != "Files":
                 self[key].append({
-                    algo: m.hexdigest(),
+                    algo: digests[algo],
                     "size": size,
                     "name": fp
                 })
             else:
                 self[key].append({
-                    "md5sum": m.hexdigest(),
+                    "md5sum": digests[algo],
                     "size": size,
                     "section": 'debile',
                     "priority": 'debile',
@@ -0,0 +1,166 @@
+# Copyright (c) 2012-2013 Paul Tagliamonte <paultag@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+JSON-RPC 2.0 next to XML-RPC, on the same server and with the same methods.
+Calls are POSTed to JSON_PATH, faults keep their XML-RPC codes and dates
+are sent as "YYYY-MM-DDTHH:MM:SS" strings.
+"""
+
+from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
+
+from datetime import datetime
+
+import xmlrpclib
+import json
+import sys
+
+
+JSON_PATH = "/json"
+
+CAPABILITY = {
+    "specUrl": "http://www.jsonrpc.org/specification",
+    "specVersion": 2,
+}
+
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        return obj.strftime("%Y-%m-%dT%H:%M:%S")
+    if isinstance(obj, xmlrpclib.DateTime):
+        return datetime.strptime(obj.value, "%Y%m%dT%H:%M:%S").strftime(
+            "%Y-%m-%dT%H:%M:%S")
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+def dumps(obj):
+    return json.dumps(obj, default=_default, separators=(',', ':'))
+
+
+def dumps_request(method, params, id=None):
+    return dumps({"jsonrpc": "2.0", "method": method, "params": params,
+                  "id": id})
+
+
+def loads_response(data):
+    """
+    Returns the result of a JSON-RPC response, or raises its error as an
+    xmlrpclib.Fault.
+    """
+    response = json.loads(data)
+    error = response.get("error")
+    if error is not None:
+        raise xmlrpclib.Fault(error["code"], error["message"])
+    return response["result"]
+
+
+class JSONRPCRequestHandlerMixIn(SimpleXMLRPCRequestHandler):
+    """
+    Serves the methods of the server's XML-RPC dispatcher to JSON-RPC calls
+    POSTed to JSON_PATH.
+    """
+
+    def do_POST(self):
+        if self.path != JSON_PATH:
+            return SimpleXMLRPCRequestHandler.do_POST(self)
+
+        try:
+            length = int(self.headers["content-length"])
+            request = json.loads(self.rfile.read(length))
+            id = request.get("id")
+        except Exception:
+            self.send_response(400)
+            self.send_header("Content-length", "0")
+            self.end_headers()
+            return
+
+        # Like SimpleXMLRPCRequestHandler, let the handler override the
+        # dispatch of the server.
+        dispatch = getattr(self, '_dispatch', None) or self.server._dispatch
+        try:
+            result = dispatch(request["method"], request.get("params", []))
+            response = dumps({"jsonrpc": "2.0", "result": result, "id": id})
+        except xmlrpclib.Fault as fault:
+            response = dumps({"jsonrpc": "2.0", "id": id, "error": {
+                "code": fault.faultCode, "message": fault.faultString,
+            }})
+        except:
+            # Same as SimpleXMLRPCDispatcher._marshaled_dispatch().
+            exc_type, exc_value, exc_tb = sys.exc_info()
+            response = dumps({"jsonrpc": "2.0", "id": id, "error": {
+                "code": 1, "message": "%s:%s" % (exc_type, exc_value),
+            }})
+
+        self.send_response(200)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+
+class JSONTransportMixIn:
+    """
+    Makes an xmlrpclib transport carry JSON-RPC calls. Use with a
+    ServerProxy below.
+    """
+
+    def send_content(self, connection, request_body):
+        connection.putheader("Content-Type", "application/json")
+        connection.putheader("Content-Length", str(len(request_body)))
+        connection.endheaders(request_body)
+
+    def parse_response(self, response):
+        return loads_response(response.read())
+
+
+class _Method(object):
+    def __init__(self, send, name):
+        self._send = send
+        self._name = name
+
+    def __getattr__(self, name):
+        return _Method(self._send, "%s.%s" % (self._name, name))
+
+    def __call__(self, *args):
+        return self._send(self._name, args)
+
+
+class ServerProxy(object):
+    """
+    Like xmlrpclib.ServerProxy, for a server with a JSONRPCRequestHandler.
+    `uri` is the address of the server, without JSON_PATH.
+    """
+
+    def __init__(self, uri, transport):
+        scheme, rest = uri.split("://", 1)
+        self._host = rest.split("/", 1)[0]
+        self._transport = transport
+
+    def _request(self, method, params):
+        return self._transport.request(self._host, JSON_PATH,
+                                       dumps_request(method, params))
+
+    def __call__(self, attr):
+        if attr == "transport":
+            return self._transport
+        raise AttributeError("Attribute %r not found" % (attr,))
+
+    def __getattr__(self, name):
+        return _Method(self._request, name)
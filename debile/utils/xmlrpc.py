@@ -20,16 +20,29 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+from debile.utils import jsonrpc
+from debile.utils.jsonrpc import JSONTransportMixIn
+
 from fnmatch import fnmatch
 
 import xmlrpclib
 import httplib
 import socket
 import ssl
+import threading
 import os.path
 import os
 
 
+# Fault code of the master turning a request away because all of its workers
+# are busy. The request was not looked at, it is safe to send it again.
+BUSY_FAULT = 503
+
+
+def is_busy(error):
+    return isinstance(error, xmlrpclib.Fault) and error.faultCode == BUSY_FAULT
+
+
 def get_host_list(cert):
     if 'subjectAltName' in cert:
         return [x[1] for x in cert['subjectAltName'] if x[0] == 'DNS']
@@ -45,12 +58,24 @@ def validate(cert, hostname):
     return False
 
 
+def client_context(key_file, cert_file, ca_certs):
+    """
+    TLS 1.2 or later, with the default ciphers of the ssl module. The
+    hostname is checked by validate(), which also knows about wildcards.
+    """
+    context = ssl.create_default_context(cafile=ca_certs)
+    context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
+    context.check_hostname = False
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+
 class DebileHTTPSConnection(httplib.HTTPSConnection):
     def __init__(
         self, host, port=None,
         key_file=None, cert_file=None, ca_certs=None,
         strict=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
-        source_address=None
+        source_address=None, context=None
     ):
         if not (os.path.isfile(cert_file) and os.access(cert_file, os.R_OK)):
             raise Exception("Could not find/access " + cert_file)
@@ -68,6 +93,8 @@ class DebileHTTPSConnection(httplib.HTTPSConnection):
             source_address=source_address
         )
         self.ca_certs = ca_certs
+        self.context = context or client_context(key_file, cert_file,
+                                                 ca_certs)
 
     def connect(self):
         sock = socket.create_connection(
@@ -78,13 +105,8 @@ class DebileHTTPSConnection(httplib.HTTPSConnection):
             self.sock = sock
             self._tunnel()
 
-        cert_reqs = (ssl.CERT_NONE if self.ca_certs is None
-                     else ssl.CERT_REQUIRED)
-
-        self.sock = ssl.wrap_socket(
-            sock, self.key_file, self.cert_file,
-            ca_certs=self.ca_certs, cert_reqs=cert_reqs,
-            do_handshake_on_connect=True, ssl_version=ssl.PROTOCOL_TLSv1,
+        self.sock = self.context.wrap_socket(
+            sock, do_handshake_on_connect=True,
         )
 
         if not validate(self.sock.getpeercert(), self.host):
@@ -93,12 +115,28 @@ class DebileHTTPSConnection(httplib.HTTPSConnection):
                             % self.host)
 
 
-class DebileSafeTransport(xmlrpclib.Transport):
+class DebileTransport(xmlrpclib.Transport):
+    """
+    Keeps its HTTP/1.1 connection to the master open between calls, and
+    can be shared between threads (one call at a time).
+    """
+
+    def __init__(self, *args, **kwargs):
+        xmlrpclib.Transport.__init__(self, *args, **kwargs)
+        self._lock = threading.Lock()
+
+    def request(self, *args, **kwargs):
+        with self._lock:
+            return xmlrpclib.Transport.request(self, *args, **kwargs)
+
+
+class DebileSafeTransport(DebileTransport):
     def __init__(self, key_file=None, cert_file=None, ca_certs=None):
-        xmlrpclib.Transport.__init__(self)
+        DebileTransport.__init__(self)
         self.key_file = key_file
         self.cert_file = cert_file
         self.ca_certs = ca_certs
+        self._context = None
 
     def make_connection(self, host):
         host = (host, {
@@ -111,33 +149,60 @@ class DebileSafeTransport(xmlrpclib.Transport):
             return self._connection[1]
 
         chost, self._extra_headers, x509 = self.get_host_info(host)
-        self._connection = host, DebileHTTPSConnection(chost, None, timeout=60, **(x509 or {}))
+        x509 = x509 or {}
+        if self._context is None:
+            self._context = client_context(**x509)
+        self._connection = host, DebileHTTPSConnection(
+            chost, None, timeout=60, context=self._context, **x509)
 
         return self._connection[1]
 
 
-def get_proxy(config, auth_method):
+class DebileJSONTransport(JSONTransportMixIn, DebileTransport):
+    pass
+
+
+class DebileJSONSafeTransport(JSONTransportMixIn, DebileSafeTransport):
+    pass
+
+
+def get_proxy(config, auth_method='ssl'):
+    """
+    Returns a proxy to the master, speaking JSON-RPC if the master
+    advertises it and XML-RPC otherwise.
+    """
     xml = config.get("xmlrpc", None)
     if xml is None:
         raise Exception("No xmlrpc found in slave yaml")
 
-    proxy = None
     if auth_method == 'simple':
-        proxy = xmlrpclib.ServerProxy(
-            "http://{host}:{port}/".format(
-            host=xml['host'],
-            port=xml['port'],
-            ),
-            allow_none=True)
+        uri = "http://{host}:{port}/".format(host=xml['host'],
+                                             port=xml['port'])
+        transports = (DebileTransport, DebileJSONTransport)
+        kwargs = {}
 
     else:
-        proxy = xmlrpclib.ServerProxy(
-        "https://{host}:{port}/".format(
-            host=xml['host'],
-            port=xml['port'],
-        ), transport=DebileSafeTransport(
-            key_file=xml.get('keyfile', None),
-            cert_file=xml.get('certfile', None),
-            ca_certs=xml.get('ca_certs', "/etc/ssl/certs/ca-certificates.crt")
-        ), allow_none=True)
+        uri = "https://{host}:{port}/".format(host=xml['host'],
+                                              port=xml['port'])
+        transports = (DebileSafeTransport, DebileJSONSafeTransport)
+        kwargs = {
+            'key_file': xml.get('keyfile', None),
+            'cert_file': xml.get('certfile', None),
+            'ca_certs': xml.get('ca_certs',
+                                "/etc/ssl/certs/ca-certificates.crt"),
+        }
+
+    proxy = xmlrpclib.ServerProxy(uri, transport=transports[0](**kwargs),
+                                  allow_none=True)
+    if xml.get('encoding', 'auto') != 'auto':
+        use_json = xml['encoding'] == 'json'
+    else:
+        try:
+            use_json = 'json-rpc' in proxy.system.getCapabilities()
+        except Exception:
+            # An older master, or none at all right now.
+            use_json = False
+
+    if use_json:
+        return jsonrpc.ServerProxy(uri, transport=transports[1](**kwargs))
     return proxy
@@ -38,6 +38,7 @@ flavors = {
         'console_scripts': [
             'debile-master = debile.master.cli:server',
             'debile-master-init = debile.master.cli:init',
+            'debile-master-upgrade = debile.master.cli:upgrade',
             'debile-incoming = debile.master.cli:process_incoming',
         ],
     }),  # Master config
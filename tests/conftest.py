@@ -0,0 +1,132 @@
+from debile.master.utils import config, session, _init_sqlalchemy
+from debile.master import lookup, metrics
+from debile.master.orm import (Person, Builder, Suite, Component, Arch, Check,
+                               Group, GroupSuite, Job, Base, create_source,
+                               create_jobs)
+from debile.master.server import (SimpleAuthXMLRPCServer,
+                                  SimpleAsyncXMLRPCServer)
+
+from datetime import datetime
+
+import pytest
+import shutil
+import tempfile
+import threading
+
+REPO = {
+    "repo_path": "/srv/debile/pool/{name}",
+    "repo_url": "http://localhost/debile/pool/{name}",
+    "files_path": "/srv/debile/files/{name}",
+    "files_url": "http://localhost/debile/files/{name}",
+}
+
+SOURCES = 50
+
+
+def _invalidate():
+    lookup.invalidate()
+    lookup.invalidate_principals()
+    metrics.invalidate()
+
+
+@pytest.fixture(scope="module")
+def database():
+    """
+    An empty SQLite database of its own for the tests of a module. The
+    config is put back as it was afterwards.
+    """
+    tmpdir = tempfile.mkdtemp()
+    saved = dict(config)
+    config['database'] = "sqlite:///%s/debile.db" % tmpdir
+    config.setdefault('repo', REPO)
+    _init_sqlalchemy(config)
+    _invalidate()
+
+    with session() as s:
+        Base.metadata.create_all(s.bind)
+
+    yield
+
+    config.clear()
+    config.update(saved)
+    _invalidate()
+    shutil.rmtree(tmpdir)
+
+
+@pytest.fixture(scope="module")
+def jobs(database):
+    """
+    SOURCES uploads to default/unstable, each with a build job for amd64,
+    and the builder "localhost" at 127.0.0.1 to take them. Returns the ids
+    of the jobs.
+    """
+    with session() as s:
+        user = Person(name="Test", email="test@example.org", ip="127.0.0.1")
+        s.add(Builder(name="localhost", maintainer=user, ip="127.0.0.1",
+                      last_ping=datetime.utcnow()))
+
+        gs = GroupSuite(group=Group(name="default", maintainer=user),
+                        suite=Suite(name="unstable"))
+        gs.components.append(Component(name="main"))
+        gs.arches.extend([Arch(name="source"), Arch(name="all"),
+                          Arch(name="amd64")])
+        gs.checks.append(Check(name="build", source=False, binary=False,
+                               build=True))
+        s.add(gs)
+
+        for i in range(SOURCES):
+            source = create_source({
+                "Source": "fnord%d" % i,
+                "Version": "1.0-1",
+                "Architecture": "any",
+                "Maintainer": "Test <test@example.org>",
+            }, gs, gs.components[0], user, ["amd64"], "any")
+            source.directory = "pool/main/f/fnord%d" % i
+            source.dsc_filename = "fnord%d_1.0-1.dsc" % i
+            create_jobs(source)
+            s.add(source)
+
+        s.flush()
+        return sorted(x for x, in s.query(Job.id))
+
+
+@pytest.fixture
+def ready_jobs(jobs):
+    """
+    The ids of `jobs`, all of them ready again.
+    """
+    with session() as s:
+        s.execute("UPDATE jobs SET state = 'ready', assigned_at = NULL, "
+                  "lease_expires_at = NULL, builder_id = NULL")
+    return jobs
+
+
+@pytest.fixture
+def start_server():
+    """
+    Returns a function starting a master serving `interface` in the
+    background, which returns the server and its URL. The servers still
+    running at the end of the test are shut down.
+    """
+    servers = []
+
+    def start(interface, workers, queue_size):
+        server = SimpleAuthXMLRPCServer(("127.0.0.1", 0),
+                                        requestHandler=SimpleAsyncXMLRPCServer,
+                                        allow_none=True)
+        server.workers = workers
+        server.queue_size = queue_size
+        server.register_function(server.get_server_stats)
+        server.register_function(server.get_stats)
+        server.register_instance(interface)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+        return server, "http://127.0.0.1:%d/" % server.server_address[1]
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,61 @@
+from debile.utils import checksums
+from debile.utils.checksums import ChecksumError, file_digests, validate
+from debile.utils.deb822 import Changes
+
+import hashlib
+import os
+import shutil
+import tempfile
+import pytest
+
+
+def setup_module():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+    for name, data in [("a.deb", "a" * 100000), ("b.deb", "b")]:
+        with open(os.path.join(tmpdir, name), "w") as f:
+            f.write(data)
+
+
+def teardown_module():
+    shutil.rmtree(tmpdir)
+
+
+def upload():
+    changes = Changes()
+    for name in ["a.deb", "b.deb"]:
+        changes.add_file(os.path.join(tmpdir, name))
+    for field in ["Files", "Checksums-Sha1", "Checksums-Sha256"]:
+        for entry in changes[field]:
+            entry["name"] = os.path.basename(entry["name"])
+    return changes
+
+
+def test_file_digests():
+    assert file_digests(os.path.join(tmpdir, "b.deb")) == {
+        "md5": hashlib.md5("b").hexdigest(),
+        "sha1": hashlib.sha1("b").hexdigest(),
+        "sha256": hashlib.sha256("b").hexdigest(),
+    }
+
+
+def test_validate(monkeypatch):
+    changes = upload()
+    validate(changes, tmpdir, "sha256")
+
+    # Big uploads are hashed by a thread pool, with the same results.
+    monkeypatch.setattr(checksums, "PARALLEL_THRESHOLD", 0)
+    validate(changes, tmpdir, "sha256")
+
+    changes["Checksums-Sha1"][1]["sha1"] = "0" * 40
+    with pytest.raises(ChecksumError) as e:
+        validate(changes, tmpdir)
+    assert str(e.value).startswith("Checksum mismatch for file %s" %
+                                   os.path.join(tmpdir, "b.deb"))
+
+    del changes["Checksums-Sha1"]
+    del changes["Checksums-Sha256"][0]
+    validate(changes, tmpdir)
+    with pytest.raises(ChecksumError) as e:
+        validate(changes, tmpdir, "sha256")
+    assert str(e.value) == "No sha256 checksum for file a.deb"
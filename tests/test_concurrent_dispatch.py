@@ -0,0 +1,244 @@
+from debile.master.utils import session
+from debile.master.orm import Builder, Job
+from debile.master import interface as interface_module
+from debile.master.interface import NAMESPACE, DebileMasterInterface
+from debile.master.dispatch import Dispatcher
+from debile.master.server import reap_expired_jobs
+
+from datetime import datetime, timedelta
+
+import threading
+import time
+import xmlrpclib
+
+SLAVES = 8
+
+
+def hammer(start_server, dispatcher, batch=None):
+    # SQLite can't have two writers, the jobs are still claimed by
+    # concurrent transactions with the database to ourselves.
+    server, url = start_server(DebileMasterInterface(dispatcher=dispatcher),
+                               1, SLAVES)
+    assigned = []
+    errors = []
+
+    def slave():
+        proxy = xmlrpclib.ServerProxy(url, allow_none=True)
+        try:
+            while True:
+                if batch is None:
+                    jobs = [proxy.get_next_job(["unstable"], ["main"],
+                                               ["amd64"], ["build"])]
+                else:
+                    jobs = proxy.get_next_jobs(["unstable"], ["main"],
+                                               ["amd64"], ["build"], batch)
+                jobs = [x for x in jobs if x is not None]
+                if not jobs:
+                    break
+                assigned.extend(x['id'] for x in jobs)
+        except Exception as e:
+            errors.append(e)
+
+    slaves = [threading.Thread(target=slave) for x in range(SLAVES)]
+    for x in slaves:
+        x.start()
+    for x in slaves:
+        x.join()
+
+    server.shutdown()
+    server.server_close()
+
+    assert errors == []
+    return assigned
+
+
+def test_concurrent_get_next_job(ready_jobs, start_server):
+    assert sorted(hammer(start_server, None)) == ready_jobs
+
+
+def test_concurrent_get_next_job_dispatcher(ready_jobs, start_server):
+    dispatcher = Dispatcher()
+    with session() as s:
+        dispatcher.rebuild(s)
+    assert sorted(hammer(start_server, dispatcher)) == ready_jobs
+
+
+def test_concurrent_get_next_jobs(ready_jobs, start_server):
+    assert sorted(hammer(start_server, None, batch=4)) == ready_jobs
+
+
+def test_claim_race(ready_jobs):
+    with session() as s:
+        job_id = s.query(Job.id).order_by(Job.id).first()[0]
+        s.execute("UPDATE jobs SET state = 'assigned' WHERE id != :id",
+                  {"id": job_id})
+
+    read = {"a": threading.Event(), "b": threading.Event()}
+    a_committed = threading.Event()
+    claims = []
+    results = {}
+
+    class RacingInterface(DebileMasterInterface):
+        def _claim_job(self, job_id):
+            name = threading.current_thread().name
+            # End the read so SQLite lets the other builder write, like a
+            # READ COMMITTED transaction would.
+            NAMESPACE.session.commit()
+            read[name].set()
+            for x in read.values():
+                assert x.wait(10)
+            # Both builders saw the job as ready, "b" only tries to take it
+            # once "a" has claimed it and committed.
+            if name == "b":
+                assert a_committed.wait(10)
+            job = DebileMasterInterface._claim_job(self, job_id)
+            claims.append((name, job_id, job is not None))
+            return job
+
+    interface = RacingInterface()
+
+    def builder():
+        name = threading.current_thread().name
+        with session() as s:
+            NAMESPACE.session = s
+            NAMESPACE.machine = s.query(Builder).one()
+            results[name] = [x.id for x in interface._query_jobs(
+                ["unstable"], ["main"], ["amd64"], ["build"], 1)]
+        if name == "a":
+            a_committed.set()
+
+    threads = [threading.Thread(target=builder, name=x) for x in "ab"]
+    for x in threads:
+        x.start()
+    for x in threads:
+        x.join()
+
+    # Exactly one of the conditional updates took the job.
+    assert claims == [("a", job_id, True), ("b", job_id, False)]
+    assert results == {"a": [job_id], "b": []}
+
+
+def test_expired_lease(ready_jobs):
+    interface = DebileMasterInterface(lease=timedelta(seconds=-1))
+    with session() as s:
+        NAMESPACE.session = s
+        NAMESPACE.machine = s.query(Builder).one()
+        job = interface.get_next_job(["unstable"], ["main"], ["amd64"],
+                                     ["build"])
+        # With a negative lease, even an extended lease is expired.
+        assert interface.heartbeat_job(job['id'])
+
+    assert reap_expired_jobs() == 1
+    assert reap_expired_jobs() == 0
+
+    with session() as s:
+        NAMESPACE.session = s
+        NAMESPACE.machine = s.query(Builder).one()
+        assert s.query(Job).get(job['id']).state == "ready"
+        assert not interface.heartbeat_job(job['id'])
+
+    NAMESPACE.session = None
+    NAMESPACE.machine = None
+
+
+def test_close_and_forfeit_jobs(ready_jobs, monkeypatch):
+    interface = DebileMasterInterface()
+    monkeypatch.setattr(interface_module, "MAX_JOBS_PER_CALL", 10)
+    with session() as s:
+        NAMESPACE.session = s
+        NAMESPACE.machine = s.query(Builder).one()
+        assert len(interface.get_next_jobs(["unstable"], ["main"], ["amd64"],
+                                           ["build"], 1000)) == 10
+        s.rollback()
+
+        a, b, c = [x['id'] for x in interface.get_next_jobs(
+            ["unstable"], ["main"], ["amd64"], ["build"], 3)]
+        # Reaped and handed to another builder in the meantime.
+        machine = NAMESPACE.machine
+        s.query(Job).get(b).builder = Builder(
+            name="other", maintainer=machine.maintainer, ip="127.0.0.2",
+            last_ping=datetime.utcnow())
+        assert interface.forfeit_jobs([a, b]) == [True, False]
+        assert interface.close_jobs([[b, False], [c, False]]) == [False,
+                                                                  True]
+        s.rollback()
+    NAMESPACE.session = None
+    NAMESPACE.machine = None
+
+
+def test_forfeit_wakes_long_poll(ready_jobs, start_server):
+    with session() as s:
+        s.execute("UPDATE jobs SET state = 'assigned', builder_id = "
+                  "(SELECT id FROM builders)")
+        job_id = s.query(Job.id).first()[0]
+
+    interface = DebileMasterInterface()
+    interface.recheck_interval = 30
+    server, url = start_server(interface, 1, 1)
+    result = {}
+
+    def waiter():
+        proxy = xmlrpclib.ServerProxy(url, allow_none=True)
+        result['job'] = proxy.get_next_job(["unstable"], ["main"], ["amd64"],
+                                           ["build"], 20)
+
+    thread = threading.Thread(target=waiter)
+    start = time.time()
+    thread.start()
+    time.sleep(0.5)
+
+    # The waiting call holds no worker.
+    stats = xmlrpclib.ServerProxy(url).get_server_stats()
+    assert stats["parked_requests"] == 1
+    assert stats["busy_workers"] == 1
+
+    with session() as s:
+        NAMESPACE.session = s
+        NAMESPACE.machine = s.query(Builder).one()
+        interface.forfeit_job(job_id)
+
+    thread.join()
+    NAMESPACE.session = None
+    NAMESPACE.machine = None
+    server.shutdown()
+    server.server_close()
+
+    assert result['job']['id'] == job_id
+    assert time.time() - start < 10
+
+
+def test_long_poll_timeout(ready_jobs, start_server):
+    with session() as s:
+        s.execute("UPDATE jobs SET state = 'assigned', builder_id = "
+                  "(SELECT id FROM builders)")
+
+    interface = DebileMasterInterface()
+    interface.recheck_interval = 0.2
+
+    # Outside of the server, there is nothing to park.
+    with session() as s:
+        NAMESPACE.session = s
+        NAMESPACE.machine = s.query(Builder).one()
+        start = time.time()
+        assert interface.get_next_job(["unstable"], ["main"], ["amd64"],
+                                      ["build"], 20) is None
+        assert time.time() - start < 1
+    NAMESPACE.session = None
+    NAMESPACE.machine = None
+
+    server, url = start_server(interface, 0, 0)
+    proxy = xmlrpclib.ServerProxy(url, allow_none=True)
+    before = proxy.get_stats()["rpc"].get("get_next_job", {})
+    start = time.time()
+    assert proxy.get_next_job(["unstable"], ["main"], ["amd64"], ["build"],
+                              1) is None
+    assert 1 <= time.time() - start < 5
+    after = proxy.get_stats()["rpc"]["get_next_job"]
+
+    server.shutdown()
+    server.server_close()
+    # The tries made while parked count as one call, the wait apart.
+    assert after["calls"] == before.get("calls", 0) + 1
+    assert after["waits"] == before.get("waits", 0) + 1
+    assert after["wait_seconds"] - before.get("wait_seconds", 0) >= 0.9
+    assert after["seconds"] - before.get("seconds", 0) < 0.5
@@ -0,0 +1,24 @@
+from debile.master.dispatch import Dispatcher
+from datetime import datetime
+
+
+def test_dispatch_priority():
+    d = Dispatcher()
+    d.push(("unstable", "main", "amd64", "build"), (1, datetime(2014, 1, 1), 1))
+    d.push(("unstable", "main", "amd64", "build"), (0, datetime(2014, 1, 2), 2))
+    d.push(("unstable", "main", "amd64", "lintian"), (0, datetime(2014, 1, 1), 3))
+
+    assert list(d.candidates(["unstable"], ["main"], ["amd64"],
+                             ["build", "lintian"])) == [3, 2, 1]
+
+
+def test_dispatch_capabilities():
+    d = Dispatcher()
+    d.push(("unstable", "main", "amd64", "build"), (0, datetime(2014, 1, 1), 1))
+    d.push(("unstable", "main", "armhf", "build"), (0, datetime(2014, 1, 1), 2))
+    d.push(("testing", "main", "amd64", "build"), (0, datetime(2014, 1, 1), 3))
+
+    assert d.pop(["unstable"], ["main"], ["armhf"], ["build"]) == 2
+    assert d.pop(["unstable"], ["main"], ["armhf"], ["build"]) is None
+    assert d.pop(["unstable"], ["main"], ["amd64"], ["lintian"]) is None
+    assert d.pop(["unstable", "testing"], ["main"], ["amd64"], ["build"]) == 1
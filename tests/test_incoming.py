@@ -0,0 +1,131 @@
+from debile.master.utils import config, emit
+from debile.master import incoming, utils
+from debile.master.incoming import arrived
+
+import argparse
+import os
+import shutil
+import tempfile
+
+
+CHANGES = """Format: 1.8
+Source: fnord
+Version: 1.0-1
+Files:
+ d41d8cd98f00b204e9800998ecf8427e 5 misc optional fnord_1.0-1.dsc
+ d41d8cd98f00b204e9800998ecf8427e 3 misc optional fnord_1.0.orig.tar.gz
+"""
+
+
+def setup_module():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(tmpdir)
+
+
+def write(name, data):
+    with open(os.path.join(tmpdir, name), "w") as f:
+        f.write(data)
+
+
+def test_arrived():
+    changes = os.path.join(tmpdir, "fnord_1.0-1_source.changes")
+    assert not arrived(changes)
+
+    write("fnord_1.0-1_source.changes", CHANGES)
+    assert not arrived(changes)
+    write("fnord_1.0-1.dsc", "dsc..")
+    write("fnord_1.0.orig.tar.gz", "t")
+    assert not arrived(changes)
+    write("fnord_1.0.orig.tar.gz", "tar")
+    assert arrived(changes)
+
+
+def fake_process_upload(args, config, path):
+    with open(os.path.join(tmpdir, "log"), "a") as f:
+        f.write(os.path.basename(path) + "\n")
+    emit('accept', 'fake', {"path": os.path.basename(path)})
+
+
+class FakeFedmsg(object):
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, modname, msg):
+        self.messages.append(msg["path"])
+
+
+def test_process_parallel(database, monkeypatch):
+    directory = os.path.join(tmpdir, "incoming")
+    os.mkdir(directory)
+    uploads = []
+    for group, name in [("a", "a1"), ("a", "a2"), ("b", "b1"), ("b", "b2"),
+                        (None, "c1")]:
+        uploads.append(name + ".changes")
+        with open(os.path.join(directory, uploads[-1]), "w") as f:
+            f.write(CHANGES)
+            if group is not None:
+                f.write("X-Debile-Group: %s\n" % group)
+    for i in range(5):
+        uploads.append("job%d.dud" % i)
+        open(os.path.join(directory, uploads[-1]), "w").close()
+
+    fedmsg = FakeFedmsg()
+    monkeypatch.setattr(incoming, "process_upload", fake_process_upload)
+    monkeypatch.setattr(utils, "fedmsg", fedmsg)
+
+    args = argparse.Namespace(directory=directory, group="default", jobs=3,
+                              dud=True, changes=True)
+    incoming.process_directory(args, config)
+
+    with open(os.path.join(tmpdir, "log")) as f:
+        log = f.read().split()
+    assert sorted(log) == sorted(uploads)
+    assert sorted(log[:5]) == sorted(uploads[:5])
+    assert log.index("a1.changes") < log.index("a2.changes")
+    assert log.index("b1.changes") < log.index("b2.changes")
+    assert sorted(fedmsg.messages) == sorted(uploads)
+
+
+def test_scan(monkeypatch):
+    directory = os.path.join(tmpdir, "scan")
+    os.mkdir(directory)
+    for name in ["good", "bad", "partial"]:
+        with open(os.path.join(directory, name + ".changes"), "w") as f:
+            f.write(CHANGES)
+    processed = []
+
+    def process_upload(args, config, path):
+        name = os.path.basename(path)
+        processed.append(name)
+        if name == "bad.changes":
+            raise ValueError("bad upload")
+        os.unlink(path)
+
+    monkeypatch.setattr(incoming, "process_upload", process_upload)
+    monkeypatch.setattr(incoming, "verify_many", lambda paths, keyring: None)
+    partial = os.path.join(directory, "partial.changes")
+    monkeypatch.setattr(incoming, "arrived", lambda path: path != partial)
+
+    args = argparse.Namespace(directory=directory, group="default", jobs=1,
+                              dud=True, changes=True)
+    conf = {"keyrings": {"pgp": None}}
+    failures = {}
+    incoming._scan(args, conf, failures)
+    assert processed == ["bad.changes", "good.changes"]
+    assert failures.keys() == [os.path.join(directory, "bad.changes")]
+
+    # The failed upload is left alone until it changes.
+    incoming._scan(args, conf, failures)
+    assert processed == ["bad.changes", "good.changes"]
+    bad = os.path.join(directory, "bad.changes")
+    os.utime(bad, (0, 0))
+    incoming._scan(args, conf, failures)
+    assert processed == ["bad.changes", "good.changes", "bad.changes"]
+
+    os.unlink(bad)
+    incoming._scan(args, conf, failures)
+    assert failures == {}
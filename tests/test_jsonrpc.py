@@ -0,0 +1,31 @@
+from debile.master.interface import DebileMasterInterface
+from debile.master.server import get_capabilities
+from debile.utils import jsonrpc
+from debile.utils.xmlrpc import get_proxy
+
+import xmlrpclib
+
+
+def test_json_rpc(ready_jobs, start_server):
+    server, url = start_server(DebileMasterInterface(), 2, 2)
+    server.register_function(get_capabilities, "system.getCapabilities")
+    host, port = server.server_address
+
+    proxy = get_proxy({"xmlrpc": {"host": host, "port": port}}, "simple")
+    assert isinstance(proxy, jsonrpc.ServerProxy)
+    job = proxy.get_next_job(["unstable"], ["main"], ["amd64"], ["build"])
+    assert job["check"] == "build"
+    assert job["assigned_at"] is not None
+
+    try:
+        proxy.forfeit_job(-1)
+        assert False, "forfeit_job should fail"
+    except xmlrpclib.Fault as e:
+        assert e.faultCode == 1
+
+    xml = get_proxy({"xmlrpc": {"host": host, "port": port,
+                                "encoding": "xml"}}, "simple")
+    assert xml.get_job(job["id"])["id"] == job["id"]
+
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,82 @@
+from debile.master.interface import DebileMasterInterface
+from debile.utils import jsonrpc
+from debile.utils.xmlrpc import DebileTransport, DebileJSONTransport, is_busy
+
+import pytest
+import threading
+import time
+import xmlrpclib
+
+# The builder the requests are authenticated as.
+pytestmark = pytest.mark.usefixtures("jobs")
+
+
+def test_server_busy(start_server):
+    server, url = start_server(DebileMasterInterface(), 1, 1)
+    server.register_function(time.sleep, "sleep")
+    result = {}
+
+    def call(name, *args):
+        try:
+            result[name] = getattr(xmlrpclib.ServerProxy(url, allow_none=True),
+                                   name)(*args)
+        except Exception as e:
+            result[name] = e
+
+    # One call keeps the worker busy, one waits in the queue.
+    sleeper = threading.Thread(target=call, args=("sleep", 2))
+    sleeper.start()
+    time.sleep(0.5)
+    queued = threading.Thread(target=call, args=("get_server_stats",))
+    queued.start()
+    time.sleep(0.5)
+
+    try:
+        xmlrpclib.ServerProxy(url).get_server_stats()
+        assert False, "The master should be busy"
+    except xmlrpclib.Fault as e:
+        assert is_busy(e)
+
+    try:
+        jsonrpc.ServerProxy(url, DebileJSONTransport()).get_server_stats()
+        assert False, "The master should be busy"
+    except xmlrpclib.Fault as e:
+        assert is_busy(e)
+
+    sleeper.join()
+    queued.join()
+    server.shutdown()
+    server.server_close()
+
+    assert result["sleep"] is None
+    stats = result["get_server_stats"]
+    # The sleeper's connection might be closed already, or not.
+    del stats["idle_connections"]
+    assert stats == {
+        "workers": 1, "busy_workers": 1, "queue_size": 1, "queue_length": 0,
+        "parked_requests": 0, "handled": 1, "rejected": 2,
+    }
+
+
+def test_keepalive(start_server):
+    server, url = start_server(DebileMasterInterface(), 1, 1)
+    proxy = xmlrpclib.ServerProxy(url, transport=DebileTransport(),
+                                  allow_none=True)
+    proxy.get_server_stats()
+    sock = proxy("transport")._connection[1].sock
+    # Let the worker put the connection aside.
+    time.sleep(0.1)
+
+    # The idle connection does not hold the only worker.
+    other = xmlrpclib.ServerProxy(url, transport=DebileTransport())
+    stats = other.get_server_stats()
+    assert stats["rejected"] == 0
+    assert stats["idle_connections"] == 1
+
+    stats = proxy.get_server_stats()
+    assert proxy("transport")._connection[1].sock is sock
+
+    server.shutdown()
+    server.server_close()
+    assert stats["handled"] in (1, 2)
+    assert stats["busy_workers"] == 1
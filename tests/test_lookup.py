@@ -0,0 +1,96 @@
+from debile.master.utils import session
+from debile.master import lookup
+from debile.master.orm import Arch
+
+from sqlalchemy import event
+from sqlalchemy.orm.exc import NoResultFound
+
+import pytest
+
+
+@pytest.fixture(scope="module", autouse=True)
+def arches(database):
+    with session() as s:
+        s.add(Arch(name="amd64"))
+        s.add(Arch(name="i386"))
+
+
+def test_ids():
+    with session() as s:
+        amd64 = s.query(Arch).filter_by(name="amd64").one().id
+        i386 = s.query(Arch).filter_by(name="i386").one().id
+
+        assert sorted(lookup.ids(s, Arch, ["amd64", "i386"])) == sorted(
+            [amd64, i386])
+        # Unknown names are left out, and remembered as unknown until the
+        # cache is invalidated.
+        assert lookup.ids(s, Arch, ["amd64", "armhf"]) == [amd64]
+        assert lookup.ids(s, Arch, []) == []
+
+        armhf = Arch(name="armhf")
+        s.add(armhf)
+        s.flush()
+        assert lookup.ids(s, Arch, ["armhf"]) == []
+        lookup.invalidate()
+        assert lookup.ids(s, Arch, ["armhf"]) == [armhf.id]
+        s.rollback()
+    lookup.invalidate()
+
+
+def test_ids_unknown_cached():
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with session() as s:
+        assert lookup.ids(s, Arch, ["armhf"]) == []
+        event.listen(s.bind, "before_cursor_execute", count)
+        try:
+            assert lookup.ids(s, Arch, ["armhf"]) == []
+            with pytest.raises(NoResultFound):
+                lookup.get(s, Arch, "armhf")
+        finally:
+            event.remove(s.bind, "before_cursor_execute", count)
+        assert statements == []
+    lookup.invalidate()
+
+
+def test_invalidate_after_commit():
+    with session() as s:
+        s.add(Arch(name="armhf"))
+        lookup.invalidate(s)
+
+        # Another session looks it up before the commit.
+        with session() as other:
+            assert lookup.ids(other, Arch, ["armhf"]) == []
+
+    with session() as s:
+        armhf = s.query(Arch).filter_by(name="armhf").one()
+        assert lookup.ids(s, Arch, ["armhf"]) == [armhf.id]
+        s.delete(armhf)
+    lookup.invalidate()
+
+
+def test_ids_cached():
+    with session() as s:
+        amd64 = lookup.get(s, Arch, "amd64")
+        assert amd64.name == "amd64"
+
+        # The cache doesn't see the rename until it is invalidated.
+        amd64.name = "x86_64"
+        s.flush()
+        assert lookup.ids(s, Arch, ["amd64"]) == [amd64.id]
+        assert lookup.ids(s, Arch, ["x86_64"]) == [amd64.id]
+
+        lookup.invalidate()
+        assert lookup.ids(s, Arch, ["amd64"]) == []
+        assert lookup.get(s, Arch, "x86_64") is amd64
+        s.rollback()
+    lookup.invalidate()
+
+
+def test_get_unknown():
+    with session() as s:
+        with pytest.raises(NoResultFound):
+            lookup.get(s, Arch, "armhf")
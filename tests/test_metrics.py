@@ -0,0 +1,146 @@
+from debile.master.utils import session
+from debile.master import metrics
+from debile.master.interface import LongPoll
+from debile.master.orm import (Person, Builder, Suite, Component, Arch, Check,
+                               Group, GroupSuite, create_source, create_jobs)
+
+from datetime import datetime, timedelta
+
+import pstats
+import pytest
+import threading
+import time
+
+
+@pytest.fixture(scope="module", autouse=True)
+def sources(database):
+    with session() as s:
+        user = Person(name="Test", email="test@example.org")
+        s.add(Builder(name="builder", maintainer=user,
+                      last_ping=datetime.utcnow() - timedelta(minutes=5)))
+        gs = GroupSuite(group=Group(name="default", maintainer=user),
+                        suite=Suite(name="unstable"))
+        gs.components.append(Component(name="main"))
+        gs.arches.extend([Arch(name="source"), Arch(name="all"),
+                          Arch(name="amd64")])
+        gs.checks.extend([
+            Check(name="build", source=False, binary=False, build=True),
+            Check(name="lintian", source=True, binary=True, build=False),
+        ])
+        s.add(gs)
+
+        for i in range(3):
+            source = create_source({
+                "Source": "fnord%d" % i,
+                "Version": "1.0-1",
+                "Architecture": "any",
+                "Maintainer": "Test <test@example.org>",
+            }, gs, gs.components[0], user, ["amd64"], "any")
+            source.directory = "pool/main/f/fnord"
+            source.dsc_filename = "fnord%d_1.0-1.dsc" % i
+            create_jobs(source)
+            s.add(source)
+
+
+def test_histogram():
+    histogram = metrics.Histogram((1, 2))
+    for value in [0.5, 1, 1.5, 3]:
+        histogram.observe(value)
+    assert list(histogram.cumulative()) == [(1, 2), (2, 3), ("+Inf", 4)]
+    assert histogram.sum == 6
+
+
+def test_stats():
+    metrics.install()
+    with metrics.rpc("test_method"):
+        with session() as s:
+            s.query(Builder).all()
+    try:
+        with metrics.rpc("test_method"):
+            raise ValueError()
+    except ValueError:
+        pass
+
+    stats = metrics.get_stats()
+    assert stats["rpc"]["test_method"]["calls"] == 2
+    assert stats["rpc"]["test_method"]["errors"] == 1
+    # BEGIN and the SELECT.
+    assert stats["rpc"]["test_method"]["queries"] == 2
+    assert 290 < stats["builders"]["builder"] < 600
+    assert stats["uploads_last_hour"] == {"source": 3, "binary": 0}
+    assert sorted((x["check"], x["state"], x["count"])
+                  for x in stats["jobs"]) == [
+        ("build", "ready", 3), ("lintian", "blocked", 3),
+        ("lintian", "ready", 3)]
+
+
+def test_failed_statement():
+    metrics.install()
+    with session() as s:
+        with pytest.raises(Exception):
+            s.execute("SELECT * FROM no_such_table")
+        assert s.connection().info.get('query_start') == []
+        s.rollback()
+
+
+def test_long_poll_wait():
+    poll = LongPoll()
+    with metrics.rpc("long_poll", poll):
+        poll.park(None, 0, time.time() + 1)
+    time.sleep(0.2)
+    # Made again by the server once it is due.
+    poll.recheck_at = None
+    with metrics.rpc("long_poll", poll):
+        pass
+
+    stats = metrics.get_stats()["rpc"]["long_poll"]
+    assert stats["calls"] == 1
+    assert stats["seconds"] < 0.1
+    assert stats["waits"] == 1
+    assert 0.2 <= stats["wait_seconds"] < 1
+    assert 'debile_rpc_wait_seconds_count{method="long_poll"} 1.0' in \
+        metrics.render()
+
+
+def test_snapshot_cached():
+    taken_at = metrics.snapshot()["taken_at"]
+    text = metrics.render()
+    assert metrics.snapshot()["taken_at"] == taken_at
+
+    assert ('debile_jobs{arch="amd64",check="build",state="ready",'
+            'suite="unstable"} 3.0') in text
+    assert ('debile_rpc_duration_seconds_count{method="test_method"} 2.0'
+            in text)
+    assert 'debile_uploads_last_hour{kind="source"} 3.0' in text
+
+
+def test_slow_rpc(caplog):
+    metrics.SLOW_RPC = 0
+    try:
+        with metrics.rpc("slow_method"):
+            with session() as s:
+                s.query(Builder).all()
+                s.query(Person).all()
+    finally:
+        metrics.SLOW_RPC = None
+
+    messages = [x.getMessage() for x in caplog.records
+                if x.getMessage().startswith("Slow RPC slow_method")]
+    assert len(messages) == 1
+    assert "3 queries" in messages[0]
+    assert "FROM builders" in messages[0]
+    assert metrics.get_stats()["rpc"]["slow_method"]["sql_seconds"] > 0
+
+
+def test_profiling(tmpdir, monkeypatch):
+    monkeypatch.setattr(metrics, "PROFILE_PATH", str(tmpdir.join("rpc.prof")))
+    metrics.toggle_profiling()
+    with metrics.rpc("profiled"):
+        with metrics.rpc("nested"):
+            sum(range(1000))
+    metrics.toggle_profiling()
+
+    for thread in threading.enumerate():
+        if thread.name == "profile":
+            thread.join()
+    assert pstats.Stats(metrics.PROFILE_PATH).total_calls > 0
@@ -0,0 +1,40 @@
+from debile.master.interface import DebileMasterInterface
+
+import pytest
+import urllib2
+import xmlrpclib
+
+# The builder the requests are authenticated as, and jobs to count.
+pytestmark = pytest.mark.usefixtures("jobs")
+
+
+def test_metrics_endpoint(start_server):
+    server, url = start_server(DebileMasterInterface(), 2, 2)
+    response = urllib2.urlopen(url + "metrics").read()
+    stats = xmlrpclib.ServerProxy(url).get_server_stats()
+
+    try:
+        urllib2.urlopen(url + "nothing")
+        assert False, "Only /metrics should be served"
+    except urllib2.HTTPError as e:
+        assert e.code == 404
+
+    proxy = xmlrpclib.ServerProxy(url)
+    try:
+        proxy.no_such_method()
+        assert False, "no_such_method should fail"
+    except xmlrpclib.Fault:
+        pass
+    rpcs = proxy.get_stats()["rpc"]
+
+    server.shutdown()
+    server.server_close()
+    # Made up method names all go to one series.
+    assert "no_such_method" not in rpcs
+    assert rpcs["other"]["errors"] >= 1
+    assert rpcs["get_server_stats"]["calls"] >= 1
+    assert "# TYPE debile_jobs gauge" in response
+    assert "debile_server_busy_workers 1.0" in response
+    # The worker might still be counting the /metrics request as handled.
+    assert stats["handled"] in (0, 1)
+    assert stats["busy_workers"] in (1, 2)
@@ -0,0 +1,32 @@
+from debile.master.utils import session
+from debile.master.orm import Job
+from debile.master.interface import DebileMasterInterface
+
+import xmlrpclib
+
+
+def test_multicall(ready_jobs, start_server):
+    server, url = start_server(DebileMasterInterface(), 2, 2)
+    server.register_multicall_functions()
+    proxy = xmlrpclib.ServerProxy(url, allow_none=True)
+    job = proxy.get_next_job(["unstable"], ["main"], ["amd64"], ["build"])
+
+    multicall = xmlrpclib.MultiCall(proxy)
+    multicall.forfeit_job(-1)
+    multicall.forfeit_job(job["id"])
+    multicall.get_job(job["id"])
+    results = multicall()
+
+    server.shutdown()
+    server.server_close()
+
+    try:
+        results[0]
+        assert False, "forfeit_job should fail"
+    except xmlrpclib.Fault as e:
+        assert e.faultCode == 1
+    assert results[1] is True
+    assert results[2]["assigned_at"] is None
+
+    with session() as s:
+        assert s.query(Job).get(job["id"]).state == "ready"
@@ -0,0 +1,81 @@
+from debile.master.utils import session
+from debile.master import lookup
+from debile.master.orm import Person, Builder
+
+from datetime import datetime
+
+import pytest
+import time
+
+
+@pytest.fixture(scope="module", autouse=True)
+def principals(database):
+    with session() as s:
+        user = Person(name="Test", email="test@example.org", ssl="AB")
+        s.add(Builder(name="builder", maintainer=user, ssl="CD",
+                      last_ping=datetime.utcnow()))
+
+
+def authenticate(fingerprint, loads):
+    with session() as s:
+        def load():
+            loads.append(fingerprint)
+            return (s.query(Builder).filter_by(ssl=fingerprint).first(),
+                    s.query(Person).filter_by(ssl=fingerprint).first())
+
+        builder, user = lookup.principals(s, ("ssl", fingerprint), load)
+        if builder is not None:
+            builder.last_ping = datetime.utcnow()
+        return (builder and builder.name, user and user.name,
+                builder and builder.maintainer.name)
+
+
+def test_principals_cached():
+    loads = []
+    assert authenticate("CD", loads) == ("builder", None, "Test")
+    assert authenticate("CD", loads) == ("builder", None, "Test")
+    assert authenticate("AB", loads)[1] == "Test"
+    assert loads == ["CD", "AB"]
+
+    # Unknown keys are never cached.
+    assert authenticate("EF", loads) == (None, None, None)
+    assert authenticate("EF", loads) == (None, None, None)
+    assert loads == ["CD", "AB", "EF", "EF"]
+
+
+def test_principals_revoked():
+    loads = []
+    assert authenticate("CD", loads)[0] == "builder"
+
+    with session() as s:
+        lookup.invalidate_principals(s)
+        # Not committed yet, this must not end up in the cache. The ping
+        # is written before this session reads anything: SQLite makes a
+        # writer wait for the transactions that have read the database.
+        assert authenticate("CD", loads)[0] == "builder"
+        s.query(Builder).one().ssl = "DEADBEEF"
+
+    assert authenticate("CD", loads) == (None, None, None)
+    assert authenticate("DEADBEEF", loads)[0] == "builder"
+
+
+def test_principals_expire():
+    loads = []
+    ttl = lookup.PRINCIPAL_TTL
+    lookup.invalidate_principals()
+    try:
+        lookup.PRINCIPAL_TTL = 0.5
+        assert authenticate("AB", loads)[1] == "Test"
+        assert authenticate("AB", loads)[1] == "Test"
+        assert loads == ["AB"]
+        time.sleep(0.6)
+        assert authenticate("AB", loads)[1] == "Test"
+        assert loads == ["AB", "AB"]
+
+        # 0 turns the cache off.
+        lookup.PRINCIPAL_TTL = 0
+        assert authenticate("AB", loads)[1] == "Test"
+        assert authenticate("AB", loads)[1] == "Test"
+        assert loads == ["AB", "AB", "AB", "AB"]
+    finally:
+        lookup.PRINCIPAL_TTL = ttl
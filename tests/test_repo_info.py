@@ -1,4 +1,4 @@
-from debile.master.orm import Group
+from debile.master.orm import Group, invalidate_repo_info
 from debile.master.utils import init_master
 
 config = init_master()
@@ -50,3 +50,26 @@ def test_repo_props():
     assert g.files_url == "http://localhost/debile/files/foo"
 
     config['repo'] = c
+
+
+resolved = []
+
+
+def counting_resolver(group, conf):
+    resolved.append(group.name)
+    return {"repo_path": "/srv/%s" % group.name, "repo_url": "url"}
+
+
+def test_repo_info_cached():
+    c = config['repo']
+    config['repo'] = {
+        "custom_resolver": "%s.counting_resolver" % (__name__)
+    }
+    assert g.repo_path == "/srv/foo"
+    assert g.repo_url == "url"
+    assert resolved == ["foo"]
+
+    invalidate_repo_info()
+    assert g.repo_path == "/srv/foo"
+    assert resolved == ["foo", "foo"]
+    config['repo'] = c
@@ -0,0 +1,170 @@
+from debile.master.utils import session
+from debile.master import interface
+from debile.master.orm import (Person, Suite, Component, Arch, Check, Group,
+                               GroupSuite, Job, create_source, create_jobs)
+from debile.master.interface import NAMESPACE, DebileMasterInterface
+from debile.master.dispatch import Dispatcher
+
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture(scope="module", autouse=True)
+def sources(database):
+    with session() as s:
+        user = Person(name="Test", email="test@example.org", ip="127.0.0.1")
+        gs = GroupSuite(group=Group(name="default", maintainer=user),
+                        suite=Suite(name="unstable"))
+        gs.components.append(Component(name="main"))
+        gs.arches.extend([Arch(name="source"), Arch(name="all"),
+                          Arch(name="amd64")])
+        gs.checks.extend([
+            Check(name="build", source=False, binary=False, build=True),
+            Check(name="lintian", source=True, binary=False, build=False),
+        ])
+        s.add(gs)
+
+        for i, version in enumerate(["1.0-1", "1.0-2", "1.0-1"]):
+            source = create_source({
+                "Source": "fnord%d" % (i // 2),
+                "Version": version,
+                "Architecture": "any",
+                "Maintainer": "Test <test@example.org>",
+            }, gs, gs.components[0], user, ["amd64"], "any")
+            source.directory = "pool/main/f/fnord"
+            source.dsc_filename = "fnord_%s.dsc" % version
+            create_jobs(source)
+            s.add(source)
+
+
+def finish_jobs():
+    with session() as s:
+        for job in s.query(Job):
+            job.finished_at = datetime.utcnow() - timedelta(days=1)
+            job.failed = job.check.name == "build"
+            job.update_state()
+
+
+def call(method, *args):
+    master = DebileMasterInterface()
+    with session() as s:
+        NAMESPACE.session = s
+        NAMESPACE.user = s.query(Person).one()
+        result = getattr(master, method)(*args)
+    NAMESPACE.session = None
+    NAMESPACE.user = None
+    return result
+
+
+def rerun(filter):
+    finish_jobs()
+    return call("rerun_jobs", filter)
+
+
+def finished_jobs():
+    with session() as s:
+        return sorted((x.source.version, x.check.name) for x in s.query(Job)
+                      if x.finished_at is not None)
+
+
+def test_rerun_jobs():
+    # fnord0 1.0-1 is superseded by fnord0 1.0-2.
+    assert rerun({}) == {"ready": 4, "blocked": 0}
+    assert rerun({"check": "lintian"}) == {"ready": 2, "blocked": 0}
+    assert rerun({"check": ["lintian", "build"],
+                  "failed": True}) == {"ready": 2, "blocked": 0}
+    assert rerun({"build": False, "suite": "unstable",
+                  "group": "default"}) == {"ready": 2, "blocked": 0}
+    assert rerun({"arch": "amd64"}) == {"ready": 2, "blocked": 0}
+    assert rerun({"finished_after": "2000-01-01",
+                  "finished_before": datetime.utcnow()}) == {"ready": 4,
+                                                              "blocked": 0}
+    assert rerun({"finished_after": datetime.utcnow()}) == {"ready": 0,
+                                                            "blocked": 0}
+
+
+def test_rerun_jobs_rollback():
+    # The chunks are not committed on their own, a failing multicall
+    # leaves the jobs alone.
+    finish_jobs()
+    before = finished_jobs()
+    chunk = interface.RERUN_CHUNK
+    interface.RERUN_CHUNK = 1
+    try:
+        with session() as s:
+            NAMESPACE.session = s
+            NAMESPACE.user = s.query(Person).one()
+            counts = DebileMasterInterface().rerun_jobs({})
+            s.rollback()
+    finally:
+        interface.RERUN_CHUNK = chunk
+        NAMESPACE.session = None
+        NAMESPACE.user = None
+    assert counts == {"ready": 4, "blocked": 0}
+    assert finished_jobs() == before
+
+
+class RebuildingDispatcher(Dispatcher):
+    # Rebuild right away instead of in the background thread.
+    def request_rebuild(self):
+        with session() as s:
+            self.rebuild(s)
+
+
+def test_rerun_jobs_dispatched():
+    finish_jobs()
+    dispatcher = RebuildingDispatcher()
+    notified = []
+    master = DebileMasterInterface(dispatcher=dispatcher)
+    master.notifier.listen(lambda: notified.append(True))
+    with session() as s:
+        NAMESPACE.session = s
+        NAMESPACE.user = s.query(Person).one()
+        assert master.rerun_jobs({"check": "lintian"})["ready"] == 2
+        assert notified == []
+    NAMESPACE.session = None
+    NAMESPACE.user = None
+
+    # Both only hear about the jobs once they are committed.
+    assert notified == [True]
+    assert len(list(dispatcher.candidates(["unstable"], ["main"], ["amd64"],
+                                          ["lintian"]))) == 2
+
+
+def test_rerun_check():
+    finish_jobs()
+    with session() as s:
+        # A job that is still running gets reset too.
+        job = s.query(Job).join(Job.check).filter(
+            Check.name == "lintian").order_by(Job.id.desc()).first()
+        job.finished_at = None
+        job.assigned_at = datetime.utcnow()
+        job.update_state()
+
+    assert call("rerun_check", "lintian") is None
+    assert finished_jobs() == [("1.0-1", "build"), ("1.0-1", "build"),
+                               ("1.0-1", "lintian"), ("1.0-2", "build")]
+    with session() as s:
+        assert [x.state for x in s.query(Job).join(Job.check).filter(
+            Check.name == "lintian", Job.finished_at == None)] == ["ready",
+                                                                  "ready"]
+
+
+def test_retry_failed():
+    finish_jobs()
+    assert call("retry_failed") is None
+    assert finished_jobs() == [("1.0-1", "build"), ("1.0-1", "lintian"),
+                               ("1.0-1", "lintian"), ("1.0-2", "lintian")]
+
+
+def test_initial_job_state():
+    with session() as s:
+        source = s.query(Job).first().source
+        job = Job(check=s.query(Check).filter_by(name="lintian").one(),
+                  arch=source.affinity, source=source, binary=None)
+        s.add(job)
+        s.flush()
+        # Without an update_state() call, the job is still dispatched.
+        assert job.state == "ready"
+        s.delete(job)
@@ -0,0 +1,141 @@
+from debile.master.utils import session
+from debile.master.orm import (Person, Builder, Suite, Component, Arch, Check,
+                               Group, GroupSuite, Source, Job, create_source,
+                               create_jobs)
+from debile.master.interface import NAMESPACE, DebileMasterInterface
+from debile.master.scheduler import (get_policy, DefaultPolicy,
+                                     FairSharePolicy)
+
+from sqlalchemy import event
+
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture(scope="module", autouse=True)
+def sources(database):
+    with session() as s:
+        user = Person(name="Test", email="test@example.org", ip="127.0.0.1")
+        s.add(Builder(name="localhost", maintainer=user, ip="127.0.0.1",
+                      last_ping=datetime.utcnow()))
+
+        unstable = Suite(name="unstable")
+        main = Component(name="main")
+        arches = [Arch(name="source"), Arch(name="all"), Arch(name="amd64")]
+        build = Check(name="build", source=False, binary=False, build=True)
+
+        # The "rebuild" group has a lot of old uploads, "uploads" a few
+        # recent ones.
+        uploaded_at = datetime.utcnow() - timedelta(days=1)
+        for name, count in [("rebuild", 10), ("uploads", 2)]:
+            gs = GroupSuite(group=Group(name=name, maintainer=user),
+                            suite=unstable)
+            gs.components.append(main)
+            gs.arches.extend(arches)
+            gs.checks.append(build)
+            s.add(gs)
+
+            for i in range(count):
+                source = create_source({
+                    "Source": "%s%d" % (name, i),
+                    "Version": "1.0-1",
+                    "Architecture": "any",
+                    "Maintainer": "Test <test@example.org>",
+                }, gs, main, user, ["amd64"], "any")
+                source.directory = "pool/main/%s" % name
+                source.dsc_filename = "%s%d_1.0-1.dsc" % (name, i)
+                source.uploaded_at = uploaded_at
+                uploaded_at += timedelta(minutes=1)
+                create_jobs(source)
+                s.add(source)
+
+
+def assign(policy, count):
+    interface = DebileMasterInterface(policy=policy)
+    with session() as s:
+        NAMESPACE.session = s
+        NAMESPACE.machine = s.query(Builder).one()
+        jobs = [interface.get_next_job(["unstable"], ["main"], ["amd64"],
+                                       ["build"]) for x in range(count)]
+        s.rollback()
+    NAMESPACE.session = None
+    NAMESPACE.machine = None
+    return [x['group'] for x in jobs]
+
+
+def test_get_policy():
+    assert isinstance(get_policy(None), DefaultPolicy)
+    assert isinstance(get_policy({"policy": "fair-share"}), FairSharePolicy)
+    assert isinstance(get_policy({
+        "policy": "debile.master.scheduler.FairSharePolicy",
+    }), FairSharePolicy)
+
+
+def test_default_policy():
+    assert assign(None, 3) == ["rebuild", "rebuild", "rebuild"]
+
+
+def test_fair_share():
+    policy = FairSharePolicy({"aging": 0})
+    assert assign(policy, 4) == ["rebuild", "uploads", "rebuild", "uploads"]
+
+
+def test_fair_share_aging():
+    # Both have waited for a day, which only counts until they are served.
+    policy = FairSharePolicy({"aging": 60})
+    assert assign(policy, 3) == ["rebuild", "uploads", "rebuild"]
+
+
+def test_fair_share_aging_no_starvation():
+    # The day old backlog of "rebuild" must not hold back the fresh uploads.
+    now = datetime.utcnow()
+    with session() as s:
+        uploads = s.query(Source).join(Source.group_suite).join(
+            GroupSuite.group).filter(Group.name == "uploads").all()
+        uploaded_at = dict((x.id, x.uploaded_at) for x in uploads)
+        for source in uploads:
+            source.uploaded_at = now
+
+    try:
+        policy = FairSharePolicy({"aging": 60})
+        assert assign(policy, 4) == ["rebuild", "uploads", "rebuild",
+                                     "uploads"]
+    finally:
+        with session() as s:
+            for source in s.query(Source).filter(
+                    Source.id.in_(uploaded_at.keys())):
+                source.uploaded_at = uploaded_at[source.id]
+
+
+def test_fair_share_weights():
+    policy = FairSharePolicy({"aging": 0, "weights": {"rebuild/unstable": 2}})
+    assert assign(policy, 3) == ["rebuild", "uploads", "rebuild"]
+
+    policy = FairSharePolicy({"aging": 0, "weights": {"unstable": 2,
+                                                      "rebuild/unstable": 1}})
+    assert assign(policy, 3) == ["rebuild", "uploads", "uploads"]
+
+
+def test_fair_share_queries():
+    policy = FairSharePolicy({"aging": 60})
+    assert assign(policy, 1) == ["rebuild"]
+
+    statements = []
+
+    def log(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with session() as s:
+        candidates = s.query(Job.id).join(Job.source).filter(
+            Job.state == "ready")
+        event.listen(s.bind, "before_cursor_execute", log)
+        try:
+            policy.group_suites(s, candidates)
+        finally:
+            event.remove(s.bind, "before_cursor_execute", log)
+
+    # The waiting uploads and the running jobs, the names are cached and
+    # when the group suites were served is kept in memory.
+    assert [x.split()[0] for x in statements] == ["BEGIN", "SELECT",
+                                                  "SELECT"]
@@ -0,0 +1,145 @@
+from debile.master import signatures
+from debile.master.signatures import verify, verify_many, SignatureError
+from debile.utils.commands import run_command
+
+from distutils.spawn import find_executable
+
+import os
+import shutil
+import tempfile
+import pytest
+
+pytestmark = pytest.mark.skipif(not find_executable("gpg"),
+                                reason="gpg is not installed")
+
+
+def setup_module():
+    global tmpdir, keyring, fingerprint
+    tmpdir = tempfile.mkdtemp()
+    home = os.path.join(tmpdir, "home")
+    os.mkdir(home, 0700)
+    keyring = os.path.join(tmpdir, "keyring.gpg")
+
+    gpg = ["gpg", "--batch", "--homedir", home, "--passphrase", ""]
+    run_command(gpg + ["--quick-gen-key", "Test <test@example.org>",
+                       "default", "default", "never"])
+    out, _, _ = run_command(gpg + ["--with-colons", "--list-keys"])
+    fingerprint = [x.split(":")[9] for x in out.split("\n")
+                   if x.startswith("fpr:")][0]
+    run_command(gpg + ["--export", "-o", keyring])
+
+    for name in ["good", "other"]:
+        path = os.path.join(tmpdir, name)
+        with open(path, "w") as f:
+            f.write("%s\n" % name)
+        run_command(gpg + ["--clearsign", "-o", path + ".asc", path])
+    with open(os.path.join(tmpdir, "other.asc")) as f:
+        data = f.read()
+    with open(os.path.join(tmpdir, "bad.asc"), "w") as f:
+        f.write(data.replace("other\n", "0ther\n"))
+    shutil.copy(os.path.join(tmpdir, "good"),
+                os.path.join(tmpdir, "unsigned.asc"))
+
+
+def teardown_module():
+    shutil.rmtree(tmpdir)
+
+
+def path(name):
+    return os.path.join(tmpdir, name + ".asc")
+
+
+def test_verify():
+    signatures.invalidate()
+    assert verify(path("good"), keyring) == fingerprint
+    for name, message in [("bad", "Bad signature"),
+                          ("unsigned", "No signature on")]:
+        with pytest.raises(SignatureError) as e:
+            verify(path(name), keyring)
+        assert str(e.value) == message
+
+
+def test_verify_many(monkeypatch):
+    signatures.invalidate()
+    calls = []
+    gpg = signatures._gpg
+
+    def counting_gpg(*args):
+        calls.append(args)
+        return gpg(*args)
+    monkeypatch.setattr(signatures, "_gpg", counting_gpg)
+
+    names = ["good", "unsigned", "bad", "other"]
+    results = verify_many([path(x) for x in names], keyring)
+    assert [results[path(x)] for x in names] == [
+        (fingerprint, None), (None, "No signature on"),
+        (None, "Bad signature"), (fingerprint, None)]
+    # gpg stops at the bad signature, the rest needs another run.
+    assert len(calls) == 2
+
+    assert verify(path("other"), keyring) == fingerprint
+    assert len(calls) == 2
+
+    # A changed keyring invalidates the results.
+    os.utime(keyring, (0, 0))
+    assert verify(path("other"), keyring) == fingerprint
+    assert len(calls) == 3
+
+
+def test_verify_swapped(monkeypatch):
+    signatures.invalidate()
+    swapped = os.path.join(tmpdir, "swapped.asc")
+    shutil.copy(path("good"), swapped)
+    gpg = signatures._gpg
+
+    def swapping_gpg(*args):
+        # The file is replaced once it was hashed, gpg must not see that.
+        shutil.copy(path("bad"), swapped)
+        return gpg(*args)
+    monkeypatch.setattr(signatures, "_gpg", swapping_gpg)
+
+    assert verify(swapped, keyring) == fingerprint
+    with pytest.raises(SignatureError) as e:
+        verify(swapped, keyring)
+    assert str(e.value) == "Bad signature"
+
+
+def test_verify_unknown_problem(monkeypatch):
+    signatures.invalidate()
+    calls = []
+    gpg = signatures._gpg
+
+    def failing_gpg(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            return None
+        return gpg(*args)
+    monkeypatch.setattr(signatures, "_gpg", failing_gpg)
+
+    with pytest.raises(SignatureError) as e:
+        verify(path("good"), keyring)
+    assert str(e.value) == signatures.UNKNOWN_PROBLEM
+    # gpg failing to run is not cached.
+    assert verify(path("good"), keyring) == fingerprint
+    assert verify(path("good"), keyring) == fingerprint
+    assert len(calls) == 2
+
+
+def test_verify_many_chunks(monkeypatch):
+    signatures.invalidate()
+    calls = []
+    gpg = signatures._gpg
+
+    def counting_gpg(*args):
+        calls.append(args)
+        return gpg(*args)
+    monkeypatch.setattr(signatures, "_gpg", counting_gpg)
+    monkeypatch.setattr(signatures, "GPG_BATCH", 2)
+
+    paths = []
+    for i in range(5):
+        paths.append(os.path.join(tmpdir, "copy%d.asc" % i))
+        shutil.copy(path("good"), paths[-1])
+    results = verify_many(paths, keyring)
+    assert [results[x] for x in paths] == [(fingerprint, None)] * 5
+    assert [len(x) - 2 for x in calls] == [2, 2, 1]
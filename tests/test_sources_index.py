@@ -0,0 +1,153 @@
+from debile.master import reprepro
+from debile.master.reprepro import Repo, RepoPackageNotFound
+
+from gzip import GzipFile
+
+import os
+import shutil
+import tempfile
+import pytest
+
+
+class Named(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class Source(object):
+    def __init__(self, name, version):
+        self.name = name
+        self.version = version
+        self.suite = Named("unstable")
+        self.component = Named("main")
+
+
+class Changes(dict):
+    def __init__(self, root, **kwargs):
+        super(Changes, self).__init__(**kwargs)
+        self.root = root
+
+    def get_changes_file(self):
+        return os.path.join(self.root, "upload.changes")
+
+    def get_dsc(self):
+        return os.path.join(self.root, "%s_%s.dsc" % (
+            self["Source"], self["Version"]))
+
+    def get_package_name(self):
+        return self["Source"]
+
+
+def write_sources(root, packages):
+    path = os.path.join(root, "dists/unstable/main/source")
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    with GzipFile(os.path.join(path, "Sources.gz.new"), "w") as f:
+        for name, version in packages:
+            f.write("Package: %s\nVersion: %s\nDirectory: %s\nFiles:\n"
+                    " 00000000000000000000000000000000 1 %s_%s.dsc\n\n" % (
+                        name, version, reprepro.pool_directory("main", name),
+                        name, version))
+    os.rename(os.path.join(path, "Sources.gz.new"),
+              os.path.join(path, "Sources.gz"))
+
+
+def setup_function(function):
+    global root
+    root = tempfile.mkdtemp()
+    write_sources(root, [("foo", "1.0-1"), ("libbar", "2.0")])
+
+
+def teardown_function(function):
+    shutil.rmtree(root)
+
+
+def test_find_dsc(monkeypatch):
+    repo = Repo(root)
+    assert repo.find_dsc(Source("foo", "1.0-1")) == (
+        "pool/main/f/foo", "foo_1.0-1.dsc")
+    with pytest.raises(RepoPackageNotFound):
+        repo.find_dsc(Source("foo", "0.9-1"))
+
+    # Lookups are answered from the index until Sources.gz changes.
+    def scan(path):
+        raise AssertionError("Sources.gz was parsed again")
+    monkeypatch.setattr(reprepro, "scan_sources", scan)
+    assert Repo(root).find_dsc(Source("libbar", "2.0")) == (
+        "pool/main/libb/libbar", "libbar_2.0.dsc")
+
+    monkeypatch.undo()
+    write_sources(root, [("foo", "1.1-1")])
+    assert repo.find_dsc(Source("foo", "1.1-1")) == (
+        "pool/main/f/foo", "foo_1.1-1.dsc")
+    with pytest.raises(RepoPackageNotFound):
+        repo.find_dsc(Source("libbar", "2.0"))
+
+
+def test_add_changes_updates_index(monkeypatch):
+    repo = Repo(root)
+    repo.find_dsc(Source("foo", "1.0-1"))
+
+    def include(distribution, changes):
+        write_sources(root, [("foo", "1.1-1"), ("libbar", "2.0")])
+        os.makedirs(os.path.join(root, "pool/main/f/foo"))
+        open(os.path.join(root, "pool/main/f/foo/foo_1.1-1.dsc"), "w").close()
+    monkeypatch.setattr(repo, "include", include)
+    repo.add_changes(Changes(root, distribution="unstable", Source="foo",
+                             Version="1.1-1"))
+
+    def scan(path):
+        raise AssertionError("Sources.gz was parsed again")
+    monkeypatch.setattr(reprepro, "scan_sources", scan)
+    assert repo.find_dsc(Source("foo", "1.1-1")) == (
+        "pool/main/f/foo", "foo_1.1-1.dsc")
+
+    monkeypatch.undo()
+    with pytest.raises(RepoPackageNotFound):
+        repo.find_dsc(Source("foo", "1.0-1"))
+
+
+def test_add_changes_other_writer(monkeypatch):
+    repo = Repo(root)
+    repo.find_dsc(Source("foo", "1.0-1"))
+
+    def include(distribution, changes):
+        # Another writer added baz along with the include.
+        write_sources(root, [("foo", "1.1-1"), ("libbar", "2.0"),
+                             ("baz", "1.0")])
+        os.makedirs(os.path.join(root, "pool/main/f/foo"))
+        open(os.path.join(root, "pool/main/f/foo/foo_1.1-1.dsc"), "w").close()
+    monkeypatch.setattr(repo, "include", include)
+    repo.add_changes(Changes(root, distribution="unstable", Source="foo",
+                             Version="1.1-1"))
+
+    # The index looks up to date, the miss rebuilds it.
+    assert repo.find_dsc(Source("baz", "1.0")) == (
+        "pool/main/b/baz", "baz_1.0.dsc")
+
+
+def test_add_changes_index_moved_on(monkeypatch):
+    repo = Repo(root)
+    repo.find_dsc(Source("foo", "1.0-1"))
+    sources = repo.sources_path("unstable", "main")
+
+    def include(distribution, changes):
+        # Somebody else indexed a change of another writer before ours.
+        write_sources(root, [("foo", "1.0-1"), ("libbar", "2.0"),
+                             ("baz", "1.0")])
+        os.utime(sources, (1, 1))
+        Repo(root).find_dsc(Source("baz", "1.0"))
+        write_sources(root, [("foo", "1.1-1"), ("libbar", "2.0"),
+                             ("baz", "1.0")])
+        os.makedirs(os.path.join(root, "pool/main/f/foo"))
+        open(os.path.join(root, "pool/main/f/foo/foo_1.1-1.dsc"), "w").close()
+    monkeypatch.setattr(repo, "include", include)
+    repo.add_changes(Changes(root, distribution="unstable", Source="foo",
+                             Version="1.1-1"))
+
+    # The index no longer was what the update was made against.
+    assert not repo.index.current("unstable", "main", sources)
+    assert repo.find_dsc(Source("foo", "1.1-1")) == (
+        "pool/main/f/foo", "foo_1.1-1.dsc")
+    assert repo.find_dsc(Source("baz", "1.0")) == (
+        "pool/main/b/baz", "baz_1.0.dsc")
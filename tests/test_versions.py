@@ -0,0 +1,50 @@
+from debile.master.versions import version_sort_key
+from debile.master.orm import Source
+
+from debian.debian_support import version_compare
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, select
+
+import itertools
+
+
+VERSIONS = [
+    "0", "1", "1.0", "1.0-0", "1.0-1", "1.0-1~bpo1", "1.0-1+b1", "1.0-1.1",
+    "1.0~rc1-1", "1.0~~-1", "1.0~-1", "1.0a-1", "1.0+dfsg-1", "1.0.0-1",
+    "1.00-1", "1.0-10", "1.0-2", "1:0.9-1", "2:0.1", "01:1.0-1", "1.0-a",
+    "1.0-~", "0~", "0.1", "a", "~", "1a", "1~", "1-1-1", "1.2-3-4~5",
+    "2.30+git20141216.a1b2c3d-1ubuntu1", "10", "9", "1.0.",
+]
+
+
+def sign(x):
+    return (x > 0) - (x < 0)
+
+
+def test_version_sort_key():
+    for a, b in itertools.product(VERSIONS, repeat=2):
+        expected = sign(version_compare(a, b))
+        got = sign(cmp(version_sort_key(a), version_sort_key(b)))
+        assert got == expected, (a, b)
+
+
+def test_version_sort_key_column():
+    # The keys must survive the column type, and sort in the database as
+    # they do in python, even for the longest versions sources can have.
+    versions = VERSIONS + ["1." * 127 + "1", "1:" + "a1" * 126 + "-1"]
+    metadata = MetaData()
+    table = Table("versions", metadata,
+                  Column("id", Integer, primary_key=True),
+                  Column("key", Source.__table__.c.version_key.type))
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    engine.execute(table.insert(), [
+        {"id": id, "key": version_sort_key(version)}
+        for id, version in enumerate(versions)
+    ])
+
+    rows = engine.execute(select([table.c.id, table.c.key]).order_by(
+        table.c.key, table.c.id)).fetchall()
+    for id, key in rows:
+        assert key == version_sort_key(versions[id])
+    got = [versions[id] for id, key in rows]
+    assert got == sorted(versions, cmp=version_compare)